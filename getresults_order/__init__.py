@@ -0,0 +1 @@
+default_app_config = 'getresults_order.apps.AppConfig'
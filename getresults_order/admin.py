@@ -1,18 +1,74 @@
 from django.contrib import admin
+from django.db.models import Q
 
 from getresults.admin import admin_site
 
+from .choices import STATUS
 from .models import OrderPanel, OrderPanelItem, Utestid, Order
+from .paginator import EstimatedCountPaginator
+
+
+class LargeTableAdminMixin(object):
+    """Changelist options for large tables.
+
+    Uses an estimated count for the unfiltered changelist and skips the
+    count of all rows shown next to filtered results. Search fields
+    prefixed with ^ or = are searched with startswith or exact, so the
+    lookup can use an index. Identifier fields, stored in upper case, are
+    searched case sensitively on the upper case search term; other fields
+    with istartswith or iexact, which use the UPPER(name) indexes of
+    migration 0012.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    identifier_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        search_fields = self.get_search_fields(request)
+        if not search_term or not all(field[:1] in '^=' for field in search_fields):
+            return super(LargeTableAdminMixin, self).get_search_results(request, queryset, search_term)
+        search_term = search_term.strip()
+        lookups = Q()
+        for field in search_fields:
+            lookup = 'exact' if field[0] == '=' else 'startswith'
+            if field[1:] in self.identifier_search_fields:
+                lookups |= Q(**{'{}__{}'.format(field[1:], lookup): search_term.upper()})
+            else:
+                lookups |= Q(**{'{}__i{}'.format(field[1:], lookup): search_term})
+        return queryset.filter(lookups), False
+
+
+class StatusListFilter(admin.SimpleListFilter):
+    """Filters by status using the choices in STATUS.
+
+    The status field has no choices, so the default filter would select the
+    distinct statuses from the whole table on every changelist load.
+    """
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return STATUS
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(status=self.value())
+        return queryset
 
 
 class OrderPanelItemInline(admin.TabularInline):
     model = OrderPanelItem
     extra = 0
+    raw_id_fields = ('utestid', )
+
+    def get_queryset(self, request):
+        return super(OrderPanelItemInline, self).get_queryset(request).select_related('utestid')
 
 
-class OrderPanelItemAdmin(admin.ModelAdmin):
+class OrderPanelItemAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('order_panel', 'utestid')
-    search_fields = ('order_panel__name', 'utestid__name')
+    list_select_related = ('order_panel', 'utestid')
+    search_fields = ('^order_panel__name', '^utestid__name')
 admin_site.register(OrderPanelItem, OrderPanelItemAdmin)
 
 
@@ -32,8 +88,10 @@ class UtestidAdmin(admin.ModelAdmin):
 admin_site.register(Utestid, UtestidAdmin)
 
 
-class OrderAdmin(admin.ModelAdmin):
-    date_hierarchy = 'order_datetime'
-    list_display = ('order_identifier', 'order_datetime', 'order_panel', 'aliquot')
-    search_fields = ('order_identifier', 'aliquot__aliquot_identifier', 'order_panel__name')
+class OrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('order_identifier', 'order_datetime', 'order_panel', 'aliquot_identifier', 'status')
+    list_select_related = ('order_panel', )
+    list_filter = (StatusListFilter, 'order_panel')
+    search_fields = ('=order_identifier', '^aliquot_identifier')
+    identifier_search_fields = ('order_identifier', 'aliquot_identifier')
 admin_site.register(Order, OrderAdmin)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig as DjangoAppConfig
+
+
+class AppConfig(DjangoAppConfig):
+    name = 'getresults_order'
+    verbose_name = 'Getresults Order'
+
+    def ready(self):
+        from . import catalog  # NOQA
+        from . import signals  # NOQA
@@ -0,0 +1,116 @@
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.db import router
+from django.utils import timezone
+from edc_constants.constants import CANCELLED, COMPLETE
+
+from .history import deferred_history
+from .models import ArchivedOrder, Order
+from .routers import record_write
+
+ARCHIVE_STATUSES = [COMPLETE, CANCELLED]
+
+
+class OrderArchive(object):
+    """Moves completed and cancelled orders to the archive table and queries both tables.
+
+    Orders are moved in chunks of `chunk_size`, each in one transaction: the
+    rows are copied to the archive with their id and order identifier, a
+    deleted historical record is written and the rows are deleted from the
+    order table. Orders referenced by rows of other models are not archived
+    and stay in the order table. An order identifier is therefore in one of the two tables;
+    identifiers are allocated from one sequence for both, see
+    order_identifier.highest_order_identifier.
+
+        archive = OrderArchive()
+        archive.archive(days=365)
+        archive.get('AAA00001')
+    """
+
+    model = Order
+    archive_model = ArchivedOrder
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or 1000
+
+    def archive(self, days=None, before=None, statuses=None):
+        """Moves orders with a status in `statuses` and an order_datetime before `before`, or older
+        than `days` (settings.ORDER_ARCHIVE_RETENTION_DAYS, default 365), to the archive.
+
+        Returns the number of orders archived.
+        """
+        if before is None:
+            days = getattr(settings, 'ORDER_ARCHIVE_RETENTION_DAYS', 365) if days is None else days
+            before = timezone.now() - timedelta(days=days)
+        statuses = statuses or ARCHIVE_STATUSES
+        archived = 0
+        while True:
+            count = self.archive_chunk(before, statuses)
+            if not count:
+                break
+            archived += count
+        return archived
+
+    def archive_chunk(self, before, statuses):
+        """Moves one chunk of orders to the archive in one transaction; returns the number moved."""
+        using = router.db_for_write(self.model)
+        with deferred_history(using=using):
+            orders = list(self.unreferenced(self.model.objects.using(using).filter(
+                status__in=statuses, order_datetime__lt=before)).order_by('order_datetime', 'pk')[:self.chunk_size])
+            if not orders:
+                return 0
+            archived_datetime = timezone.now()
+            self.archive_model.objects.using(using).bulk_create([
+                self.archive_model(archived_datetime=archived_datetime, **self.archive_values(order))
+                for order in orders])
+            # referenced orders are excluded, so there is nothing to cascade; the post_delete
+            # receivers write the deleted historical records, buffered by deferred_history,
+            # and remove the orders from the statistics
+            self.model.objects.using(using).filter(pk__in=[order.pk for order in orders]).delete()
+            record_write(self.model)
+        return len(orders)
+
+    def unreferenced(self, queryset):
+        """Excludes the orders referenced by rows of other models, which would be deleted or orphaned."""
+        for related_object in self.model._meta.related_objects:
+            queryset = queryset.exclude(**{'{}__isnull'.format(related_object.name): False})
+        return queryset
+
+    def archive_values(self, order):
+        """Returns a dictionary of the archive field values of an order."""
+        order_fields = set(field.attname for field in order._meta.concrete_fields)
+        return {
+            field.attname: getattr(order, field.attname) for field in self.archive_model._meta.concrete_fields
+            if field.attname in order_fields}
+
+    def filter(self, include_archived=False, **lookups):
+        """Returns a list of querysets of orders matching the lookups, the archive last if `include_archived`."""
+        querysets = [self.model.objects.filter(**lookups)]
+        if include_archived:
+            querysets.append(self.archive_model.objects.filter(**lookups))
+        return querysets
+
+    def iterator(self, include_archived=False, **lookups):
+        """Yields the orders matching the lookups from the order table then, optionally, the archive."""
+        return chain.from_iterable(queryset.iterator() for queryset in self.filter(include_archived, **lookups))
+
+    def get(self, order_identifier, include_archived=True):
+        """Returns the order or archived order with this order identifier."""
+        try:
+            return self.model.objects.get(order_identifier=order_identifier)
+        except self.model.DoesNotExist:
+            if not include_archived:
+                raise
+            try:
+                return self.archive_model.objects.get(order_identifier=order_identifier)
+            except self.archive_model.DoesNotExist:
+                raise self.model.DoesNotExist(
+                    'Order matching query does not exist. Got order_identifier=\'{}\''.format(order_identifier))
+
+    def exists(self, order_identifier):
+        """Returns True if the order identifier is used in the order table or the archive."""
+        if self.model.objects.filter(order_identifier=order_identifier).exists():
+            return True
+        return self.archive_model.objects.filter(order_identifier=order_identifier).exists()
@@ -0,0 +1,123 @@
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CatalogVersion, OrderPanel, OrderPanelItem, Utestid
+from .spec import UtestidSpec, UtestidSpecCatalog
+
+
+class Catalog(object):
+    """A process-local catalog of order panel items and utestids.
+
+    The catalog is loaded with one query and is cleared by the post_save and
+    post_delete receivers below. Changes made in other processes bump the
+    CatalogVersion; call refresh_if_stale() to compare versions and reload.
+
+        from getresults_order.catalog import catalog
+        for order_panel_item in catalog.panel_items('VL'):
+            print(order_panel_item.utestid.precision)
+    """
+
+    name = 'order_catalog'
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.loaded = False
+            self.version = None
+            self.order_panel_items = {}
+            self.utestids = {}
+
+    def load(self):
+        """Loads the order panel items with their order panels and utestids in one query."""
+        with self.lock:
+            version = self.current_version()
+            order_panel_items = {}
+            utestids = {}
+            for order_panel_item in OrderPanelItem.objects.select_related('order_panel', 'utestid'):
+                order_panel_items.setdefault(order_panel_item.order_panel.name, []).append(order_panel_item)
+                utestids[order_panel_item.utestid.name] = order_panel_item.utestid
+            self.order_panel_items = {name: tuple(items) for name, items in order_panel_items.items()}
+            self.utestids = utestids
+            self.version = version
+            self.loaded = True
+
+    def panel_items(self, order_panel_name):
+        """Returns a tuple of the OrderPanelItems of an order panel."""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return self.order_panel_items.get(order_panel_name, ())
+
+    def panel_utestids(self, order_panel_name):
+        """Returns a tuple of the Utestids of an order panel."""
+        return tuple(order_panel_item.utestid for order_panel_item in self.panel_items(order_panel_name))
+
+    def utestid(self, name):
+        """Returns the Utestid with this name; a utestid not in any panel is fetched and kept."""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            try:
+                return self.utestids[name]
+            except KeyError:
+                utestid = Utestid.objects.get(name=name)
+                self.utestids[name] = utestid
+                return utestid
+
+    def spec_catalog(self):
+        """Returns a UtestidSpecCatalog of the utestids and order panels in the catalog."""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return UtestidSpecCatalog(
+                [UtestidSpec.from_utestid(utestid) for utestid in self.utestids.values()],
+                {name: [item.utestid.name for item in items] for name, items in self.order_panel_items.items()},
+                self.version)
+
+    def current_version(self):
+        """Returns the version stamp of the catalog in the database."""
+        version = CatalogVersion.objects.filter(name=self.name).values_list('version', flat=True).first()
+        return version or 0
+
+    def is_stale(self):
+        """Returns True if the catalog changed in the database since it was loaded."""
+        return self.loaded and self.version != self.current_version()
+
+    def refresh_if_stale(self):
+        if self.is_stale():
+            self.clear()
+
+    def changed(self):
+        """Clears the catalog and bumps the version stamp so other processes see the change."""
+        self.clear()
+        if not CatalogVersion.objects.filter(name=self.name).update(version=F('version') + 1):
+            try:
+                with transaction.atomic():
+                    CatalogVersion.objects.create(name=self.name, version=1)
+            except IntegrityError:
+                CatalogVersion.objects.filter(name=self.name).update(version=F('version') + 1)
+
+
+catalog = Catalog()
+
+
+@receiver(post_save, sender=OrderPanel, dispatch_uid='order_panel_catalog_on_post_save')
+@receiver(post_save, sender=OrderPanelItem, dispatch_uid='order_panel_item_catalog_on_post_save')
+@receiver(post_save, sender=Utestid, dispatch_uid='utestid_catalog_on_post_save')
+def catalog_on_post_save(sender, instance, raw, created, using, **kwargs):
+    if not raw:
+        catalog.changed()
+
+
+@receiver(post_delete, sender=OrderPanel, dispatch_uid='order_panel_catalog_on_post_delete')
+@receiver(post_delete, sender=OrderPanelItem, dispatch_uid='order_panel_item_catalog_on_post_delete')
+@receiver(post_delete, sender=Utestid, dispatch_uid='utestid_catalog_on_post_delete')
+def catalog_on_post_delete(sender, instance, using, **kwargs):
+    catalog.changed()
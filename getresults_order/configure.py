@@ -1,60 +1,185 @@
 import csv
+import hashlib
 import os
 
+from collections import namedtuple
+from decimal import Decimal
+
 from django.conf import settings
+from django.db import transaction
+
+from .catalog import catalog
+from .history import bulk_history_create
+from .models import Utestid, OrderPanel, OrderPanelItem, CatalogChecksum
+
+LoadSummary = namedtuple('LoadSummary', 'created updated deleted unchanged conflicting')
 
-from .models import Utestid, OrderPanel, OrderPanelItem
+UTESTID_FIELDS = [
+    'description', 'value_type', 'value_datatype', 'lower_limit', 'upper_limit',
+    'precision', 'formula', 'formula_utestid_name']
+
+
+def file_checksum(filename):
+    """Returns the sha256 hex digest of a file's content, read in chunks."""
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
 
 class Configure(object):
+    """Loads utestids and order panels from csv files.
+
+    The checksum of each file is recorded when it is loaded; a file whose
+    checksum is unchanged is skipped. A changed file is applied as a row
+    level diff: new rows are created, utestids whose row changed are
+    updated and order panel items no longer in the file are deleted.
+    """
 
-    def __init__(self, utestid_file=None, sender_file=None):
+    def __init__(self, utestid_file=None, sender_file=None, force=False):
         self.utestid_filename = (
             utestid_file or os.path.join(settings.BASE_DIR, 'testdata/utestids.csv'))
         self.order_panel_file = sender_file or os.path.join(settings.BASE_DIR, 'testdata/order_panels.csv')
-        self.load_all()
+        self.summary = {}
+        self.skipped = []
+        self.load_all(force=force)
 
-    def load_all(self):
-        self.load_utestids_from_csv()
-        self.load_order_panels_from_csv()
+    def load_all(self, force=False):
+        """Loads utestids then order panels and returns a dictionary of LoadSummary by model name.
 
-    def load_order_panels_from_csv(self):
-        csv_filename = self.order_panel_file
+        Files with an unchanged checksum are skipped unless `force` is True and are
+        listed in self.skipped. Order panels are reloaded whenever utestids are.
+        """
+        self.summary = {}
+        self.skipped = []
+        if self.load_if_changed('utestid', self.utestid_filename, self.load_utestids_from_csv, force):
+            force = True
+        self.load_if_changed('order_panel', self.order_panel_file, self.load_order_panels_from_csv, force)
+        return self.summary
+
+    def load_if_changed(self, name, filename, load, force=False):
+        """Calls `load` and records the file's checksum, in one transaction, if the checksum changed.
+
+        Returns True if the file was loaded.
+        """
+        checksum = self.checksum(filename)
+        if not force and CatalogChecksum.objects.filter(name=name, checksum=checksum).exists():
+            self.skipped.append(name)
+            return False
+        with transaction.atomic():
+            summary = load()
+            self.summary.update(summary if isinstance(summary, dict) else {name: summary})
+            if not CatalogChecksum.objects.filter(name=name).update(filename=filename, checksum=checksum):
+                CatalogChecksum.objects.create(name=name, filename=filename, checksum=checksum)
+        return True
+
+    def checksum(self, filename):
+        """Returns the sha256 hex digest of a file's content."""
+        return file_checksum(filename)
+
+    def read_csv(self, csv_filename):
+        """Yields each row of a csv file as a dictionary keyed by the lower case header."""
         with open(csv_filename, 'r') as f:
             reader = csv.reader(f, quotechar="'")
             header = next(reader)
             header = [h.lower() for h in header]
             for row in reader:
-                r = dict(zip(header, row))
-                try:
-                    order_panel = OrderPanel.objects.get(name=r['order_panel'].strip())
-                except OrderPanel.DoesNotExist:
-                    order_panel = OrderPanel.objects.create(name=r['order_panel'].strip())
-                try:
-                    utestid = Utestid.objects.get(name=r['utestid'].strip())
-                    OrderPanelItem.objects.get(order_panel=order_panel, utestid=utestid)
-                except OrderPanelItem.DoesNotExist:
-                    OrderPanelItem.objects.create(order_panel=order_panel, utestid=utestid)
+                yield dict(zip(header, row))
+
+    def load_order_panels_from_csv(self):
+        """Creates the missing order panels and order panel items and deletes items not in the file.
+
+        Returns a dictionary of LoadSummary for order_panel and order_panel_item. An
+        item is conflicting if its utestid does not exist.
+        """
+        rows = []
+        for r in self.read_csv(self.order_panel_file):
+            rows.append((r['order_panel'].strip(), r['utestid'].strip()))
+        with transaction.atomic():
+            order_panels = {order_panel.name: order_panel for order_panel in OrderPanel.objects.all()}
+            new_order_panels = [
+                OrderPanel(name=name) for name in sorted(set(name for name, _ in rows))
+                if name not in order_panels]
+            for order_panel in self.bulk_create(OrderPanel, new_order_panels):
+                order_panels[order_panel.name] = order_panel
+            utestids = {utestid.name: utestid for utestid in Utestid.objects.all()}
+            existing_items = {
+                (order_panel_name, utestid_name): pk for pk, order_panel_name, utestid_name in
+                OrderPanelItem.objects.values_list('pk', 'order_panel__name', 'utestid__name').order_by()}
+            in_file, new_items, conflicting = set(), [], 0
+            for order_panel_name, utestid_name in rows:
+                key = (order_panel_name, utestid_name)
+                if key in in_file or key in existing_items:
+                    in_file.add(key)
+                    continue
+                if utestid_name not in utestids:
+                    conflicting += 1
+                    continue
+                in_file.add(key)
+                new_items.append(OrderPanelItem(
+                    order_panel=order_panels[order_panel_name], utestid=utestids[utestid_name]))
+            self.bulk_create(OrderPanelItem, new_items)
+            removed_items = [pk for key, pk in existing_items.items() if key not in in_file]
+            if removed_items:
+                OrderPanelItem.objects.filter(pk__in=removed_items).delete()
+        panel_names = set(order_panel_name for order_panel_name, _ in rows)
+        return {
+            'order_panel': LoadSummary(
+                len(new_order_panels), 0, 0, len(panel_names) - len(new_order_panels), 0),
+            'order_panel_item': LoadSummary(
+                len(new_items), 0, len(removed_items), len(rows) - len(new_items) - conflicting, conflicting)}
 
     def load_utestids_from_csv(self):
-        csv_filename = self.utestid_filename
-        with open(csv_filename, 'r') as f:
-            reader = csv.reader(f, quotechar="'")
-            header = next(reader)
-            header = [h.lower() for h in header]
-            for row in reader:
-                r = dict(zip(header, row))
+        """Creates the missing utestids and updates those whose row changed; returns a LoadSummary.
+
+        A repeated name with a different row is conflicting and the first row is used.
+        """
+        rows = {}
+        conflicting = 0
+        for r in self.read_csv(self.utestid_filename):
+            name = r['name'].strip()
+            values = self.utestid_values(r)
+            if name in rows:
+                conflicting += int(rows[name] != values)
+                continue
+            rows[name] = values
+        with transaction.atomic():
+            utestids = {utestid.name: utestid for utestid in Utestid.objects.all()}
+            new_utestids, updated, unchanged = [], 0, 0
+            for name, values in rows.items():
                 try:
-                    Utestid.objects.get(name=r['name'].strip())
-                except Utestid.DoesNotExist:
-                    Utestid.objects.create(
-                        name=r['name'].strip(),
-                        description=r['description'].strip().lower(),
-                        value_type=r['value_type'].lower(),
-                        value_datatype=r['value_datatype'].lower(),
-                        lower_limit=r['lower_limit'] if r['lower_limit'] else None,
-                        upper_limit=r['upper_limit'] if r['upper_limit'] else None,
-                        precision=r['precision'] if r['precision'] else None,
-                        formula=r['formula'] if r['formula'] else None,
-                        formula_utestid_name=r['formula_utestid_name'].lower() if r['formula_utestid_name'] else None,
-                    )
+                    utestid = utestids[name]
+                except KeyError:
+                    new_utestids.append(Utestid(name=name, **values))
+                else:
+                    if {field: getattr(utestid, field) for field in UTESTID_FIELDS} == values:
+                        unchanged += 1
+                    else:
+                        for field, value in values.items():
+                            setattr(utestid, field, value)
+                        utestid.save()
+                        updated += 1
+            self.bulk_create(Utestid, new_utestids)
+        return LoadSummary(len(new_utestids), updated, 0, unchanged, conflicting)
+
+    def utestid_values(self, r):
+        """Returns a dictionary of Utestid field values from a csv row."""
+        return dict(
+            description=r['description'].strip().lower(),
+            value_type=r['value_type'].lower(),
+            value_datatype=r['value_datatype'].lower(),
+            lower_limit=Decimal(r['lower_limit']) if r['lower_limit'] else None,
+            upper_limit=Decimal(r['upper_limit']) if r['upper_limit'] else None,
+            precision=int(r['precision']) if r['precision'] else None,
+            formula=r['formula'] if r['formula'] else None,
+            formula_utestid_name=r['formula_utestid_name'].lower() if r['formula_utestid_name'] else None,
+        )
+
+    def bulk_create(self, model, instances):
+        """Bulk inserts instances with their historical records and marks the catalog as changed."""
+        if instances:
+            instances = model.objects.bulk_create(instances)
+            bulk_history_create(model, instances)
+            catalog.changed()
+        return instances
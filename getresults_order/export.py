@@ -0,0 +1,120 @@
+import csv
+import json
+
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Order
+
+EXPORT_FIELDS = ['order_identifier', 'order_datetime', 'order_panel__name', 'aliquot_identifier', 'status']
+EXPORT_HEADER = ['order_identifier', 'order_datetime', 'order_panel', 'aliquot_identifier', 'status']
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo(object):
+    """A file-like object for csv.writer that returns each line instead of writing it."""
+
+    def write(self, value):
+        return value
+
+
+class OrderExport(object):
+    """Exports orders with their panel name as CSV or NDJSON, one chunk of rows at a time.
+
+    Rows are read with values_list() joined to the order panel, one query
+    of `chunk_size` rows per chunk paged by order identifier, so no model
+    instances are built and memory does not grow with the number of rows
+    on any backend. Filter by order_datetime from `start` to `end`, both
+    inclusive; a date includes the whole day.
+
+        with open('orders.csv', 'w') as f:
+            OrderExport(order_panel='VL', status=PENDING).write(f)
+    """
+
+    def __init__(self, file_format=None, start=None, end=None, order_panel=None, status=None, chunk_size=None):
+        self.file_format = file_format or 'csv'
+        if self.file_format not in ['csv', 'ndjson']:
+            raise ValueError('Invalid export format. Expected csv or ndjson. Got {}'.format(file_format))
+        self.start = to_datetime(start)
+        self.end = to_datetime(end, end=True)
+        self.order_panel = order_panel
+        self.status = status
+        self.chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+        self.rows = 0
+        self.csv_writer = csv.writer(Echo(), lineterminator='\n')
+
+    def __iter__(self):
+        """Yields the export as strings of up to chunk_size rows, the CSV header first."""
+        format_row = self.csv_row if self.file_format == 'csv' else self.ndjson_row
+        if self.file_format == 'csv':
+            yield self.csv_row(EXPORT_HEADER)
+        self.rows = 0
+        queryset = self.queryset()
+        last_order_identifier = None
+        while True:
+            chunk = queryset if last_order_identifier is None else queryset.filter(
+                order_identifier__gt=last_order_identifier)
+            rows = list(chunk[:self.chunk_size])
+            if not rows:
+                return
+            self.rows += len(rows)
+            yield ''.join(format_row(row) for row in rows)
+            if len(rows) < self.chunk_size:
+                return
+            last_order_identifier = rows[-1][0]
+
+    @property
+    def content_type(self):
+        return 'text/csv' if self.file_format == 'csv' else 'application/x-ndjson'
+
+    def queryset(self):
+        """Returns the filtered orders as tuples of EXPORT_FIELDS in order identifier order."""
+        queryset = Order.objects.all()
+        if self.start:
+            queryset = queryset.filter(order_datetime__gte=self.start)
+        if self.end:
+            queryset = queryset.filter(order_datetime__lt=self.end)
+        if self.order_panel:
+            queryset = queryset.filter(order_panel__name=self.order_panel)
+        if self.status:
+            queryset = queryset.filter(status=self.status)
+        return queryset.order_by('order_identifier').values_list(*EXPORT_FIELDS)
+
+    def write(self, f):
+        """Writes the export to an open file and returns the number of rows written."""
+        for chunk in self:
+            f.write(chunk)
+        return self.rows
+
+    def csv_row(self, row):
+        return self.csv_writer.writerow(
+            [value.isoformat() if isinstance(value, datetime) else value for value in row])
+
+    def ndjson_row(self, row):
+        return json.dumps(dict(zip(
+            EXPORT_HEADER, [value.isoformat() if isinstance(value, datetime) else value for value in row]))) + '\n'
+
+
+def to_datetime(value, end=False):
+    """Returns a date, datetime or ISO 8601 string as a datetime, or None.
+
+    A date is the start of the day, or of the next day if `end`, so an end
+    date includes the whole day.
+    """
+    if not value:
+        return None
+    if not isinstance(value, (date, datetime)):
+        parsed = parse_datetime(value) or parse_date(value)
+        if parsed is None:
+            raise ValueError('Invalid date or datetime. Got {}'.format(value))
+        value = parsed
+    if not isinstance(value, datetime):
+        value = datetime.combine(value + timedelta(days=1) if end else value, time())
+    elif end:
+        value = value + timedelta(microseconds=1)
+    if settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
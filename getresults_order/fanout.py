@@ -0,0 +1,87 @@
+from collections import namedtuple
+
+from django.db.models.query import QuerySet
+from edc_constants.constants import CANCELLED
+
+from .managers import aliquots_by_identifier
+from .models import Order, Requisition
+
+FanoutSummary = namedtuple('FanoutSummary', 'orders existing missing')
+
+
+class OrderFanout(object):
+    """Expands requisitions into one order per requisitioned panel.
+
+    The aliquot of a requisition is the aliquot whose aliquot_identifier is
+    the requisition's specimen_identifier, or requisition_identifier if it
+    has none. Requisitions are handled in batches of `batch_size`; each
+    batch is a fixed number of queries: the requisitions with their panels,
+    their aliquots, the existing orders and the bulk insert of new orders.
+
+    An order is not created if one that is not cancelled already exists for
+    the aliquot and panel, so running the fan out again on the same requisitions creates no
+    duplicates.
+
+        summary = OrderFanout().fan_out(Requisition.objects.filter(...))
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or 500
+
+    def fan_out(self, requisitions):
+        """Creates the missing orders for a queryset or list of requisitions.
+
+        Returns a FanoutSummary of the new orders, the number of orders that
+        already existed and the requisition identifiers without an aliquot.
+        """
+        orders, existing, missing = [], 0, []
+        for batch in self.batches(requisitions):
+            batch_orders, batch_existing, batch_missing = self.fan_out_batch(batch)
+            orders.extend(batch_orders)
+            existing += batch_existing
+            missing.extend(batch_missing)
+        return FanoutSummary(orders, existing, missing)
+
+    def fan_out_batch(self, requisitions):
+        """Creates the missing orders for a batch of requisitions with their panels prefetched."""
+        aliquots = aliquots_by_identifier(self.aliquot_identifier(requisition) for requisition in requisitions)
+        existing_orders = set(Order.objects.filter(aliquot_identifier__in=list(aliquots)).exclude(
+            status=CANCELLED).values_list('aliquot_identifier', 'order_panel_id').order_by())
+        new_orders, existing, missing = [], 0, []
+        for requisition in requisitions:
+            aliquot_identifier = self.aliquot_identifier(requisition)
+            try:
+                aliquot = aliquots[aliquot_identifier]
+            except KeyError:
+                missing.append(requisition.requisition_identifier)
+                continue
+            for order_panel in requisition.tests.all():
+                if (aliquot_identifier, order_panel.pk) in existing_orders:
+                    existing += 1
+                    continue
+                existing_orders.add((aliquot_identifier, order_panel.pk))
+                new_orders.append(Order.objects.make_order(aliquot, order_panel))
+        return Order.objects.bulk_create_orders(new_orders), existing, missing
+
+    def batches(self, requisitions):
+        """Yields lists of requisitions with their panels prefetched, `batch_size` at a time.
+
+        A queryset is read in primary key order, one batch per query.
+        """
+        if isinstance(requisitions, QuerySet):
+            queryset = requisitions.order_by('pk').prefetch_related('tests')
+            last_pk = None
+            while True:
+                batch = list((queryset if last_pk is None else queryset.filter(pk__gt=last_pk))[:self.batch_size])
+                if not batch:
+                    return
+                yield batch
+                last_pk = batch[-1].pk
+        else:
+            pks = [requisition.pk for requisition in requisitions]
+            for index in range(0, len(pks), self.batch_size):
+                yield list(Requisition.objects.filter(
+                    pk__in=pks[index:index + self.batch_size]).prefetch_related('tests'))
+
+    def aliquot_identifier(self, requisition):
+        return requisition.specimen_identifier or requisition.requisition_identifier
@@ -0,0 +1,136 @@
+import math
+
+from decimal import Decimal
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAX_INT64_VALUE = 2.0 ** 62
+MAX_EXACT_FLOAT = 2.0 ** 52
+LIMIT_TYPES = (Decimal, int, float)
+
+
+def format_value(utestid, raw_value, value_type=None):
+    """Returns a raw value of a utestid, a Utestid or UtestidSpec, as the type defined in value_type."""
+    value_type = value_type or utestid.value_type
+    if utestid.value_type == 'calculated':
+        raw_value = utestid.compiled_formula(raw_value)
+    if utestid.value_datatype == 'string':
+        return str(raw_value)
+    elif utestid.value_datatype == 'integer':
+        return int(round(finite_float(raw_value), 0))
+    elif utestid.value_datatype == 'decimal':
+        return round(finite_float(raw_value), utestid.precision)
+    raise ValueError('Invalid utestid.value_type. Got \'{}\''.format(value_type))
+
+
+def finite_float(raw_value):
+    """Returns the raw value as a float; raises a ValueError for NaN and infinity, as format_values does."""
+    value = float(raw_value)
+    if not math.isfinite(value):
+        raise ValueError('Cannot format a value that is not finite. Got {}'.format(value))
+    return value
+
+
+def format_value_with_quantifier(utestid, raw_value):
+    """Returns a tuple of (quantifier, value) given a raw value of a utestid, see Utestid.value_with_quantifier()."""
+    value = utestid.value(raw_value)
+    try:
+        if value < utestid.lower_limit:
+            return ('<', utestid.value(utestid.lower_limit, 'absolute'))
+        elif value > utestid.upper_limit:
+            return ('>', utestid.value(utestid.upper_limit, 'absolute'))
+    except TypeError:
+        pass
+    return ('=', value)
+
+
+def format_values(utestid, raw_values):
+    """Returns a batch of raw values for one utestid formatted as utestid.value() would.
+
+    With NumPy installed, values of datatype integer and decimal are calculated
+    and rounded in one vectorized pass and returned as an array; otherwise, and
+    for datatype string, each value is formatted by utestid.value().
+    """
+    if utestid.value_datatype not in ['string', 'integer', 'decimal']:
+        raise ValueError('Invalid utestid.value_type. Got \'{}\''.format(utestid.value_datatype))
+    if np is None:
+        return [utestid.value(raw_value) for raw_value in raw_values]
+    if utestid.value_datatype == 'string':
+        return np.array([utestid.value(raw_value) for raw_value in raw_values], dtype=object)
+    values = np.asarray(raw_values if isinstance(raw_values, np.ndarray) else list(raw_values), dtype=float)
+    if utestid.value_type == 'calculated':
+        values = utestid.compiled_formula.evaluate_array(values)
+    if not np.all(np.isfinite(values)):
+        raise ValueError('Cannot format a value that is not finite. Got {}'.format(values[~np.isfinite(values)][0]))
+    if utestid.value_datatype == 'integer' or utestid.precision is None:
+        return round_to_integer(values)
+    return round_to_precision(values, utestid.precision)
+
+
+def format_values_with_quantifier(utestid, raw_values):
+    """Returns a tuple of (quantifiers, values) for a batch of raw values of one utestid.
+
+    Each pair of quantifier and value is what utestid.value_with_quantifier()
+    returns for the raw value, including its inclusive limits. With NumPy
+    installed the quantifiers and values are arrays, otherwise lists.
+    """
+    if np is None:
+        pairs = [utestid.value_with_quantifier(raw_value) for raw_value in raw_values]
+        return [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+    values = format_values(utestid, raw_values)
+    quantifiers = np.full(len(values), '=', dtype='<U1')
+    if utestid.value_datatype == 'string' or not len(values):
+        return quantifiers, values
+    if not isinstance(utestid.lower_limit, LIMIT_TYPES):
+        return quantifiers, values
+    values = values.copy()
+    below = compare_to_limit(values, utestid.lower_limit, lambda value, limit: value < limit)
+    if np.any(below):
+        quantifiers[below] = '<'
+        values[below] = utestid.value(utestid.lower_limit, 'absolute')
+    if isinstance(utestid.upper_limit, LIMIT_TYPES):
+        above = ~below & compare_to_limit(values, utestid.upper_limit, lambda value, limit: value > limit)
+        if np.any(above):
+            quantifiers[above] = '>'
+            values[above] = utestid.value(utestid.upper_limit, 'absolute')
+    return quantifiers, values
+
+
+def compare_to_limit(values, limit, compare):
+    """Returns a boolean array comparing values to a Decimal limit.
+
+    Values equal to the float nearest the limit are compared to the Decimal
+    itself, so the result is the same as comparing each value to the limit.
+    """
+    float_limit = float(limit)
+    result = compare(values, float_limit)
+    for index in np.flatnonzero(values == float_limit):
+        result[index] = compare(values[index].item(), limit)
+    return result
+
+
+def round_to_integer(values):
+    """Returns values rounded half to even as integers, like int(round(value, 0))."""
+    if np.any(np.abs(values) >= MAX_INT64_VALUE):
+        return np.array([int(round(value, 0)) for value in values.tolist()], dtype=object)
+    return np.rint(values).astype(np.int64)
+
+
+def round_to_precision(values, precision):
+    """Returns values rounded to `precision` decimal places, like round(value, precision).
+
+    Values that are within rounding error of a tie, or too large to scale
+    exactly, are rounded by round() so the results are identical.
+    """
+    if not 0 <= precision <= 15:
+        return np.array([round(value, precision) for value in values.tolist()])
+    scale = 10.0 ** precision
+    scaled = values * scale
+    rounded = np.rint(scaled) / scale
+    near_tie = (np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6) | (np.abs(scaled) >= MAX_EXACT_FLOAT)
+    for index in np.flatnonzero(near_tie):
+        rounded[index] = round(values[index].item(), precision)
+    return rounded
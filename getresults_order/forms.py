@@ -1,18 +1,71 @@
 from django import forms
 
-from getresults_aliquot.models import Aliquot
-
+from .managers import aliquots_by_identifier
 from .models import Order
 
 
 class OrderForm(forms.ModelForm):
+    """An order form that resolves the aliquot of its aliquot identifier and sets it on the order.
+
+    In a BaseOrderFormSet the aliquots of all forms are resolved by the
+    formset in one query and passed in as `aliquots`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.aliquots = kwargs.pop('aliquots', None)
+        super(OrderForm, self).__init__(*args, **kwargs)
 
     def clean_aliquot_identifier(self):
         aliquot_identifier = self.cleaned_data.get('aliquot_identifier')
+        if self.aliquots is None:
+            self.aliquots = aliquots_by_identifier([aliquot_identifier])
         try:
-            Aliquot.objects.get(aliquot_identifier=aliquot_identifier)
-        except Aliquot.DoesNotExist:
+            self.instance.aliquot = self.aliquots[aliquot_identifier]
+        except KeyError:
             raise forms.ValidationError('Invalid Aliquot Identifier. Got {}'.format(aliquot_identifier))
+        return aliquot_identifier
 
     class Meta:
         model = Order
+        fields = ['order_datetime', 'order_panel', 'aliquot_identifier', 'status']
+
+
+class BaseOrderFormSet(forms.BaseModelFormSet):
+    """A formset of OrderForms that resolves the aliquots of all forms with one query.
+
+    Each form with an invalid aliquot identifier has a field error and the
+    invalid identifiers are also reported together as a non-form error.
+    The resolved aliquots are set on the orders, so save() does not look
+    them up again.
+    """
+
+    def full_clean(self):
+        if self.is_bound:
+            aliquot_identifiers = [self.raw_aliquot_identifier(form) for form in self.forms]
+            aliquots = aliquots_by_identifier(
+                aliquot_identifier for aliquot_identifier in aliquot_identifiers if aliquot_identifier)
+            for form in self.forms:
+                form.aliquots = aliquots
+        super(BaseOrderFormSet, self).full_clean()
+
+    def raw_aliquot_identifier(self, form):
+        """Returns the submitted aliquot identifier of a form, cleaned by its field, or None if invalid."""
+        try:
+            return form.fields['aliquot_identifier'].clean(
+                form.data.get(form.add_prefix('aliquot_identifier')))
+        except forms.ValidationError:
+            return None
+
+    def clean(self):
+        super(BaseOrderFormSet, self).clean()
+        invalid = []
+        for form in self.forms:
+            if 'aliquot_identifier' in form.errors:
+                aliquot_identifier = self.raw_aliquot_identifier(form)
+                if aliquot_identifier and aliquot_identifier not in invalid:
+                    invalid.append(aliquot_identifier)
+        if invalid:
+            raise forms.ValidationError('Invalid Aliquot Identifiers. Got {}'.format(', '.join(invalid)))
+
+
+OrderFormSet = forms.modelformset_factory(Order, form=OrderForm, formset=BaseOrderFormSet)
@@ -0,0 +1,127 @@
+import ast
+import math
+
+from decimal import Decimal
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FUNCTIONS = {
+    'log10': math.log10,
+    'ln': math.log,
+    'exp': math.exp,
+    'sqrt': math.sqrt,
+}
+
+ARRAY_FUNCTIONS = {
+    'log10': np.log10,
+    'ln': np.log,
+    'exp': np.exp,
+    'sqrt': np.sqrt,
+} if np else {}
+
+ALLOWED_NODES = [
+    'Expression', 'BinOp', 'UnaryOp', 'Call', 'Name', 'Load', 'Num', 'Constant',
+    'Add', 'Sub', 'Mult', 'Div', 'FloorDiv', 'Mod', 'Pow', 'UAdd', 'USub',
+]
+
+FORMULA_CACHE_SIZE = 256
+
+
+class Formula(object):
+    """A formula for a calculated value, parsed once into a whitelisted expression tree.
+
+    Formulas may use numbers, the operators + - * / // % ** and the functions
+    log10, ln, exp and sqrt (case insensitive). The raw value is referred to
+    as {value}. A formula that is only a function name, e.g. LOG10, applies
+    the function to the value.
+
+        formula = Formula('LOG10')
+        formula(750000)  # 5.875...
+    """
+
+    def __init__(self, formula):
+        self.formula = formula
+        self.function = self.compile(formula)
+        self.array_function = None
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.formula)
+
+    def __call__(self, raw_value):
+        return self.function(to_number(raw_value))
+
+    def evaluate_array(self, values):
+        """Returns the formula applied to a NumPy array of floats in one vectorized pass.
+
+        Raises a ValueError where math would, e.g. for log10 of 0.
+        """
+        if self.array_function is None:
+            namespace = dict(ARRAY_FUNCTIONS, __builtins__={})
+            self.array_function = eval('lambda value: ({})'.format(self.expression), namespace)
+        with np.errstate(divide='raise', invalid='raise', over='raise'):
+            try:
+                result = self.array_function(values)
+            except FloatingPointError as e:
+                raise ValueError('Formula \'{}\' failed. Got {}'.format(self.formula, e))
+        return np.broadcast_to(np.asarray(result, dtype=float), values.shape)
+
+    def compile(self, formula):
+        """Returns a function of one argument, `value`, that evaluates the formula.
+
+        The expression is checked against a whitelist of node types, names
+        and functions before it is compiled.
+        """
+        expression = (formula or '').strip().lower().replace('{value}', 'value')
+        if expression in FUNCTIONS:
+            expression = '{}(value)'.format(expression)
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError:
+            raise ValueError('Invalid formula for calculated value. Got \'{}\''.format(formula))
+        called = set(id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call))
+        if not all(is_allowed_node(node, called) for node in ast.walk(tree)):
+            raise ValueError('Invalid formula for calculated value. Got \'{}\''.format(formula))
+        self.expression = expression
+        namespace = dict(FUNCTIONS, __builtins__={})
+        return eval('lambda value: ({})'.format(expression), namespace)
+
+
+def is_allowed_node(node, called):
+    """Returns True if a node of a formula's syntax tree is in the whitelist.
+
+    `called` is the set of ids of the nodes called as functions.
+    """
+    node_type = type(node).__name__
+    if node_type not in ALLOWED_NODES:
+        return False
+    if node_type in ['Num', 'Constant']:
+        number = node.n if node_type == 'Num' else node.value
+        return isinstance(number, (int, float)) and not isinstance(number, bool)
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            return False
+        return len(node.args) == 1 and not node.keywords
+    if isinstance(node, ast.Name):
+        return node.id == 'value' or id(node) in called
+    return True
+
+
+def to_number(raw_value):
+    """Returns the raw value as an int or float the way ast.literal_eval(str(raw_value)) would."""
+    if isinstance(raw_value, (int, float)) and not isinstance(raw_value, bool):
+        return raw_value
+    raw_value = str(raw_value) if isinstance(raw_value, Decimal) else raw_value
+    try:
+        return int(raw_value)
+    except ValueError:
+        return float(raw_value)
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def get_formula(formula):
+    """Returns the compiled Formula for a formula text, caching the FORMULA_CACHE_SIZE most recently used."""
+    return Formula(formula)
@@ -0,0 +1,176 @@
+import threading
+
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.utils import timezone
+from simple_history.models import HistoricalRecords
+
+from .routers import write_database
+
+local = threading.local()
+
+
+def get_history_model(model):
+    """Returns the historical model of an audited model or None if the model has no audit trail."""
+    manager_name = getattr(model._meta, 'simple_history_manager_attribute', None)
+    if not manager_name:
+        return None
+    return getattr(model, manager_name).model
+
+
+def get_history_user():
+    """Returns the user of the current request as set by the simple_history middleware, if any."""
+    try:
+        user = HistoricalRecords.thread.request.user
+    except AttributeError:
+        return None
+    return user if user.is_authenticated() else None
+
+
+def bulk_history_create(model, instances, history_type='+', history_user=None, batch_size=None, using=None):
+    """Writes the historical records for a batch of instances with one bulk insert to database `using`.
+
+    Mirrors HistoricalRecords.create_historical_record for use after
+    bulk_create and queryset updates, neither of which send post_save.
+    """
+    history_model = get_history_model(model)
+    if history_model is None:
+        return []
+    history_date = timezone.now()
+    history_user = history_user or get_history_user()
+    historical_records = []
+    for instance in instances:
+        historical_records.append(history_model(
+            history_date=getattr(instance, '_history_date', history_date),
+            history_type=history_type,
+            history_user=history_user,
+            **field_values(instance)))
+    return history_model._default_manager.using(using).bulk_create(historical_records, batch_size=batch_size)
+
+
+def field_values(instance):
+    """Returns a dictionary of the field values of an instance keyed by attname, as copied to its history."""
+    return {field.attname: getattr(instance, field.attname) for field in instance._meta.fields}
+
+
+class DeferredHistory(object):
+    """The historical records buffered in one deferred_history() block.
+
+    Each record registers a no-op commit hook as a marker; Django discards
+    the hooks of a savepoint that is rolled back, so a record whose marker
+    is still pending belongs to a change that was not rolled back. flush()
+    writes those records in the transaction of the block.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.records = []
+        self.written = 0
+
+    def add(self, historical_record):
+        def marker():
+            pass
+        transaction.on_commit(marker, using=self.using)
+        self.records.append((marker, historical_record))
+
+    def flush(self):
+        """Writes the records of the changes not rolled back with one bulk insert per historical model.
+
+        Returns the number written.
+        """
+        # run_on_commit holds (savepoint ids, hook, ...) for the hooks not discarded by a rollback
+        pending = set(hook[1] for hook in transaction.get_connection(self.using).run_on_commit)
+        historical_records = {}
+        for marker, historical_record in self.records:
+            if marker in pending:
+                historical_records.setdefault(historical_record.__class__, []).append(historical_record)
+        self.records = []
+        for history_model, records in historical_records.items():
+            history_model._default_manager.using(self.using).bulk_create(records)
+        written = sum(len(records) for records in historical_records.values())
+        self.written += written
+        return written
+
+
+class DeferredHistoricalRecords(HistoricalRecords):
+    """HistoricalRecords that buffers its records inside deferred_history() instead of writing each one."""
+
+    def create_historical_record(self, instance, history_type):
+        deferred = getattr(local, 'deferred_history', None)
+        if deferred is None:
+            return super(DeferredHistoricalRecords, self).create_historical_record(instance, history_type)
+        history_model = getattr(instance, self.manager_name).model
+        deferred.add(history_model(
+            history_date=getattr(instance, '_history_date', timezone.now()),
+            history_type=history_type,
+            history_user=self.get_history_user(instance),
+            **field_values(instance)))
+
+
+@contextmanager
+def deferred_history(using=None):
+    """Runs the block in a transaction and writes the historical records created in it at its end.
+
+    Records are buffered instead of written on each save and are written
+    with one bulk insert per historical model at the end of the block, in
+    its transaction, so they commit or roll back with the changes. Records
+    of changes rolled back by an inner atomic block are not written. A
+    nested block joins the outer one.
+
+        with deferred_history():
+            for order in orders:
+                order.save()
+    """
+    if getattr(local, 'deferred_history', None) is not None:
+        yield local.deferred_history
+        return
+    deferred = DeferredHistory(using or write_database())
+    with transaction.atomic(using=deferred.using):
+        local.deferred_history = deferred
+        try:
+            yield deferred
+        finally:
+            local.deferred_history = None
+        deferred.flush()
+
+
+def compact_history(model, before, fields=None, chunk_size=500):
+    """Deletes the historical records of `model` dated before `before` that add nothing to the trail.
+
+    Of the old records of each object, the first and the last, creations,
+    deletions and those in which one of `fields` changed from the previous
+    record are kept. Objects are processed `chunk_size` at a time. Returns
+    the number of records deleted.
+    """
+    history_model = get_history_model(model)
+    if history_model is None:
+        return 0
+    pk_name = model._meta.pk.attname
+    history = history_model._default_manager.filter(history_date__lt=before)
+    columns = ['history_id', pk_name, 'history_type'] + list(fields or [])
+    deleted = 0
+    last_object_id = None
+    while True:
+        object_ids = history.order_by(pk_name).values_list(pk_name, flat=True).distinct()
+        if last_object_id is not None:
+            object_ids = object_ids.filter(**{pk_name + '__gt': last_object_id})
+        object_ids = list(object_ids[:chunk_size])
+        if not object_ids:
+            break
+        last_object_id = object_ids[-1]
+        rows = history.filter(**{pk_name + '__in': object_ids}).order_by(
+            pk_name, 'history_date', 'history_id').values_list(*columns)
+        history_ids = []
+        for _, versions in groupby(rows, key=itemgetter(1)):
+            versions = list(versions)
+            for previous, version in zip(versions, versions[1:-1]):
+                if version[2] == '~' and version[3:] == previous[3:]:
+                    history_ids.append(version[0])
+        for index in range(0, len(history_ids), chunk_size):
+            chunk = history_ids[index:index + chunk_size]
+            history_model._default_manager.using(history.db).filter(history_id__in=chunk).delete()
+            deleted += len(chunk)
+    return deleted
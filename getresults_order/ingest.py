@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .catalog import catalog
+from .models import Order
+from .pipeline import FormattedResult
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionServer(object):
+    """An asyncio server that receives results from analysers and writes them in batches.
+
+    Each line received is a JSON object with order_identifier, utestid and
+    value. Invalid lines are answered with "ERR <message>". Valid results
+    are queued and flushed in batches of up to `batch_size`, or after
+    `flush_interval` seconds. A flush looks up the orders in one query,
+    formats each value with the UtestidSpec of the order's panel and
+    passes a list of FormattedResults to `writer`.
+
+    Flushes run in a worker thread, so a slow commit does not stop the
+    server from reading. When `max_pending` results are queued, reading
+    stops until a flush frees space, which pushes back on the connections.
+    A batch that fails to flush is logged and reported as failed by
+    flush_failed(), and the server goes on with the next batch.
+
+        server = IngestionServer(writer)
+        loop.run_until_complete(server.start(port=9000))
+        loop.run_forever()
+    """
+
+    def __init__(self, writer, batch_size=None, flush_interval=None, max_pending=None, use_executor=True):
+        self.writer = writer
+        self.batch_size = batch_size or getattr(settings, 'INGESTION_BATCH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'INGESTION_FLUSH_INTERVAL', 1.0)
+        self.max_pending = max_pending or getattr(settings, 'INGESTION_MAX_PENDING', 10000)
+        self.executor = ThreadPoolExecutor(max_workers=1) if use_executor else None
+        self.queue = None
+        self.server = None
+        self.flusher = None
+        self.spec_catalog = None
+        self.flushed = 0
+        self.failed = 0
+
+    async def start(self, host=None, port=None, path=None):
+        """Starts listening on a TCP host and port or on a unix socket path, and the flusher."""
+        self.open()
+        if path:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host or '127.0.0.1', port)
+        return self.server
+
+    def open(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_pending)
+            self.flusher = asyncio.ensure_future(self.flush_forever())
+
+    async def close(self):
+        """Stops listening, flushes the queued results and stops the flusher."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.flusher is not None:
+            await self.queue.put(None)
+            await self.flusher
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    async def handle_connection(self, reader, stream_writer):
+        """Reads result lines from one connection until it is closed."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    record = self.parse(line)
+                except ValueError as e:
+                    stream_writer.write('ERR {}\n'.format(e).encode('utf-8'))
+                    await stream_writer.drain()
+                    continue
+                await self.queue.put(record)
+        finally:
+            stream_writer.close()
+
+    def parse(self, line):
+        """Returns a tuple of (order_identifier, utestid_name, raw_value) for a message line."""
+        try:
+            message = json.loads(line.decode('utf-8') if isinstance(line, bytes) else line)
+            return (message['order_identifier'], message['utestid'], message['value'])
+        except (KeyError, TypeError, UnicodeDecodeError, ValueError):
+            raise ValueError('Invalid result message. Got {!r}'.format(line[:100]))
+
+    async def flush_forever(self):
+        """Collects queued results into batches and flushes each batch until None is queued."""
+        loop = asyncio.get_event_loop()
+        closing = False
+        while not closing:
+            record = await self.queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    closing = True
+                    break
+                batch.append(record)
+            await self.flush_batch(batch)
+
+    async def flush_batch(self, batch):
+        """Flushes a batch, in the worker thread if any; a failed flush is passed to flush_failed()."""
+        try:
+            if self.executor is None:
+                self.flush(batch)
+            else:
+                await asyncio.get_event_loop().run_in_executor(self.executor, self.flush_in_thread, batch)
+        except Exception as e:
+            self.flush_failed(batch, e)
+
+    def flush_failed(self, batch, exception):
+        """Logs a batch that failed to flush and passes it to the writer with the error on each result.
+
+        Override to retry the batch or to keep it elsewhere.
+        """
+        logger.error('Failed to flush {} results.'.format(len(batch)), exc_info=exception)
+        self.failed += len(batch)
+        error = 'Flush failed. {}: {}'.format(exception.__class__.__name__, exception)
+        try:
+            self.writer([
+                FormattedResult(order_identifier, utestid_name, raw_value, None, None, error)
+                for order_identifier, utestid_name, raw_value in batch])
+        except Exception:
+            logger.exception('Failed to report {} results as failed.'.format(len(batch)))
+
+    def flush_in_thread(self, batch):
+        close_old_connections()
+        return self.flush(batch)
+
+    def flush(self, batch):
+        """Formats a batch of records for the panels of their orders and passes them to the writer."""
+        order_panels = dict(Order.objects.filter(
+            order_identifier__in=set(order_identifier for order_identifier, _, _ in batch)).values_list(
+                'order_identifier', 'order_panel__name'))
+        spec_catalog = self.get_spec_catalog()
+        panel_specs = {
+            order_panel: {spec.name: spec for spec in spec_catalog.panel_specs(order_panel)}
+            for order_panel in set(order_panels.values())}
+        results = []
+        for order_identifier, utestid_name, raw_value in batch:
+            quantifier = value = error = None
+            try:
+                order_panel = order_panels[order_identifier]
+            except KeyError:
+                error = 'Invalid order identifier. Got {}'.format(order_identifier)
+            else:
+                specs = panel_specs[order_panel]
+                try:
+                    quantifier, value = specs[utestid_name].value_with_quantifier(raw_value)
+                except KeyError:
+                    error = 'Invalid utestid for panel {}. Got {}'.format(order_panel, utestid_name)
+                except (ArithmeticError, TypeError, ValueError) as e:
+                    error = '{}: {}'.format(e.__class__.__name__, e)
+            results.append(FormattedResult(order_identifier, utestid_name, raw_value, quantifier, value, error))
+        self.writer(results)
+        self.flushed += len(results)
+        return results
+
+    def get_spec_catalog(self):
+        """Returns the spec catalog, rebuilt when the catalog changed."""
+        catalog.refresh_if_stale()
+        if self.spec_catalog is None or not catalog.loaded or self.spec_catalog.version != catalog.version:
+            self.spec_catalog = catalog.spec_catalog()
+        return self.spec_catalog
+
+
+class NdjsonResultWriter(object):
+    """A writer for IngestionServer that writes each FormattedResult as a JSON line to an open file."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def __call__(self, results):
+        for result in results:
+            self.f.write(json.dumps(dict(zip(FormattedResult._fields, result)), default=str) + '\n')
+        self.f.flush()
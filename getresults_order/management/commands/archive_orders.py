@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from getresults_order.archive import ARCHIVE_STATUSES, OrderArchive
+
+
+class Command(BaseCommand):
+
+    help = 'Moves completed and cancelled orders older than the retention window to the archive table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='retention window in days (default settings.ORDER_ARCHIVE_RETENTION_DAYS or 365)')
+        parser.add_argument('--status', action='append', dest='statuses',
+                            help='status to archive, may be repeated (default {})'.format(
+                                ', '.join(ARCHIVE_STATUSES)))
+        parser.add_argument('--chunk-size', type=int, default=1000, help='orders per transaction (default 1000)')
+
+    def handle(self, *args, **options):
+        archived = OrderArchive(chunk_size=options['chunk_size']).archive(
+            days=options['days'], statuses=options['statuses'])
+        self.stdout.write('archived {} orders'.format(archived))
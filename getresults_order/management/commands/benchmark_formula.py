@@ -0,0 +1,42 @@
+import ast
+import timeit
+
+from math import log10
+
+from django.core.management.base import BaseCommand
+
+from getresults_order.formula import Formula
+
+
+def literal_eval_calculated_value(formula, raw_value):
+    """The previous Utestid.calculated_value, formatting and parsing the formula for every value."""
+    try:
+        value = ast.literal_eval(formula.format(value=raw_value))
+    except ValueError:
+        if formula == 'LOG10':
+            value = log10(float(raw_value))
+        else:
+            raise ValueError('Invalid formula for caluclated value. See {}')
+    return value
+
+
+class Command(BaseCommand):
+
+    help = 'Compares calculated values using a compiled formula with formatting and ast.literal_eval per value.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000000, help='number of values (default 1000000)')
+        parser.add_argument('--formula', default='LOG10', help='formula (default LOG10)')
+
+    def handle(self, *args, **options):
+        count, formula = options['count'], options['formula']
+        values = [n % 100000 + 1 for n in range(count)]
+        compiled_formula = Formula(formula)
+        literal_eval_seconds = timeit.timeit(
+            lambda: [literal_eval_calculated_value(formula, value) for value in values], number=1)
+        compiled_seconds = timeit.timeit(
+            lambda: [compiled_formula(value) for value in values], number=1)
+        self.stdout.write('formula: {}, values: {}'.format(formula, count))
+        self.stdout.write('  format + literal_eval: {:.3f}s'.format(literal_eval_seconds))
+        self.stdout.write('  compiled formula:      {:.3f}s'.format(compiled_seconds))
+        self.stdout.write('  speedup:               {:.1f}x'.format(literal_eval_seconds / compiled_seconds))
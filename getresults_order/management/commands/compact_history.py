@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from getresults_order.history import compact_history, get_history_model
+
+COMPACT_FIELDS = {'order': ['status']}
+
+
+class Command(BaseCommand):
+
+    help = ('Deletes historical records older than the retention window that add nothing to the audit trail, '
+            'keeping the first and last version of each object and every status change of an order.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='retention window in days (default settings.ORDER_HISTORY_RETENTION_DAYS or 365)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='objects per query (default 500)')
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'ORDER_HISTORY_RETENTION_DAYS', 365)
+        before = timezone.now() - timedelta(days=days)
+        for model in django_apps.get_app_config('getresults_order').get_models():
+            if get_history_model(model) is None:
+                continue
+            deleted = compact_history(
+                model, before, fields=COMPACT_FIELDS.get(model._meta.model_name), chunk_size=options['chunk_size'])
+            self.stdout.write('{}: deleted {} historical records'.format(model._meta.model_name, deleted))
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from getresults_order.export import OrderExport
+
+
+class Command(BaseCommand):
+
+    help = 'Exports orders with their panel name as CSV or NDJSON, streaming rows in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'ndjson'], default='csv',
+                            help='export format (default csv)')
+        parser.add_argument('--output', help='output file (default stdout)')
+        parser.add_argument('--start', help='first order date or datetime, ISO 8601')
+        parser.add_argument('--end', help='last order date or datetime, ISO 8601')
+        parser.add_argument('--panel', dest='order_panel', help='order panel name')
+        parser.add_argument('--status', help='order status')
+
+    def handle(self, *args, **options):
+        try:
+            export = OrderExport(
+                file_format=options['file_format'], start=options['start'], end=options['end'],
+                order_panel=options['order_panel'], status=options['status'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                rows = export.write(f)
+            self.stderr.write('exported {} orders to {}'.format(rows, options['output']))
+        else:
+            export.write(sys.stdout)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from getresults_order.manifest import ManifestImporter
+
+
+class Command(BaseCommand):
+
+    help = 'Imports requisitions and orders from a CSV or NDJSON manifest, resuming from the last saved chunk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', help='manifest file (.csv or .ndjson)')
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'ndjson'],
+                            help='manifest format (default by file extension)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='rows per transaction (default 1000)')
+        parser.add_argument('--errors', dest='error_file', help='write rows that failed to this csv file')
+        parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and import from the start')
+
+    def handle(self, *args, **options):
+        importer = ManifestImporter(
+            options['filename'], file_format=options['file_format'],
+            chunk_size=options['chunk_size'], error_file=options['error_file'])
+        summary = importer.import_manifest(restart=options['restart'])
+        self.stdout.write('rows: {}, requisitions: {}, orders: {}, errors: {}, resumed after line: {}'.format(
+            summary.rows, summary.requisitions, summary.orders, summary.errors, summary.skipped))
+        for line_number, message in importer.errors:
+            self.stdout.write('  line {}: {}'.format(line_number, message))
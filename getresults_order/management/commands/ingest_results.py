@@ -0,0 +1,33 @@
+import asyncio
+import sys
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from getresults_order.ingest import IngestionServer, NdjsonResultWriter
+
+
+class Command(BaseCommand):
+
+    help = 'Receives analyser results as JSON lines over TCP or a unix socket and writes them in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='host to listen on (default 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=9000, help='port to listen on (default 9000)')
+        parser.add_argument('--socket', help='unix socket path to listen on instead of a port')
+        parser.add_argument('--writer', help='dotted path of a writer callable (default JSON lines to stdout)')
+        parser.add_argument('--batch-size', type=int, help='results per flush')
+
+    def handle(self, *args, **options):
+        writer = import_string(options['writer']) if options['writer'] else NdjsonResultWriter(sys.stdout)
+        server = IngestionServer(writer, batch_size=options['batch_size'])
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(server.start(host=options['host'], port=options['port'], path=options['socket']))
+        self.stderr.write('listening on {}'.format(options['socket'] or '{}:{}'.format(
+            options['host'], options['port'])))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(server.close())
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from getresults_order.statistics import rebuild_order_statistics
+
+
+class Command(BaseCommand):
+
+    help = 'Recounts the order statistics per order panel, status and day from the order table.'
+
+    def handle(self, *args, **options):
+        count = rebuild_order_statistics()
+        self.stdout.write('rebuilt {} order statistics'.format(count))
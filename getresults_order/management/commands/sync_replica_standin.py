@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from getresults_order.routers import copy_sqlite_database, write_database
+
+
+class Command(BaseCommand):
+
+    help = 'Copies the primary SQLite database to the SQLite files standing in for read replicas.'
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES[write_database()]
+        for alias in getattr(settings, 'ORDER_READ_DATABASES', None) or []:
+            replica = settings.DATABASES[alias]
+            if not (primary['ENGINE'].endswith('sqlite3') and replica['ENGINE'].endswith('sqlite3')):
+                raise CommandError('The replica stand-in requires SQLite databases. Got {}'.format(alias))
+            copy_sqlite_database(primary['NAME'], replica['NAME'])
+            self.stdout.write('copied {} to {}'.format(primary['NAME'], replica['NAME']))
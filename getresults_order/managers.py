@@ -0,0 +1,304 @@
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from edc_constants.constants import CANCELLED, PENDING
+
+from getresults_aliquot.models import Aliquot
+
+from .choices import STATUS
+from .history import bulk_history_create
+from .order_identifier import allocate_order_identifiers
+from .order_index import order_identifier_index
+from .routers import record_write
+from .statistics import record_order_statistics, statistic_key
+
+LOOKUP_CHUNK_SIZE = 500
+WORKLIST_LIMIT = 100
+CLAIM_ATTEMPTS = 5
+SUBMIT_BATCH_SIZE = 250
+CURSOR_DATETIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+TransitionSummary = namedtuple('TransitionSummary', 'orders skipped')
+SubmissionSummary = namedtuple('SubmissionSummary', 'orders created')
+
+
+def encode_worklist_cursor(order):
+    """Returns a cursor for the position after `order` in a worklist."""
+    order_datetime = order.order_datetime
+    if timezone.is_aware(order_datetime):
+        order_datetime = order_datetime.astimezone(timezone.utc)
+    return '{}.{}'.format(order_datetime.strftime(CURSOR_DATETIME_FORMAT), order.pk)
+
+
+def decode_worklist_cursor(cursor):
+    """Returns a tuple of (order_datetime, pk) for a cursor from encode_worklist_cursor()."""
+    try:
+        order_datetime, pk = cursor.split('.', 1)
+        order_datetime = datetime.strptime(order_datetime, CURSOR_DATETIME_FORMAT)
+    except (AttributeError, ValueError):
+        raise ValueError('Invalid worklist cursor. Got {}'.format(cursor))
+    if settings.USE_TZ:
+        order_datetime = timezone.make_aware(order_datetime, timezone.utc)
+    return order_datetime, pk
+
+
+def aliquots_by_identifier(aliquot_identifiers):
+    """Returns a dictionary of {aliquot_identifier: aliquot} using one IN query per chunk."""
+    aliquot_identifiers = sorted(set(aliquot_identifiers))
+    aliquots = {}
+    for index in range(0, len(aliquot_identifiers), LOOKUP_CHUNK_SIZE):
+        chunk = aliquot_identifiers[index:index + LOOKUP_CHUNK_SIZE]
+        for aliquot in Aliquot.objects.filter(aliquot_identifier__in=chunk):
+            aliquots[aliquot.aliquot_identifier] = aliquot
+    return aliquots
+
+
+class BaseOrderManager(models.Manager):
+
+    @property
+    def write_db(self):
+        """Returns the database alias writes go to, see routers.OrderReadReplicaRouter."""
+        return self._db or router.db_for_write(self.model)
+
+    def bulk_create_orders(self, orders, batch_size=None):
+        """Creates a batch of unsaved orders and returns them with their order identifiers.
+
+        Order identifiers are reserved in one step, the rows and their
+        historical records are written with bulk inserts and post_save
+        is not sent.
+        """
+        orders = list(orders)
+        if not orders:
+            return []
+        self.prepare_orders(orders)
+        self.model.check_archived_order_identifiers(
+            order.order_identifier for order in orders if order.order_identifier)
+        order_identifiers = iter(allocate_order_identifiers(
+            len([order for order in orders if not order.order_identifier])))
+        for order in orders:
+            order.order_identifier = order.order_identifier or next(order_identifiers)
+        with transaction.atomic(using=self.write_db):
+            orders = self.bulk_create(orders, batch_size=batch_size)
+            record_write(self.model)
+            bulk_history_create(self.model, orders, batch_size=batch_size, using=self.write_db)
+            self.record_statistics(orders)
+            order_identifiers = [order.order_identifier for order in orders]
+            transaction.on_commit(
+                lambda: order_identifier_index.add(order_identifiers, model=self.model), using=self.write_db)
+        return orders
+
+    def submit_orders(self, orders, batch_size=None):
+        """Creates the submitted orders that do not exist yet and returns a SubmissionSummary.
+
+        A submitted order exists if an order has its idempotency_key or, unless
+        cancelled, its aliquot_identifier and order_panel. Orders are handled
+        in batches of `batch_size`: existing orders are found with one query
+        per batch and the others are created with bulk_create_orders();
+        duplicates are created once. If a concurrent submission inserts one of
+        them first, the batch is looked up again. Returns the order for each
+        submitted order, existing or new, in the order submitted, and the list
+        of new orders.
+        """
+        orders = list(orders)
+        batch_size = batch_size or SUBMIT_BATCH_SIZE
+        results, created = [], []
+        with transaction.atomic(using=self.write_db):
+            for index in range(0, len(orders), batch_size):
+                batch_results, batch_created = self.submit_batch(orders[index:index + batch_size])
+                results.extend(batch_results)
+                created.extend(batch_created)
+        return SubmissionSummary(results, created)
+
+    def submit_batch(self, orders):
+        """Creates the orders of one batch that do not exist yet, see submit_orders()."""
+        unassigned = [order for order in orders if not order.order_identifier]
+        for attempt in range(2):
+            results, created = self.match_orders(orders, *self.existing_orders(orders))
+            try:
+                self.bulk_create_orders(created)
+            except IntegrityError:
+                if attempt:
+                    raise
+                for order in unassigned:
+                    order.order_identifier = None
+                continue
+            return results, created
+
+    def match_orders(self, orders, existing_by_key, existing_by_aliquot):
+        """Returns a tuple of (the existing or new order for each order, the new orders) for a batch.
+
+        A later duplicate in the batch is matched to the first as if it existed.
+        """
+        results, created = [], []
+        for order in orders:
+            aliquot_key = (order.aliquot_identifier, order.order_panel_id)
+            result = existing_by_key.get(order.idempotency_key) if order.idempotency_key else None
+            if result is None and order.status != CANCELLED:
+                result = existing_by_aliquot.get(aliquot_key)
+            if result is None:
+                result = order
+                created.append(order)
+                if order.idempotency_key:
+                    existing_by_key[order.idempotency_key] = order
+                if order.status != CANCELLED:
+                    existing_by_aliquot[aliquot_key] = order
+            results.append(result)
+        return results, created
+
+    def existing_orders(self, orders):
+        """Returns dictionaries of the existing orders for a batch, by idempotency key and by
+        (aliquot_identifier, order_panel_id), using one query."""
+        idempotency_keys = set(order.idempotency_key for order in orders if order.idempotency_key)
+        aliquot_keys = set(
+            (order.aliquot_identifier, order.order_panel_id) for order in orders if order.status != CANCELLED)
+        by_key, by_aliquot = {}, {}
+        if not idempotency_keys and not aliquot_keys:
+            return by_key, by_aliquot
+        lookup = Q(idempotency_key__in=idempotency_keys) if idempotency_keys else Q()
+        if aliquot_keys:
+            lookup |= ~Q(status=CANCELLED) & Q(
+                aliquot_identifier__in=set(key[0] for key in aliquot_keys),
+                order_panel_id__in=set(key[1] for key in aliquot_keys))
+        for order in self.using(self.write_db).filter(lookup).order_by('order_datetime'):
+            if order.idempotency_key in idempotency_keys:
+                by_key[order.idempotency_key] = order
+            aliquot_key = (order.aliquot_identifier, order.order_panel_id)
+            if order.status != CANCELLED and aliquot_key in aliquot_keys:
+                by_aliquot.setdefault(aliquot_key, order)
+        return by_key, by_aliquot
+
+    def prepare_orders(self, orders):
+        """Prepares a batch of orders before insert. Override to resolve related objects in bulk."""
+        return orders
+
+    def record_statistics(self, orders, previous_keys=None, using=None):
+        """Records new orders, or orders moved from `previous_keys`, in the order statistics."""
+        if not self.model.track_statistics:
+            return
+        changes = Counter()
+        for index, order in enumerate(orders):
+            order._statistic_key = statistic_key(order)
+            changes[order._statistic_key] += 1
+            if previous_keys is not None:
+                changes[previous_keys[index]] -= 1
+        record_order_statistics(changes, using or self.write_db)
+
+    def worklist(self, order_panel, cursor=None, limit=None, status=PENDING):
+        """Returns a tuple of (orders, next cursor) for an order panel, oldest order_datetime first.
+
+        Pass the returned cursor to get the next page; it is None on the last
+        page. Pages are read by key, (order_datetime, pk), not by offset, using
+        the index on (status, order_panel, order_datetime).
+        """
+        limit = limit or WORKLIST_LIMIT
+        queryset = self.filter(status=status, order_panel=order_panel).order_by('order_datetime', 'pk')
+        if cursor:
+            order_datetime, pk = decode_worklist_cursor(cursor)
+            queryset = queryset.filter(
+                Q(order_datetime__gt=order_datetime) | Q(order_datetime=order_datetime, pk__gt=pk))
+        orders = list(queryset[:limit + 1])
+        if len(orders) > limit:
+            return orders[:limit], encode_worklist_cursor(orders[limit - 1])
+        return orders, None
+
+    def claim(self, order_panel, claimed_by, count):
+        """Claims up to `count` unclaimed pending orders of an order panel, oldest first, and returns them.
+
+        Each order is claimed with a conditional update on claimed_by so an
+        order claimed concurrently by another analyser is skipped and the
+        next unclaimed order is tried instead. Orders are read from the
+        primary database.
+        """
+        claimed_datetime = timezone.now()
+        claimed = []
+        for _ in range(CLAIM_ATTEMPTS):
+            pks = list(self.using(self.write_db).filter(
+                status=PENDING, order_panel=order_panel, claimed_by__isnull=True).order_by(
+                    'order_datetime', 'pk').values_list('pk', flat=True)[:count - len(claimed)])
+            if not pks:
+                break
+            with transaction.atomic(using=self.write_db):
+                self.filter(pk__in=pks, status=PENDING, claimed_by__isnull=True).update(
+                    claimed_by=claimed_by, claimed_datetime=claimed_datetime)
+                record_write(self.model)
+                orders = list(self.filter(pk__in=pks, claimed_by=claimed_by, claimed_datetime=claimed_datetime))
+                bulk_history_create(self.model, orders, history_type='~', using=self.write_db)
+            claimed.extend(orders)
+            if len(claimed) >= count:
+                break
+        return sorted(claimed, key=lambda order: (order.order_datetime, order.pk))
+
+    def transition(self, orders, status, from_status=PENDING, history_user=None):
+        """Moves orders, or order pks, with status `from_status` to `status` and returns a TransitionSummary.
+
+        Per chunk of orders, the orders still in `from_status` are locked and
+        read, updated with one UPDATE ... WHERE id IN (...) AND status =
+        `from_status` and their historical records are written with one bulk
+        insert; save() is not called. Returns the updated orders and the pks
+        of the orders skipped because they were not in `from_status`, e.g.
+        changed by a concurrent update.
+        """
+        statuses = [value for value, _ in STATUS]
+        for value in [status, from_status]:
+            if value not in statuses:
+                raise ValueError('Invalid order status. Expected one of {}. Got {}'.format(statuses, value))
+        if status == from_status:
+            raise ValueError('Invalid order status transition. Got {} to {}'.format(from_status, status))
+        pks = list(dict.fromkeys(getattr(order, 'pk', order) for order in orders))
+        transitioned = []
+        with transaction.atomic(using=self.write_db):
+            for index in range(0, len(pks), LOOKUP_CHUNK_SIZE):
+                chunk = list(self.using(self.write_db).select_for_update().filter(
+                    pk__in=pks[index:index + LOOKUP_CHUNK_SIZE], status=from_status))
+                if not chunk:
+                    continue
+                self.using(self.write_db).filter(
+                    pk__in=[order.pk for order in chunk], status=from_status).update(status=status)
+                record_write(self.model)
+                previous_keys = [statistic_key(order) for order in chunk]
+                for order in chunk:
+                    order.status = status
+                bulk_history_create(
+                    self.model, chunk, history_type='~', history_user=history_user, using=self.write_db)
+                self.record_statistics(chunk, previous_keys)
+                transitioned.extend(chunk)
+        updated = set(order.pk for order in transitioned)
+        return TransitionSummary(transitioned, [pk for pk in pks if pk not in updated])
+
+    def release_claims(self, claimed_by):
+        """Returns the pending orders claimed by `claimed_by` to the worklist and returns them."""
+        with transaction.atomic(using=self.write_db):
+            orders = list(self.filter(status=PENDING, claimed_by=claimed_by))
+            self.filter(pk__in=[order.pk for order in orders]).update(claimed_by=None, claimed_datetime=None)
+            record_write(self.model)
+            for order in orders:
+                order.claimed_by, order.claimed_datetime = None, None
+            bulk_history_create(self.model, orders, history_type='~', using=self.write_db)
+        return orders
+
+
+class OrderManager(BaseOrderManager):
+
+    def make_order(self, aliquot, order_panel):
+        """Returns an unsaved order for an aliquot and order panel."""
+        return self.model(aliquot=aliquot, aliquot_identifier=aliquot.aliquot_identifier, order_panel=order_panel)
+
+    def prepare_orders(self, orders):
+        """Resolves the aliquot of each order using one query for the batch."""
+        aliquots = aliquots_by_identifier(
+            order.aliquot_identifier for order in orders if not order.aliquot_id)
+        for order in orders:
+            if order.aliquot_id:
+                order.aliquot_identifier = order.aliquot.aliquot_identifier
+            else:
+                try:
+                    order.aliquot = aliquots[order.aliquot_identifier]
+                except KeyError:
+                    raise Aliquot.DoesNotExist(
+                        'Aliquot matching query does not exist. Got aliquot_identifier=\'{}\''.format(
+                            order.aliquot_identifier))
+        return orders
@@ -0,0 +1,231 @@
+import csv
+import json
+import os
+
+from collections import namedtuple
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .configure import file_checksum
+from .managers import aliquots_by_identifier
+from .models import ManifestCheckpoint, Order, OrderPanel, Requisition
+
+ImportSummary = namedtuple('ImportSummary', 'rows requisitions orders errors skipped')
+
+REQUIRED_FIELDS = ['requisition_identifier', 'subject_identifier', 'specimen_identifier', 'panels']
+
+
+class ManifestError(ValueError):
+    pass
+
+
+class ManifestImporter(object):
+    """Imports requisitions, their panels and the resulting orders from a CSV or NDJSON manifest.
+
+    Each row is one requisition with the fields requisition_identifier,
+    subject_identifier, specimen_identifier, specimen_type,
+    requisition_datetime (ISO 8601, optional), aliquot_identifier (optional,
+    defaults to the specimen_identifier) and panels, the order panel names
+    separated by ';' (or a list in NDJSON). An order is created for each panel.
+
+    The file is read as a stream and saved in chunks of `chunk_size` rows, one
+    transaction per chunk. The last line of each saved chunk is recorded in a
+    ManifestCheckpoint for the file's checksum, so importing the same file
+    again resumes after the last saved chunk. A row that fails validation or
+    cannot be saved is reported with its line number and does not stop the
+    import; errors are written to `error_file` as CSV if given.
+
+        importer = ManifestImporter('manifest.csv', chunk_size=1000)
+        summary = importer.import_manifest()
+    """
+
+    def __init__(self, filename, file_format=None, chunk_size=None, error_file=None):
+        self.filename = filename
+        self.file_format = file_format or ('ndjson' if os.path.splitext(filename)[1].lower() in [
+            '.ndjson', '.jsonl', '.json'] else 'csv')
+        if self.file_format not in ['csv', 'ndjson']:
+            raise ManifestError('Invalid manifest format. Expected csv or ndjson. Got {}'.format(file_format))
+        self.chunk_size = chunk_size or 1000
+        self.error_file = error_file
+        self.errors = []
+        self.order_panels = None
+
+    def import_manifest(self, restart=False):
+        """Imports the manifest from its checkpoint, or from the first row if `restart`, and
+        returns an ImportSummary."""
+        checksum = self.checksum()
+        checkpoint, _ = ManifestCheckpoint.objects.get_or_create(
+            checksum=checksum, defaults={'filename': self.filename})
+        start_line = 0 if restart else checkpoint.line_number
+        self.order_panels = {order_panel.name: order_panel for order_panel in OrderPanel.objects.all()}
+        rows = requisitions = orders = errors = 0
+        error_writer = None
+        with open(self.error_file, 'w') if self.error_file else open(os.devnull, 'w') as error_f:
+            if self.error_file:
+                error_writer = csv.writer(error_f)
+                error_writer.writerow(['line_number', 'requisition_identifier', 'error'])
+            for chunk in self.chunks(start_line):
+                saved_requisitions, saved_orders, chunk_errors = self.import_chunk(chunk)
+                rows += len(chunk)
+                requisitions += saved_requisitions
+                orders += saved_orders
+                errors += len(chunk_errors)
+                for line_number, row, message in chunk_errors:
+                    if error_writer:
+                        error_writer.writerow([line_number, row.get('requisition_identifier'), message])
+                    else:
+                        self.errors.append((line_number, message))
+        ManifestCheckpoint.objects.filter(pk=checkpoint.pk).update(complete=True)
+        return ImportSummary(rows, requisitions, orders, errors, start_line)
+
+    def import_chunk(self, chunk):
+        """Validates and saves a chunk with its checkpoint in one transaction.
+
+        If saving the chunk fails, its rows are saved one by one so only the
+        failing rows are reported. Returns a tuple of (requisitions, orders, errors).
+        """
+        valid_rows, errors = self.validate(chunk)
+        last_line_number = chunk[-1][0]
+        try:
+            with transaction.atomic():
+                requisitions, orders = self.save(valid_rows)
+                self.save_checkpoint(last_line_number)
+        except DatabaseError:
+            requisitions = orders = 0
+            for valid_row in valid_rows:
+                try:
+                    with transaction.atomic():
+                        saved_requisitions, saved_orders = self.save([valid_row])
+                except DatabaseError as e:
+                    errors.append((valid_row[0], valid_row[1], str(e)))
+                else:
+                    requisitions += saved_requisitions
+                    orders += saved_orders
+            self.save_checkpoint(last_line_number)
+        return requisitions, orders, sorted(errors, key=lambda error: error[0])
+
+    def validate(self, chunk):
+        """Returns a tuple of (valid rows, errors) for a chunk.
+
+        A valid row is a tuple of (line_number, row, requisition, order panels, aliquot).
+        Aliquots and existing requisitions are fetched with one query each.
+        """
+        errors, parsed = [], []
+        for line_number, row in chunk:
+            try:
+                parsed.append((line_number, row) + self.parse(row))
+            except (ManifestError, KeyError, TypeError, ValueError) as e:
+                errors.append((line_number, row, str(e)))
+        aliquots = aliquots_by_identifier(aliquot_identifier for _, _, _, _, aliquot_identifier in parsed)
+        existing = set(Requisition.objects.filter(
+            requisition_identifier__in=[requisition.requisition_identifier for _, _, requisition, _, _ in parsed]
+        ).values_list('requisition_identifier', flat=True))
+        valid_rows = []
+        for line_number, row, requisition, order_panels, aliquot_identifier in parsed:
+            if requisition.requisition_identifier in existing:
+                errors.append((line_number, row, 'Requisition {} already exists'.format(
+                    requisition.requisition_identifier)))
+            elif aliquot_identifier not in aliquots:
+                errors.append((line_number, row, 'Invalid aliquot identifier. Got {}'.format(aliquot_identifier)))
+            else:
+                existing.add(requisition.requisition_identifier)
+                valid_rows.append((line_number, row, requisition, order_panels, aliquots[aliquot_identifier]))
+        return valid_rows, errors
+
+    def parse(self, row):
+        """Returns a tuple of (unsaved requisition, order panels, aliquot_identifier) for a row."""
+        for field in REQUIRED_FIELDS:
+            if not row.get(field):
+                raise ManifestError('Missing {}'.format(field))
+        panel_names = row['panels']
+        if not isinstance(panel_names, list):
+            panel_names = str(panel_names).split(';')
+        order_panels = []
+        for name in panel_names:
+            try:
+                order_panels.append(self.order_panels[str(name).strip()])
+            except KeyError:
+                raise ManifestError('Invalid order panel. Got {}'.format(name))
+        requisition_datetime = None
+        if row.get('requisition_datetime'):
+            requisition_datetime = parse_datetime(str(row['requisition_datetime']))
+            if requisition_datetime is None:
+                raise ManifestError('Invalid requisition_datetime. Got {}'.format(row['requisition_datetime']))
+            if timezone.is_naive(requisition_datetime):
+                requisition_datetime = timezone.make_aware(requisition_datetime)
+        requisition = Requisition(
+            requisition_identifier=to_text(row['requisition_identifier']),
+            subject_identifier=to_text(row['subject_identifier']),
+            specimen_identifier=to_text(row['specimen_identifier']),
+            specimen_type=to_text(row.get('specimen_type')),
+            requisition_datetime=requisition_datetime)
+        aliquot_identifier = to_text(row.get('aliquot_identifier')) or requisition.specimen_identifier
+        return requisition, order_panels, aliquot_identifier
+
+    def save(self, valid_rows):
+        """Bulk inserts the requisitions, their panels and orders; returns (requisitions, orders)."""
+        if not valid_rows:
+            return 0, 0
+        requisitions = Requisition.objects.bulk_create([requisition for _, _, requisition, _, _ in valid_rows])
+        Requisition.tests.through.objects.bulk_create([
+            Requisition.tests.through(requisition_id=requisition.pk, orderpanel_id=order_panel.pk)
+            for requisition, (_, _, _, order_panels, _) in zip(requisitions, valid_rows)
+            for order_panel in order_panels])
+        orders = Order.objects.bulk_create_orders([
+            Order.objects.make_order(aliquot, order_panel)
+            for _, _, _, order_panels, aliquot in valid_rows
+            for order_panel in order_panels])
+        return len(requisitions), len(orders)
+
+    def save_checkpoint(self, line_number):
+        ManifestCheckpoint.objects.filter(checksum=self.checksum()).update(line_number=line_number)
+
+    def chunks(self, start_line=0):
+        """Yields lists of up to chunk_size (line_number, row) tuples after `start_line`."""
+        chunk = []
+        for line_number, row in self.read():
+            if line_number <= start_line:
+                continue
+            chunk.append((line_number, row))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def read(self):
+        """Yields (line_number, row) for each row of the manifest; a row is a dictionary.
+
+        An NDJSON line that is not a JSON object is yielded as an empty row so it
+        is reported as an error.
+        """
+        with open(self.filename, 'r') as f:
+            if self.file_format == 'csv':
+                reader = csv.reader(f)
+                header = [h.strip().lower() for h in next(reader)]
+                for row in reader:
+                    if row:
+                        yield reader.line_num, dict(zip(header, row))
+            else:
+                for line_number, line in enumerate(f, start=1):
+                    if line.strip():
+                        try:
+                            row = json.loads(line)
+                        except ValueError:
+                            row = {}
+                        yield line_number, row if isinstance(row, dict) else {}
+
+    def checksum(self):
+        """Returns the sha256 hex digest of the manifest, computed once."""
+        try:
+            return self._checksum
+        except AttributeError:
+            self._checksum = file_checksum(self.filename)
+            return self._checksum
+
+
+def to_text(value):
+    """Returns a manifest value as a stripped string; NDJSON values may be numbers."""
+    return '' if value is None else str(value).strip()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getresults_order', '0006_manifestcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalorder',
+            name='claimed_by',
+            field=models.CharField(editable=False, help_text='analyser or user that claimed the order from the worklist', max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='historicalorder',
+            name='claimed_datetime',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='claimed_by',
+            field=models.CharField(editable=False, help_text='analyser or user that claimed the order from the worklist', max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='claimed_datetime',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='order',
+            index_together=set([('status', 'order_panel', 'order_datetime')]),
+        ),
+    ]
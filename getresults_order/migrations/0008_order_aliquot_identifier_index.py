@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getresults_order', '0007_order_worklist'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historicalorder',
+            name='aliquot_identifier',
+            field=models.CharField(db_index=True, max_length=25),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='aliquot_identifier',
+            field=models.CharField(db_index=True, max_length=25),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import django_extensions.db.fields
+import django_revision.revision_field
+import edc_base.model.fields.hostname_modification_field
+import edc_base.model.fields.userfield
+import edc_base.model.fields.uuid_auto_field
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getresults_aliquot', '__first__'),
+        ('getresults_order', '0008_order_aliquot_identifier_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('user_created', edc_base.model.fields.userfield.UserField(editable=False, max_length=50, verbose_name='user created')),
+                ('user_modified', edc_base.model.fields.userfield.UserField(editable=False, max_length=50, verbose_name='user modified')),
+                ('hostname_created', models.CharField(default='mac2-2.local', editable=False, help_text='System field. (modified on create only)', max_length=50)),
+                ('hostname_modified', edc_base.model.fields.hostname_modification_field.HostnameModificationField(editable=False, help_text='System field. (modified on every save)', max_length=50)),
+                ('revision', django_revision.revision_field.RevisionField(blank=True, editable=False, help_text='System field. Git repository tag:branch:commit.', max_length=75, null=True, verbose_name='Revision')),
+                ('id', edc_base.model.fields.uuid_auto_field.UUIDAutoField(editable=False, help_text='System field. UUID primary key.', primary_key=True, serialize=False)),
+                ('order_identifier', models.CharField(editable=False, max_length=50, unique=True)),
+                ('order_datetime', models.DateTimeField(default=django.utils.timezone.now)),
+                ('aliquot_identifier', models.CharField(db_index=True, max_length=25)),
+                ('status', models.CharField(default='PENDING', max_length=25)),
+                ('claimed_by', models.CharField(editable=False, help_text='analyser or user that claimed the order from the worklist', max_length=50, null=True)),
+                ('claimed_datetime', models.DateTimeField(editable=False, null=True)),
+                ('archived_datetime', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('aliquot', models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='getresults_aliquot.Aliquot')),
+                ('order_panel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='getresults_order.OrderPanel')),
+            ],
+            options={
+                'db_table': 'getresults_archivedorder',
+                'ordering': ('order_identifier',),
+            },
+        ),
+    ]
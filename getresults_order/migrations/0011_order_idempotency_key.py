@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# One order per aliquot and panel unless cancelled. Partial indexes are
+# supported by PostgreSQL and SQLite; on other backends duplicates are
+# only detected by BaseOrderManager.submit_orders. Cancel existing
+# duplicates before migrating.
+ACTIVE_ORDER_INDEX = 'getresults_order_aliquot_panel_active_uniq'
+PARTIAL_INDEX_VENDORS = ['postgresql', 'sqlite']
+
+
+def create_active_order_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute(
+            'CREATE UNIQUE INDEX {} ON getresults_order (aliquot_identifier, order_panel_id) '
+            'WHERE status <> \'CANCELLED\''.format(ACTIVE_ORDER_INDEX))
+
+
+def drop_active_order_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute('DROP INDEX {}'.format(ACTIVE_ORDER_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getresults_order', '0010_orderstatistic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, help_text='key sent by the client with a submission so a resubmission returns this order', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='historicalorder',
+            name='idempotency_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='key sent by the client with a submission so a resubmission returns this order', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, help_text='key sent by the client with a submission so a resubmission returns this order', max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(create_active_order_index, drop_active_order_index),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Indexes for the case insensitive prefix search on names in the admin.
+# istartswith is UPPER(name) LIKE on PostgreSQL and LIKE, case
+# insensitive, on SQLite; on MySQL the column index is used.
+NAME_SEARCH_INDEXES = [
+    ('getresults_orderpanel_name_upper', 'getresults_orderpanel'),
+    ('getresults_utestid_name_upper', 'getresults_utestid'),
+]
+NAME_SEARCH_INDEX_SQL = {
+    'postgresql': 'CREATE INDEX {} ON {} (UPPER(name::text) text_pattern_ops)',
+    'sqlite': 'CREATE INDEX {} ON {} (name COLLATE NOCASE)',
+}
+
+
+def create_name_search_indexes(apps, schema_editor):
+    sql = NAME_SEARCH_INDEX_SQL.get(schema_editor.connection.vendor)
+    if sql:
+        for index_name, db_table in NAME_SEARCH_INDEXES:
+            schema_editor.execute(sql.format(index_name, db_table))
+
+
+def drop_name_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in NAME_SEARCH_INDEX_SQL:
+        for index_name, db_table in NAME_SEARCH_INDEXES:
+            schema_editor.execute('DROP INDEX {}'.format(index_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getresults_order', '0011_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_search_indexes, drop_name_search_indexes),
+    ]
@@ -1,16 +1,18 @@
-import ast
-
-from math import log10
-
 from django.db import models
 from django.utils import timezone
-from simple_history.models import HistoricalRecords as AuditTrail
 from edc_base.model.models import BaseUuidModel
 from edc_constants.constants import PENDING
 from getresults_aliquot.models import Aliquot
 
 from .choices import VALUE_DATATYPES, VALUE_TYPES
-from .order_identifier import OrderIdentifier
+from .formatting import format_value, format_value_with_quantifier, format_values, format_values_with_quantifier
+from .formula import get_formula
+from .history import DeferredHistoricalRecords as AuditTrail
+from .managers import BaseOrderManager, OrderManager
+from .order_identifier import next_order_identifier
+from .statistics import record_order_change, statistic_key
+
+STATISTIC_FIELDS = set(['order_panel_id', 'status', 'order_datetime'])
 
 
 class OrderPanel(BaseUuidModel):
@@ -31,6 +33,104 @@ class OrderPanel(BaseUuidModel):
         ordering = ('name', )
 
 
+class OrderIdentifierSequence(BaseUuidModel):
+    """High-water mark of a sequence of order identifiers, stored as an integer.
+
+    See order_identifier.reserve_order_identifiers."""
+
+    name = models.CharField(
+        max_length=25,
+        unique=True
+    )
+
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        app_label = 'getresults_order'
+        db_table = 'getresults_orderidentifiersequence'
+
+
+class OrderIdentifierBlock(BaseUuidModel):
+    """An unused range of order identifiers returned by an OrderIdentifierLease."""
+
+    name = models.CharField(max_length=25)
+
+    first_value = models.BigIntegerField()
+
+    last_value = models.BigIntegerField()
+
+    def __str__(self):
+        return '{}: {}-{}'.format(self.name, self.first_value, self.last_value)
+
+    class Meta:
+        app_label = 'getresults_order'
+        db_table = 'getresults_orderidentifierblock'
+        ordering = ('name', 'first_value')
+
+
+class CatalogVersion(BaseUuidModel):
+    """Version stamp of the order panel and utestid catalog, see catalog.Catalog."""
+
+    name = models.CharField(
+        max_length=25,
+        unique=True
+    )
+
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '{}: {}'.format(self.name, self.version)
+
+    class Meta:
+        app_label = 'getresults_order'
+        db_table = 'getresults_catalogversion'
+
+
+class CatalogChecksum(BaseUuidModel):
+    """Checksum of the csv file the catalog was last loaded from, see configure.Configure."""
+
+    name = models.CharField(
+        max_length=25,
+        unique=True
+    )
+
+    filename = models.CharField(max_length=250)
+
+    checksum = models.CharField(max_length=64)
+
+    def __str__(self):
+        return '{}: {}'.format(self.name, self.filename)
+
+    class Meta:
+        app_label = 'getresults_order'
+        db_table = 'getresults_catalogchecksum'
+
+
+class ManifestCheckpoint(BaseUuidModel):
+    """Last line of a manifest file saved by manifest.ManifestImporter, keyed by the file's checksum."""
+
+    checksum = models.CharField(
+        max_length=64,
+        unique=True
+    )
+
+    filename = models.CharField(max_length=250)
+
+    line_number = models.IntegerField(default=0)
+
+    complete = models.BooleanField(default=False)
+
+    def __str__(self):
+        return '{}: {}'.format(self.filename, self.line_number)
+
+    class Meta:
+        app_label = 'getresults_order'
+        db_table = 'getresults_manifestcheckpoint'
+
+
 class Requisition(BaseUuidModel):
 
     subject_identifier = models.CharField(max_length=25)
@@ -65,21 +165,73 @@ class BaseOrder(BaseUuidModel):
 
     order_panel = models.ForeignKey(OrderPanel)
 
-    aliquot_identifier = models.CharField(max_length=25)
+    aliquot_identifier = models.CharField(
+        max_length=25,
+        db_index=True)
 
     status = models.CharField(
         max_length=25, default=PENDING)
 
+    claimed_by = models.CharField(
+        max_length=50,
+        null=True,
+        editable=False,
+        help_text='analyser or user that claimed the order from the worklist')
+
+    claimed_datetime = models.DateTimeField(
+        null=True,
+        editable=False)
+
+    idempotency_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+        help_text='key sent by the client with a submission so a resubmission returns this order')
+
+    objects = BaseOrderManager()
+
     history = AuditTrail()
 
+    track_statistics = False
+
     def __str__(self):
         return '{}: {}'.format(self.order_identifier, self.order_panel)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(BaseOrder, cls).from_db(db, field_names, values)
+        if STATISTIC_FIELDS.issubset(field_names):
+            instance._statistic_key = statistic_key(instance)
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.order_identifier:
-            order_identifier = OrderIdentifier()
-            self.order_identifier = next(order_identifier)
+            self.order_identifier = next_order_identifier()
+        elif self._state.adding:
+            self.check_archived_order_identifiers([self.order_identifier])
+        adding = self._state.adding
         super(BaseOrder, self).save(*args, **kwargs)
+        if self.track_statistics and (adding or hasattr(self, '_statistic_key')):
+            self._statistic_key = record_order_change(
+                None if adding else self._statistic_key, self, self._state.db)
+
+    @classmethod
+    def check_archived_order_identifiers(cls, order_identifiers):
+        """Raises a ValueError if an order identifier given for a new order is used by an archived order.
+
+        Identifiers issued from the sequence are not checked, the sequence
+        includes the archive.
+        """
+        order_identifiers = list(order_identifiers)
+        if cls is ArchivedOrder:
+            return
+        for index in range(0, len(order_identifiers), 500):
+            archived = list(ArchivedOrder.objects.filter(
+                order_identifier__in=order_identifiers[index:index + 500]).values_list('order_identifier', flat=True))
+            if archived:
+                raise ValueError('Order identifier {} is used by an archived order.'.format(', '.join(archived)))
 
     class Meta:
         abstract = True
@@ -89,10 +241,13 @@ class Order(BaseOrder):
 
     aliquot = models.ForeignKey(Aliquot, null=True, editable=False)
 
+    objects = OrderManager()
+
     history = AuditTrail()
 
+    track_statistics = True
+
     def save(self, *args, **kwargs):
-        self.order_identifier = self.order_identifier or OrderIdentifier(None)
         if not self.aliquot:
             self.aliquot = Aliquot.objects.get(aliquot_identifier=self.aliquot_identifier)
         else:
@@ -103,6 +258,42 @@ class Order(BaseOrder):
         app_label = 'getresults_order'
         db_table = 'getresults_order'
         ordering = ('order_identifier', )
+        index_together = (('status', 'order_panel', 'order_datetime'), )
+
+
+class ArchivedOrder(BaseOrder):
+    """An order moved out of the order table by archive.archive_orders, keeping its id and identifier."""
+
+    aliquot = models.ForeignKey(Aliquot, null=True, editable=False)
+
+    archived_datetime = models.DateTimeField(
+        default=timezone.now,
+        editable=False)
+
+    class Meta:
+        app_label = 'getresults_order'
+        db_table = 'getresults_archivedorder'
+        ordering = ('order_identifier', )
+
+
+class OrderStatistic(BaseUuidModel):
+    """The number of orders of an order panel with a status on a day, see statistics."""
+
+    order_panel = models.ForeignKey(OrderPanel)
+
+    status = models.CharField(max_length=25)
+
+    order_date = models.DateField(db_index=True)
+
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '{} {} {}: {}'.format(self.order_panel, self.status, self.order_date, self.count)
+
+    class Meta:
+        app_label = 'getresults_order'
+        db_table = 'getresults_orderstatistic'
+        unique_together = (('order_panel', 'status', 'order_date'), )
 
 
 class Utestid(BaseUuidModel):
@@ -171,36 +362,25 @@ class Utestid(BaseUuidModel):
 
     def value(self, raw_value, value_type=None):
         """Returns the value as the type defined in value_type."""
-        value_type = value_type or self.value_type
-        if self.value_type == 'calculated':
-            raw_value = self.calculated_value(raw_value)
-        if self.value_datatype == 'string':
-            return str(raw_value)
-        elif self.value_datatype == 'integer':
-            return int(round(float(raw_value), 0))
-        elif self.value_datatype == 'decimal':
-            return round(float(raw_value), self.precision)
-        else:
-            raise ValueError('Invalid utestid.value_type. Got \'{}\''.format(value_type))
-        return None
+        return format_value(self, raw_value, value_type)
 
     def calculated_value(self, raw_value):
-        """Returns the value as the type defined in value_type.
+        """Returns the value calculated by applying the formula to the raw value.
 
-        Formulas may use basic operators such as 1 + 1 that can be evaluted
-        by ast.literla_eval.
+        Formulas may use basic operators such as {value} * 1000 and the functions
+        log10, ln, exp and sqrt. The formula is compiled once and cached by
+        its text, see formula.Formula.
 
-        Allowed functions (so far):
-            LOG10: if the formula is 'LOG10', the returned value will be log10 of value.
+        Allowed functions:
+            LOG10, LN, EXP, SQRT: if the formula is only the function name, the returned value
+            will be the function of value, e.g. 'LOG10'.
         """
-        try:
-            value = ast.literal_eval(self.formula.format(value=raw_value))
-        except ValueError:
-            if self.formula == 'LOG10':
-                value = log10(float(raw_value))
-            else:
-                raise ValueError('Invalid formula for caluclated value. See {}')
-        return value
+        return self.compiled_formula(raw_value)
+
+    @property
+    def compiled_formula(self):
+        """Returns the compiled formula, cached by the formula text."""
+        return get_formula(self.formula)
 
     def value_with_quantifier(self, raw_value):
         """Returns a tuple of (quantifier, value) given a raw value.
@@ -211,15 +391,19 @@ class Utestid(BaseUuidModel):
             * if the upper limit of detection is 750000, a value of 750000 returns ('=', 750000)
               and a value of 750001 returns ('>', 750000)
         """
-        value = self.value(raw_value)
-        try:
-            if value < self.lower_limit:
-                return ('<', self.value(self.lower_limit, 'absolute'))
-            elif value > self.upper_limit:
-                return ('>', self.value(self.upper_limit, 'absolute'))
-        except TypeError:
-            pass
-        return ('=', value)
+        return format_value_with_quantifier(self, raw_value)
+
+    def values(self, raw_values):
+        """Returns a batch of raw values formatted as value() would, see formatting.format_values."""
+        return format_values(self, raw_values)
+
+    def values_with_quantifier(self, raw_values):
+        """Returns a tuple of (quantifiers, values) for a batch of raw values.
+
+        Each pair is what value_with_quantifier() returns for the raw value,
+        see formatting.format_values_with_quantifier.
+        """
+        return format_values_with_quantifier(self, raw_values)
 
     class Meta:
         app_label = 'getresults_order'
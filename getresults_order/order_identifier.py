@@ -1,3 +1,16 @@
+import atexit
+import os
+import re
+import threading
+import time
+
+from string import ascii_uppercase, digits
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, router, transaction
+from django.db.models import F, Max
+
 from edc_identifier.alphanumeric_identifier import AlphanumericIdentifier
 
 
@@ -8,3 +21,347 @@ class OrderIdentifier(AlphanumericIdentifier):
     numeric_pattern = r'^[0-9]{5}$'
     seed = ['AAA', '00000']
     separator = None
+
+
+ALPHA_LENGTH = len(OrderIdentifier.seed[0])
+NUMERIC_LENGTH = len(OrderIdentifier.seed[1])
+NUMERIC_BASE = 10 ** NUMERIC_LENGTH
+MAX_ENCODED_IDENTIFIER = len(ascii_uppercase) ** ALPHA_LENGTH * NUMERIC_BASE - 1
+ORDER_IDENTIFIER_REGEX = r'^[A-Z]{{{}}}[0-9]{{{}}}$'.format(ALPHA_LENGTH, NUMERIC_LENGTH)
+
+
+def encode_order_identifier(identifier):
+    """Returns the position of an order identifier in the sequence, e.g. AAA00001 -> 1."""
+    alpha, numeric = identifier[:ALPHA_LENGTH], identifier[ALPHA_LENGTH:]
+    valid = len(identifier) == ALPHA_LENGTH + NUMERIC_LENGTH and numeric.isdigit()
+    if not valid or any(c not in ascii_uppercase for c in alpha):
+        raise ValueError('Invalid order identifier. Got \'{}\''.format(identifier))
+    value = 0
+    for c in alpha:
+        value = value * len(ascii_uppercase) + ascii_uppercase.index(c)
+    return value * NUMERIC_BASE + int(numeric)
+
+
+def decode_order_identifier(value):
+    """Returns the order identifier at a position in the sequence, e.g. 1 -> AAA00001."""
+    if not 0 <= value <= MAX_ENCODED_IDENTIFIER:
+        raise ValueError('Order identifier sequence exhausted or invalid. Got {}'.format(value))
+    alpha_value, numeric = divmod(value, NUMERIC_BASE)
+    alpha = ''
+    for _ in range(ALPHA_LENGTH):
+        alpha_value, index = divmod(alpha_value, len(ascii_uppercase))
+        alpha = ascii_uppercase[index] + alpha
+    return '{}{}'.format(alpha, str(numeric).zfill(NUMERIC_LENGTH))
+
+
+def highest_order_identifier(using=None):
+    """Returns the highest encoded order identifier found in the order tables of database `using`, or 0."""
+    from .models import BaseOrder
+    using = using or router.db_for_write(django_apps.get_model('getresults_order', 'OrderIdentifierSequence'))
+    table_names = connections[using].introspection.table_names()
+    highest = 0
+    for model in django_apps.get_models():
+        if issubclass(model, BaseOrder) and model._meta.db_table in table_names:
+            identifier = model.objects.using(using).filter(
+                order_identifier__regex=ORDER_IDENTIFIER_REGEX).aggregate(
+                    Max('order_identifier')).get('order_identifier__max')
+            if identifier:
+                highest = max(highest, encode_order_identifier(identifier))
+    return highest
+
+
+# backends that lock the whole database for a write; a second connection
+# would wait on the caller's own transaction
+DATABASE_LOCK_VENDORS = ['sqlite']
+
+
+def independent_connection(using):
+    """Returns a new connection to `using` if the caller is in a transaction; the caller closes it.
+
+    Returns None if the connection is not in a transaction, or if its
+    backend locks the whole database for a write, see DATABASE_LOCK_VENDORS.
+    """
+    caller_connection = connections[using]
+    if not caller_connection.in_atomic_block or caller_connection.vendor in DATABASE_LOCK_VENDORS:
+        return None
+    return caller_connection.__class__(caller_connection.settings_dict, using)
+
+
+def reserve_order_values_independently(independent, count, name):
+    """Returns the last value of `count` values reserved and committed on an independent connection.
+
+    Returns None if the sequence does not exist yet. The connection is
+    closed before returning.
+    """
+    OrderIdentifierSequence = django_apps.get_model('getresults_order', 'OrderIdentifierSequence')
+    table = independent.ops.quote_name(OrderIdentifierSequence._meta.db_table)
+    independent.set_autocommit(False)
+    try:
+        with independent.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {} SET last_value = last_value + %s WHERE name = %s'.format(table), [count, name])
+            last_value = None
+            if cursor.rowcount:
+                cursor.execute('SELECT last_value FROM {} WHERE name = %s'.format(table), [name])
+                last_value = cursor.fetchone()[0]
+        independent.commit()
+    except Exception:
+        independent.rollback()
+        raise
+    finally:
+        independent.close()
+    return last_value
+
+
+def reserve_order_values(count, name=None):
+    """Returns a tuple of (first, last) for `count` consecutive encoded order identifiers
+    reserved in one transaction.
+
+    The high-water mark is kept in OrderIdentifierSequence and is seeded from
+    the existing order tables the first time the sequence is used. If the
+    caller is in a transaction, the values are reserved and committed on an
+    independent connection, so the sequence row is not locked until the
+    caller commits; see independent_connection().
+    """
+    OrderIdentifierSequence = django_apps.get_model('getresults_order', 'OrderIdentifierSequence')
+    name = name or OrderIdentifier.name
+    using = router.db_for_write(OrderIdentifierSequence)
+    independent = independent_connection(using)
+    if independent is not None:
+        last_value = reserve_order_values_independently(independent, count, name)
+        if last_value is not None:
+            return check_reserved_values(last_value, count)
+    with transaction.atomic(using=using):
+        updated = OrderIdentifierSequence.objects.filter(name=name).update(
+            last_value=F('last_value') + count)
+        if not updated:
+            try:
+                with transaction.atomic(using=using):
+                    OrderIdentifierSequence.objects.create(
+                        name=name, last_value=highest_order_identifier(using) + count)
+            except IntegrityError:
+                OrderIdentifierSequence.objects.filter(name=name).update(
+                    last_value=F('last_value') + count)
+        last_value = OrderIdentifierSequence.objects.filter(
+            name=name).values_list('last_value', flat=True)[0]
+    return check_reserved_values(last_value, count)
+
+
+def check_reserved_values(last_value, count):
+    if last_value > MAX_ENCODED_IDENTIFIER:
+        raise ValueError('Order identifier sequence exhausted. Got {}'.format(last_value))
+    return last_value - count + 1, last_value
+
+
+def reserve_order_identifiers(count, name=None):
+    """Returns a list of `count` consecutive order identifiers reserved in one transaction."""
+    if count < 1:
+        return []
+    first, last = reserve_order_values(count, name)
+    return [decode_order_identifier(value) for value in range(first, last + 1)]
+
+
+class OrderIdentifierLease(object):
+    """Hands out order identifiers from memory out of a block leased in one transaction.
+
+    A block is either a range returned by another process or `block_size`
+    new values reserved from the sequence. Call release() to return the
+    unused part of the block; a block that is never released is abandoned,
+    leaving a gap in the sequence but never a duplicate.
+
+    The block size is settings.ORDER_IDENTIFIER_BLOCK_SIZE, default 100. A
+    block leased inside a transaction is reserved on an independent
+    connection, see reserve_order_values(). If that is not possible, e.g. on
+    SQLite, one value is reserved in the caller's transaction instead, so
+    no values are held in memory that a rollback would return to the
+    sequence.
+
+        lease = OrderIdentifierLease(block_size=100)
+        order_identifier = next(lease)
+    """
+
+    def __init__(self, block_size=None, name=None):
+        self.block_size = block_size or getattr(settings, 'ORDER_IDENTIFIER_BLOCK_SIZE', 100)
+        self.name = name or OrderIdentifier.name
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.next_value = None
+        self.last_value = None
+        self.database = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # forked, the block belongs to the parent process
+                self.pid, self.next_value, self.last_value = os.getpid(), None, None
+            if self.next_value is None or self.next_value > self.last_value:
+                self.next_value, self.last_value = self.lease()
+                self.database = self.get_database()
+            value = self.next_value
+            self.next_value += 1
+        return decode_order_identifier(value)
+
+    def lease(self):
+        """Returns a tuple of (first, last) for a returned block or a newly reserved one."""
+        OrderIdentifierBlock = django_apps.get_model('getresults_order', 'OrderIdentifierBlock')
+        using = router.db_for_write(OrderIdentifierBlock)
+        if connections[using].in_atomic_block:
+            if independent_connection(using) is None:
+                return reserve_order_values(1, self.name)
+            return reserve_order_values(self.block_size, self.name)
+        for block in OrderIdentifierBlock.objects.filter(name=self.name).order_by('first_value')[:5]:
+            deleted, _ = OrderIdentifierBlock.objects.filter(pk=block.pk).delete()
+            if deleted:
+                return block.first_value, block.last_value
+        return reserve_order_values(self.block_size, self.name)
+
+    def get_database(self):
+        """Returns the (alias, name) of the database blocks are leased from."""
+        using = router.db_for_write(django_apps.get_model('getresults_order', 'OrderIdentifierBlock'))
+        return using, connections[using].settings_dict['NAME']
+
+    def release(self):
+        """Returns the unused part of the current block so another lease can use it.
+
+        The block is dropped instead if the database has changed since it was
+        leased, e.g. after a test database was destroyed.
+        """
+        with self.lock:
+            unused = self.next_value is not None and self.next_value <= self.last_value
+            if unused and self.pid == os.getpid() and self.database == self.get_database():
+                OrderIdentifierBlock = django_apps.get_model('getresults_order', 'OrderIdentifierBlock')
+                OrderIdentifierBlock.objects.create(
+                    name=self.name, first_value=self.next_value, last_value=self.last_value)
+            self.next_value, self.last_value = None, None
+
+
+class NodeOrderIdentifier(object):
+    """Generates order identifiers without coordination from a node prefix and a local counter.
+
+    Identifiers are the node prefix, the counter and the process id, the
+    last two in base 36, e.g. GAB00HVCF3WQ7K01NUQ. The counter is monotonic
+    within the process and seeded from the clock (in microseconds) so a
+    restarted process does not reuse values. Node prefixes must be unique
+    across sites, see validate_node_order_identifiers.
+    """
+
+    prefix_pattern = r'^[A-Z][A-Z0-9]{1,9}$'
+    counter_length = 11
+    pid_length = 5
+
+    def __init__(self, node_prefix=None):
+        self.node_prefix = node_prefix or getattr(settings, 'ORDER_IDENTIFIER_NODE_PREFIX', None)
+        if not re.match(self.prefix_pattern, self.node_prefix or ''):
+            raise ValueError(
+                'Invalid ORDER_IDENTIFIER_NODE_PREFIX. Expected {}. Got \'{}\''.format(
+                    self.prefix_pattern, self.node_prefix))
+        self.lock = threading.Lock()
+        self.last_value = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            self.last_value = max(self.last_value + 1, int(time.time() * 1000000))
+            value = self.last_value
+        return '{}{}{}'.format(
+            self.node_prefix, to_base36(value, self.counter_length), to_base36(os.getpid(), self.pid_length))
+
+    @classmethod
+    def node_prefix_of(cls, identifier):
+        """Returns the node prefix of a node identifier or None if it is not one."""
+        suffix_length = cls.counter_length + cls.pid_length
+        prefix, suffix = identifier[:-suffix_length], identifier[-suffix_length:]
+        if len(identifier) <= suffix_length or not re.match(cls.prefix_pattern, prefix):
+            return None
+        if any(c not in BASE36_DIGITS for c in suffix):
+            return None
+        return prefix
+
+
+BASE36_DIGITS = digits + ascii_uppercase
+
+
+def to_base36(value, length):
+    """Returns a non-negative integer as a zero padded base 36 string."""
+    encoded = ''
+    while value:
+        value, index = divmod(value, 36)
+        encoded = BASE36_DIGITS[index] + encoded
+    if len(encoded) > length:
+        raise ValueError('Value too large for {} base 36 digits. Got {}'.format(length, encoded))
+    return encoded.zfill(length)
+
+
+def validate_node_order_identifiers(identifiers_by_node):
+    """Raises a ValueError if order identifiers from several nodes cannot be merged.
+
+    `identifiers_by_node` is a dictionary of {node_prefix: identifiers}. Each
+    identifier must be a node identifier carrying the prefix of the node it
+    came from and must be unique across all nodes.
+    """
+    seen = {}
+    errors = []
+    for node_prefix, identifiers in identifiers_by_node.items():
+        for identifier in identifiers:
+            if NodeOrderIdentifier.node_prefix_of(identifier) != node_prefix:
+                errors.append('{} from node {} does not carry the node prefix'.format(identifier, node_prefix))
+            elif identifier in seen:
+                errors.append('{} from node {} duplicates an identifier from node {}'.format(
+                    identifier, node_prefix, seen[identifier]))
+            else:
+                seen[identifier] = node_prefix
+    if errors:
+        raise ValueError('Order identifiers are not globally unique. {}'.format('; '.join(errors)))
+
+
+order_identifier_lease = OrderIdentifierLease()
+
+
+def release_order_identifier_lease():
+    """Returns the unused order identifiers of this process's lease; call from commands and workers on exit."""
+    try:
+        order_identifier_lease.release()
+    except DatabaseError:
+        pass
+
+
+atexit.register(release_order_identifier_lease)
+
+node_order_identifier = None
+
+
+def get_order_identifier_scheme():
+    """Returns the identifier scheme set in settings.ORDER_IDENTIFIER_SCHEME, 'sequence' or 'node'."""
+    scheme = getattr(settings, 'ORDER_IDENTIFIER_SCHEME', 'sequence')
+    if scheme not in ['sequence', 'node']:
+        raise ValueError('Invalid ORDER_IDENTIFIER_SCHEME. Got \'{}\''.format(scheme))
+    return scheme
+
+
+def get_node_order_identifier():
+    """Returns this process's NodeOrderIdentifier for settings.ORDER_IDENTIFIER_NODE_PREFIX."""
+    global node_order_identifier
+    node_prefix = getattr(settings, 'ORDER_IDENTIFIER_NODE_PREFIX', None)
+    if node_order_identifier is None or node_order_identifier.node_prefix != node_prefix:
+        node_order_identifier = NodeOrderIdentifier(node_prefix)
+    return node_order_identifier
+
+
+def next_order_identifier():
+    """Returns the next order identifier from this process's lease or node generator."""
+    if get_order_identifier_scheme() == 'node':
+        return next(get_node_order_identifier())
+    return next(order_identifier_lease)
+
+
+def allocate_order_identifiers(count):
+    """Returns a list of `count` new order identifiers using the configured scheme."""
+    if get_order_identifier_scheme() == 'node':
+        node_identifier = get_node_order_identifier()
+        return [next(node_identifier) for _ in range(count)]
+    return reserve_order_identifiers(count)
@@ -0,0 +1,200 @@
+import heapq
+import threading
+
+from array import array
+from bisect import bisect_left
+
+from django.apps import apps as django_apps
+
+from .order_identifier import encode_order_identifier
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LOOKUP_CHUNK_SIZE = 500
+REBUILD_CHUNK_SIZE = 10000
+COMPACT_THRESHOLD = 100000
+
+
+class OrderIdentifierIndex(object):
+    """An in-memory index of the order identifiers in the order table.
+
+    Identifiers in the AAA00000 format are kept as a sorted array of their
+    encoded integers, 8 bytes each, so millions fit in tens of megabytes;
+    other identifiers, e.g. node identifiers, are kept in a set. The index
+    is built on first use, reading the identifiers in pages of
+    REBUILD_CHUNK_SIZE. Orders created in this
+    process are added by the order manager and the post_save receiver.
+    Orders created in other processes are found with the database fallback
+    of exists() and resolve(); deleted orders are not removed, call
+    rebuild().
+
+        from getresults_order.order_index import order_identifier_index
+        found = order_identifier_index.resolve(order_identifiers)
+    """
+
+    def __init__(self, model=None):
+        self.lock = threading.RLock()
+        self._model = model
+        self.clear()
+
+    @property
+    def model(self):
+        return self._model or django_apps.get_model('getresults_order', 'Order')
+
+    def clear(self):
+        with self.lock:
+            self.built = False
+            self.encoded = array('q')
+            self.added = set()
+            self.other = set()
+
+    def rebuild(self):
+        """Builds the index from the order identifiers, read in order in pages of REBUILD_CHUNK_SIZE.
+
+        Each page is one query that starts after the last identifier of the
+        previous page, so the rows are not all held by the database driver.
+        """
+        encoded, other = array('q'), set()
+        previous = -1
+        for identifier in self.identifiers():
+            value = self.encode(identifier)
+            if value is None:
+                other.add(identifier)
+            elif value > previous:
+                encoded.append(value)
+                previous = value
+            else:
+                other.add(identifier)
+        with self.lock:
+            self.encoded, self.added, self.other = encoded, set(), other
+            self.built = True
+
+    def identifiers(self):
+        """Yields all order identifiers in order, one query per page of REBUILD_CHUNK_SIZE."""
+        queryset = self.model.objects.order_by('order_identifier').values_list('order_identifier', flat=True)
+        last_identifier = None
+        while True:
+            chunk = queryset if last_identifier is None else queryset.filter(order_identifier__gt=last_identifier)
+            identifiers = list(chunk[:REBUILD_CHUNK_SIZE])
+            for identifier in identifiers:
+                yield identifier
+            if len(identifiers) < REBUILD_CHUNK_SIZE:
+                return
+            last_identifier = identifiers[-1]
+
+    def add(self, identifiers, model=None):
+        """Adds new order identifiers of `model` if the index is built for it."""
+        if model is not None and model is not self.model:
+            return
+        with self.lock:
+            if not self.built:
+                return
+            for identifier in identifiers:
+                value = self.encode(identifier)
+                if value is None:
+                    self.other.add(identifier)
+                else:
+                    self.added.add(value)
+            if len(self.added) > max(COMPACT_THRESHOLD, len(self.encoded) // 100):
+                self.compact()
+
+    def compact(self):
+        """Merges the identifiers added since the index was built into the sorted array.
+
+        Only the added identifiers are sorted; they are merged with the
+        array in one pass, with np.union1d if NumPy is installed.
+        """
+        with self.lock:
+            if np is not None:
+                merged = np.union1d(
+                    np.frombuffer(self.encoded, dtype=np.int64) if self.encoded else np.array([], dtype=np.int64),
+                    np.fromiter(self.added, dtype=np.int64, count=len(self.added)))
+                encoded = array('q')
+                encoded.frombytes(merged.astype(np.int64).tobytes())
+            else:
+                encoded, previous = array('q'), None
+                for value in heapq.merge(self.encoded, sorted(self.added)):
+                    if value != previous:
+                        encoded.append(value)
+                        previous = value
+            self.encoded, self.added = encoded, set()
+
+    def __contains__(self, identifier):
+        """Returns True if the identifier is in the index; does not query the database."""
+        with self.lock:
+            if not self.built:
+                self.rebuild()
+            value = self.encode(identifier)
+            if value is None:
+                return identifier in self.other
+            index = bisect_left(self.encoded, value)
+            return (index < len(self.encoded) and self.encoded[index] == value) or value in self.added
+
+    def __len__(self):
+        return len(self.encoded) + len(self.added) + len(self.other)
+
+    def exists(self, identifier, fallback=True):
+        """Returns True if the order exists, querying the database only if it is not in the index."""
+        return bool(self.resolve([identifier], fallback=fallback))
+
+    def resolve(self, identifiers, fallback=True):
+        """Returns the set of identifiers for which an order exists.
+
+        Identifiers not in the index are looked up in the database, one IN
+        query per chunk, unless `fallback` is False; those found are added.
+        """
+        identifiers = set(identifiers)
+        with self.lock:
+            if not self.built:
+                self.rebuild()
+            found = self.find(identifiers)
+        missing = sorted(identifiers - found)
+        if fallback and missing:
+            from_database = []
+            for index in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+                from_database.extend(self.model.objects.filter(
+                    order_identifier__in=missing[index:index + LOOKUP_CHUNK_SIZE]).values_list(
+                        'order_identifier', flat=True))
+            self.add(from_database)
+            found.update(from_database)
+        return found
+
+    def find(self, identifiers):
+        """Returns the subset of identifiers in the index, searching the array in one pass with NumPy."""
+        encoded, found = {}, set()
+        for identifier in identifiers:
+            value = self.encode(identifier)
+            if value is None:
+                if identifier in self.other:
+                    found.add(identifier)
+            elif value in self.added:
+                found.add(identifier)
+            else:
+                encoded[identifier] = value
+        if not encoded or not len(self.encoded):
+            return found
+        if np is not None:
+            values = np.fromiter(encoded.values(), dtype=np.int64, count=len(encoded))
+            sorted_values = np.frombuffer(self.encoded, dtype=np.int64)
+            indexes = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+            hits = sorted_values[indexes] == values
+            found.update(identifier for identifier, hit in zip(encoded, hits.tolist()) if hit)
+        else:
+            for identifier, value in encoded.items():
+                index = bisect_left(self.encoded, value)
+                if index < len(self.encoded) and self.encoded[index] == value:
+                    found.add(identifier)
+        return found
+
+    def encode(self, identifier):
+        """Returns the encoded identifier, or None if it is not in the AAA00000 format."""
+        try:
+            return encode_order_identifier(identifier)
+        except (TypeError, ValueError):
+            return None
+
+
+order_identifier_index = OrderIdentifierIndex()
@@ -0,0 +1,114 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+
+FormattedResult = namedtuple(
+    'FormattedResult', 'order_identifier utestid_name raw_value quantifier value error')
+
+
+def format_chunk(spec, raw_values):
+    """Returns a list of (quantifier, value, error) for raw values of one UtestidSpec.
+
+    The chunk is formatted in one batch; if that fails, each value is
+    formatted on its own so the error is reported for the failing values
+    only. Runs in a worker process.
+    """
+    try:
+        quantifiers, values = spec.values_with_quantifier(raw_values)
+    except (ArithmeticError, TypeError, ValueError):
+        pass
+    else:
+        quantifiers = quantifiers.tolist() if hasattr(quantifiers, 'tolist') else quantifiers
+        values = values.tolist() if hasattr(values, 'tolist') else values
+        return [(quantifier, value, None) for quantifier, value in zip(quantifiers, values)]
+    results = []
+    for raw_value in raw_values:
+        try:
+            quantifier, value = spec.value_with_quantifier(raw_value)
+        except (ArithmeticError, TypeError, ValueError) as e:
+            results.append((None, None, '{}: {}'.format(e.__class__.__name__, e)))
+        else:
+            results.append((quantifier, value, None))
+    return results
+
+
+class FormattingPipeline(object):
+    """Formats a stream of (order_identifier, utestid_name, raw_value) records with a process pool.
+
+    Records are read in windows of `window_size`. Each window is grouped by
+    utestid and split into chunks of `chunk_size`. The chunks are formatted
+    by format_chunk() in a ProcessPoolExecutor of `max_workers`
+    (settings.FORMATTING_POOL_WORKERS, default the number of CPUs). A window
+    of fewer than `min_pool_records` (settings.FORMATTING_POOL_MIN_RECORDS,
+    default 5000) is formatted in this process.
+
+    Results are yielded as FormattedResults in the order of the records. A
+    record that cannot be formatted, or whose utestid is not in the spec
+    catalog, has quantifier and value None and the error message in error.
+
+        pipeline = FormattingPipeline(catalog.spec_catalog())
+        for result in pipeline.format(records):
+            ...
+    """
+
+    def __init__(self, spec_catalog=None, max_workers=None, min_pool_records=None, chunk_size=None,
+                 window_size=None):
+        if spec_catalog is None:
+            from .catalog import catalog
+            spec_catalog = catalog.spec_catalog()
+        self.spec_catalog = spec_catalog
+        self.max_workers = max_workers or getattr(settings, 'FORMATTING_POOL_WORKERS', None)
+        self.min_pool_records = (
+            getattr(settings, 'FORMATTING_POOL_MIN_RECORDS', 5000) if min_pool_records is None
+            else min_pool_records)
+        self.chunk_size = chunk_size or 10000
+        self.window_size = window_size or 200000
+
+    def format(self, records):
+        """Yields a FormattedResult for each record, in the order of the records."""
+        records = iter(records)
+        executor = None
+        try:
+            while True:
+                window = list(islice(records, self.window_size))
+                if not window:
+                    break
+                if executor is None and len(window) >= self.min_pool_records and self.max_workers != 1:
+                    executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                for result in self.format_window(window, executor if len(window) >= self.min_pool_records else None):
+                    yield result
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def format_window(self, window, executor=None):
+        """Returns a list of FormattedResults for a list of records."""
+        groups = {}
+        for index, (_, utestid_name, raw_value) in enumerate(window):
+            groups.setdefault(utestid_name, []).append((index, raw_value))
+        tasks, task_indexes = [], []
+        errors = {}
+        for utestid_name in sorted(groups):
+            indexed_values = groups[utestid_name]
+            try:
+                spec = self.spec_catalog[utestid_name]
+            except KeyError:
+                for index, _ in indexed_values:
+                    errors[index] = (None, None, 'Invalid utestid. Got {}'.format(utestid_name))
+                continue
+            for start in range(0, len(indexed_values), self.chunk_size):
+                chunk = indexed_values[start:start + self.chunk_size]
+                tasks.append((spec, [raw_value for _, raw_value in chunk]))
+                task_indexes.append([index for index, _ in chunk])
+        if executor is None:
+            chunk_results = [format_chunk(spec, raw_values) for spec, raw_values in tasks]
+        else:
+            chunk_results = executor.map(format_chunk, *zip(*tasks)) if tasks else []
+        formatted = errors
+        for indexes, results in zip(task_indexes, chunk_results):
+            formatted.update(zip(indexes, results))
+        return [
+            FormattedResult(order_identifier, utestid_name, raw_value, *formatted[index])
+            for index, (order_identifier, utestid_name, raw_value) in enumerate(window)]
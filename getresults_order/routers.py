@@ -0,0 +1,98 @@
+import random
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+ROUTED_MODELS = ['order', 'orderpanel', 'utestid']
+
+local = threading.local()
+
+
+class OrderReadReplicaRouter(object):
+    """Routes reads of Order, OrderPanel and Utestid to replicas and their writes to the primary.
+
+    Configure in settings:
+        DATABASE_ROUTERS = ['getresults_order.routers.OrderReadReplicaRouter']
+        ORDER_READ_DATABASES = ['replica']  # aliases of the replicas
+        ORDER_WRITE_DATABASE = 'default'  # the primary (default 'default')
+        ORDER_STICKY_SECONDS = 5  # reads after a write go to the primary (default 5)
+
+    After a write, reads in the same thread go to the primary for
+    ORDER_STICKY_SECONDS so they see the write despite replication lag.
+    Writes are recorded by record_write(), called from the post_save and
+    post_delete receivers and from the bulk paths of the order manager.
+    Reads inside a transaction on the primary, or inside use_primary(), go
+    to the primary. Other models are not routed.
+    """
+
+    def is_routed(self, model):
+        return is_routed_model(model)
+
+    def db_for_read(self, model, **hints):
+        if not self.is_routed(model):
+            return None
+        read_databases = getattr(settings, 'ORDER_READ_DATABASES', None)
+        if not read_databases or self.is_sticky() or connections[write_database()].in_atomic_block:
+            return write_database()
+        return random.choice(read_databases)
+
+    def db_for_write(self, model, **hints):
+        if not self.is_routed(model):
+            return None
+        return write_database()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = [write_database()] + list(getattr(settings, 'ORDER_READ_DATABASES', None) or [])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def is_sticky(self):
+        if getattr(local, 'use_primary', 0):
+            return True
+        last_write = getattr(local, 'last_write', None)
+        return last_write is not None and time.time() - last_write < getattr(settings, 'ORDER_STICKY_SECONDS', 5)
+
+
+def is_routed_model(model):
+    return model._meta.app_label == 'getresults_order' and model._meta.model_name in ROUTED_MODELS
+
+
+def record_write(model):
+    """Sends the reads of this thread to the primary for ORDER_STICKY_SECONDS after a write of `model`."""
+    if is_routed_model(model):
+        local.last_write = time.time()
+
+
+def write_database():
+    return getattr(settings, 'ORDER_WRITE_DATABASE', 'default')
+
+
+@contextmanager
+def use_primary():
+    """Sends the reads of this thread to the primary inside the block."""
+    local.use_primary = getattr(local, 'use_primary', 0) + 1
+    try:
+        yield
+    finally:
+        local.use_primary -= 1
+
+
+def copy_sqlite_database(source_name, target_name):
+    """Copies one SQLite database file to another with the SQLite backup API.
+
+    A stand-in for replication when a second local SQLite file is used as
+    the replica, see settings.ORDER_REPLICA_STANDIN.
+    """
+    source = sqlite3.connect(source_name)
+    target = sqlite3.connect(target_name)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
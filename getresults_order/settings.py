@@ -88,9 +88,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # a file, not in memory, so the order identifier concurrency test can share it between processes
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
     }
 }
 
+# Reads of Order, OrderPanel and Utestid go to ORDER_READ_DATABASES, see getresults_order.routers.
+# With ORDER_REPLICA_STANDIN set, a second SQLite file stands in for a replica;
+# refresh it from the primary with "manage.py sync_replica_standin".
+if os.environ.get('ORDER_REPLICA_STANDIN'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['getresults_order.routers.OrderReadReplicaRouter']
+    ORDER_READ_DATABASES = ['replica']
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
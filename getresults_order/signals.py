@@ -1,11 +1,41 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .order_identifier import OrderIdentifier
+from .models import Order, OrderPanel, Utestid
+from .order_index import order_identifier_index
+from .routers import record_write
+from .statistics import record_order_statistics, statistic_key
 
 
-@receiver(post_save, weak=False, dispatch_uid='order_on_post_save')
-def order_on_post_save(sender, instance, raw, created, using, update_fields, **kwargs):
-    if not raw:
-        instance.order_identifier = OrderIdentifier().identifier
-        instance.save()
+@receiver(post_save, sender=Order, weak=False, dispatch_uid='order_index_on_post_save')
+def order_index_on_post_save(sender, instance, raw, created, using, update_fields, **kwargs):
+    """Adds a new order to the order identifier index once the transaction commits."""
+    if created:
+        order_identifier = instance.order_identifier
+        transaction.on_commit(lambda: order_identifier_index.add([order_identifier], model=sender), using=using)
+
+
+@receiver(post_delete, sender=Order, weak=False, dispatch_uid='order_statistic_on_post_delete')
+def order_statistic_on_post_delete(sender, instance, using, **kwargs):
+    """Removes a deleted order from the order statistics."""
+    record_order_statistics({getattr(instance, '_statistic_key', None) or statistic_key(instance): -1}, using)
+
+
+def record_write_on_post_save(sender, **kwargs):
+    """Records a save of a routed model, see routers.record_write."""
+    record_write(sender)
+
+
+def record_write_on_post_delete(sender, **kwargs):
+    """Records a delete of a routed model, see routers.record_write."""
+    record_write(sender)
+
+
+for model in (Order, OrderPanel, Utestid):
+    post_save.connect(
+        record_write_on_post_save, sender=model, weak=False,
+        dispatch_uid='record_write_on_post_save_{}'.format(model._meta.model_name))
+    post_delete.connect(
+        record_write_on_post_delete, sender=model, weak=False,
+        dispatch_uid='record_write_on_post_delete_{}'.format(model._meta.model_name))
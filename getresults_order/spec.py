@@ -0,0 +1,139 @@
+import json
+import zlib
+
+from decimal import Decimal
+
+from .formatting import format_value, format_value_with_quantifier, format_values, format_values_with_quantifier
+from .formula import Formula
+
+SPEC_FIELDS = (
+    'name', 'value_type', 'value_datatype', 'lower_limit', 'upper_limit',
+    'precision', 'formula', 'formula_utestid_name', 'units')
+
+
+class UtestidSpec(object):
+    """An immutable snapshot of a Utestid that formats values without the database.
+
+    value(), value_with_quantifier(), values() and values_with_quantifier()
+    return what the Utestid methods return. A spec pickles as a tuple of its
+    fields; the formula is compiled on first use in each process.
+
+        spec = UtestidSpec.from_utestid(Utestid.objects.get(name='PHM'))
+        spec.value_with_quantifier(399)  # ('<', 400)
+    """
+
+    __slots__ = SPEC_FIELDS + ('_formula', )
+
+    def __init__(self, name, value_type, value_datatype, lower_limit=None, upper_limit=None,
+                 precision=None, formula=None, formula_utestid_name=None, units=None):
+        for field, value in zip(SPEC_FIELDS, (
+                name, value_type, value_datatype, lower_limit, upper_limit,
+                precision, formula, formula_utestid_name, units)):
+            object.__setattr__(self, field, value)
+        object.__setattr__(self, '_formula', None)
+
+    @classmethod
+    def from_utestid(cls, utestid):
+        return cls(*[getattr(utestid, field) for field in SPEC_FIELDS])
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} is immutable'.format(self.__class__.__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('{} is immutable'.format(self.__class__.__name__))
+
+    def __reduce__(self):
+        return (self.__class__, self.as_tuple())
+
+    def __eq__(self, other):
+        return isinstance(other, UtestidSpec) and self.as_tuple() == other.as_tuple()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.name)
+
+    def __str__(self):
+        return self.name
+
+    def as_tuple(self):
+        return tuple(getattr(self, field) for field in SPEC_FIELDS)
+
+    @property
+    def compiled_formula(self):
+        """Returns the compiled formula, compiled once per spec."""
+        if self._formula is None:
+            object.__setattr__(self, '_formula', Formula(self.formula))
+        return self._formula
+
+    def value(self, raw_value, value_type=None):
+        """Returns the value as the type defined in value_type, see Utestid.value()."""
+        return format_value(self, raw_value, value_type)
+
+    def value_with_quantifier(self, raw_value):
+        """Returns a tuple of (quantifier, value) given a raw value, see Utestid.value_with_quantifier()."""
+        return format_value_with_quantifier(self, raw_value)
+
+    def values(self, raw_values):
+        """Returns a batch of raw values formatted as value() would, see formatting.format_values."""
+        return format_values(self, raw_values)
+
+    def values_with_quantifier(self, raw_values):
+        """Returns a tuple of (quantifiers, values) for a batch of raw values."""
+        return format_values_with_quantifier(self, raw_values)
+
+
+class UtestidSpecCatalog(object):
+    """UtestidSpecs by name and the utestid names of each order panel, serializable to one blob.
+
+    dumps() returns the catalog as zlib compressed JSON; loads() reads it
+    back without the database.
+
+        blob = catalog.spec_catalog().dumps()
+        specs = UtestidSpecCatalog.loads(blob)
+        specs.panel_specs('VL')
+    """
+
+    def __init__(self, specs, panels=None, version=None):
+        self.specs = {spec.name: spec for spec in specs}
+        self.panels = {name: tuple(utestid_names) for name, utestid_names in (panels or {}).items()}
+        self.version = version
+
+    def __getitem__(self, name):
+        return self.specs[name]
+
+    def __contains__(self, name):
+        return name in self.specs
+
+    def __len__(self):
+        return len(self.specs)
+
+    def panel_specs(self, order_panel_name):
+        """Returns a tuple of the UtestidSpecs of an order panel."""
+        return tuple(self.specs[name] for name in self.panels.get(order_panel_name, ()))
+
+    def dumps(self):
+        data = {
+            'version': self.version,
+            'fields': SPEC_FIELDS,
+            'specs': [[str(value) if isinstance(value, Decimal) else value for value in spec.as_tuple()]
+                      for spec in sorted(self.specs.values(), key=lambda spec: spec.name)],
+            'panels': self.panels,
+        }
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def loads(cls, blob):
+        data = json.loads(zlib.decompress(blob).decode('utf-8'))
+        specs = []
+        for values in data['specs']:
+            spec = dict(zip(data['fields'], values))
+            for field in ['lower_limit', 'upper_limit']:
+                if spec[field] is not None:
+                    spec[field] = Decimal(spec[field])
+            specs.append(UtestidSpec(**spec))
+        return cls(specs, data['panels'], data['version'])
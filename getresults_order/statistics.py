@@ -0,0 +1,123 @@
+from collections import Counter
+
+from django.apps import apps as django_apps
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def order_date(order_datetime):
+    """Returns the day of an order_datetime in the default time zone, settings.TIME_ZONE.
+
+    Not the active time zone of a request, so an order is counted under the
+    same day whichever time zone is active when it changes.
+    """
+    if timezone.is_aware(order_datetime):
+        order_datetime = timezone.localtime(order_datetime, timezone.get_default_timezone())
+    return order_datetime.date()
+
+
+def statistic_key(order):
+    """Returns the (order_panel_id, status, order_date) an order is counted under."""
+    return (order.order_panel_id, order.status, order_date(order.order_datetime))
+
+
+def get_statistic_model():
+    return django_apps.get_model('getresults_order', 'OrderStatistic')
+
+
+def record_order_statistics(changes, using):
+    """Adds a dictionary of {(order_panel_id, status, order_date): change} to the statistics on commit.
+
+    The changes are applied after the transaction commits with one update
+    per key, so concurrent transactions do not wait on the statistic rows.
+    Changes rolled back, also by an inner atomic block, are not applied;
+    Django discards their commit hook. Outside a transaction they are
+    applied at once.
+    """
+    changes = Counter({key: change for key, change in changes.items() if change})
+    if changes:
+        transaction.on_commit(lambda: apply_order_statistics(changes, using), using=using)
+
+
+def record_order_change(previous, order, using):
+    """Records an order moving from the statistic key `previous`, None if new, to its current key."""
+    key = statistic_key(order)
+    if previous != key:
+        changes = Counter({key: 1})
+        if previous is not None:
+            changes[previous] -= 1
+        record_order_statistics(changes, using)
+    return key
+
+
+def apply_order_statistics(changes, using):
+    """Adds the changes to the statistic rows, creating missing rows."""
+    statistic_model = get_statistic_model()
+    statistics = statistic_model.objects.using(using)
+    with transaction.atomic(using=using):
+        for (order_panel_id, status, day), change in sorted(changes.items()):
+            if not change:
+                continue
+            lookups = dict(order_panel_id=order_panel_id, status=status, order_date=day)
+            if statistics.filter(**lookups).update(count=F('count') + change):
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    statistics.create(count=change, **lookups)
+            except IntegrityError:
+                statistics.filter(**lookups).update(count=F('count') + change)
+
+
+def order_statistics(order_panel=None, status=None, start=None, end=None):
+    """Returns a dictionary of {(order panel name, status, order_date): count}.
+
+    Reads the statistic rows only, so the cost depends on the number of
+    panels, statuses and days asked for, not on the number of orders.
+    Filter by order panel name, status and order_date from `start` to
+    `end`, both inclusive.
+    """
+    queryset = get_statistic_model().objects.filter(count__gt=0)
+    if order_panel:
+        queryset = queryset.filter(order_panel__name=order_panel)
+    if status:
+        queryset = queryset.filter(status=status)
+    if start:
+        queryset = queryset.filter(order_date__gte=start)
+    if end:
+        queryset = queryset.filter(order_date__lte=end)
+    return {
+        (order_panel_name, status, day): count for order_panel_name, status, day, count in queryset.values_list(
+            'order_panel__name', 'status', 'order_date', 'count')}
+
+
+def rebuild_order_statistics(model=None, chunk_size=None):
+    """Recounts the statistics from the order table and replaces them; returns the number of statistic rows.
+
+    The order table is read in pages of `chunk_size` orders, each starting
+    after the primary key of the last order of the previous page. Orders
+    written while the rebuild runs may be counted twice or not at all; run
+    it when orders are not being written or run it again.
+    """
+    model = model or django_apps.get_model('getresults_order', 'Order')
+    statistic_model = get_statistic_model()
+    using = router.db_for_write(statistic_model)
+    chunk_size = chunk_size or 10000
+    queryset = model.objects.using(using).order_by('pk').values_list(
+        'pk', 'order_panel_id', 'status', 'order_datetime')
+    counts = Counter()
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk[:chunk_size])
+        for _, order_panel_id, status, order_datetime in rows:
+            counts[(order_panel_id, status, order_date(order_datetime))] += 1
+        if len(rows) < chunk_size:
+            break
+        last_pk = rows[-1][0]
+    with transaction.atomic(using=using):
+        statistic_model.objects.using(using).all().delete()
+        statistic_model.objects.using(using).bulk_create([
+            statistic_model(order_panel_id=order_panel_id, status=status, order_date=day, count=count)
+            for (order_panel_id, status, day), count in sorted(counts.items())])
+    return len(counts)
@@ -1,9 +1,58 @@
+import asyncio
+import json
 import math
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock, skipIf
 
-from getresults_order.configure import Configure as ConfigureOrder
-from getresults_order.models import Utestid, OrderPanelItem, BaseOrder, OrderPanel
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from django.test.utils import override_settings, CaptureQueriesContext
+
+from getresults_aliquot.models import Aliquot
+from getresults.admin import admin_site
+from getresults_order.admin import OrderAdmin, OrderPanelItemAdmin
+from getresults_order.archive import OrderArchive
+from getresults_order.catalog import catalog
+from getresults_order.configure import Configure as ConfigureOrder, LoadSummary
+from getresults_order.export import OrderExport
+from getresults_order.fanout import OrderFanout
+from getresults_order.forms import OrderForm, OrderFormSet
+from getresults_order.formula import FORMULA_CACHE_SIZE, Formula, get_formula
+from getresults_order.history import compact_history, deferred_history
+from getresults_order.ingest import IngestionServer
+from getresults_order.manifest import ManifestImporter
+from getresults_order.models import (
+    ArchivedOrder, Order, Utestid, OrderPanelItem, BaseOrder, OrderPanel, OrderIdentifierBlock,
+    OrderIdentifierSequence, CatalogVersion, Requisition, ManifestCheckpoint, OrderStatistic)
+from getresults_order.views import OrderExportView, WorklistView
+from getresults_order.order_index import OrderIdentifierIndex, order_identifier_index
+from getresults_order.paginator import EstimatedCountPaginator
+from getresults_order.pipeline import FormattingPipeline
+from getresults_order.routers import (
+    OrderReadReplicaRouter, copy_sqlite_database, local as router_local, record_write, use_primary)
+from getresults_order.signals import record_write_on_post_delete, record_write_on_post_save
+from getresults_order.statistics import order_date, order_statistics, rebuild_order_statistics
+from getresults_order.spec import UtestidSpec, UtestidSpecCatalog
+from getresults_order.order_identifier import (
+    DATABASE_LOCK_VENDORS, highest_order_identifier, decode_order_identifier, encode_order_identifier,
+    reserve_order_identifiers, OrderIdentifierLease, NodeOrderIdentifier, validate_node_order_identifiers)
 
 
 class DummyOrder(BaseOrder):
@@ -12,11 +61,26 @@ class DummyOrder(BaseOrder):
         app_label = 'getresults_order'
 
 
+class DummyArchivedOrder(BaseOrder):
+
+    archived_datetime = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        app_label = 'getresults_order'
+
+
+class DummyOrderResult(models.Model):
+
+    order = models.ForeignKey(DummyOrder)
+
+    class Meta:
+        app_label = 'getresults_order'
+
+
 class TestGetresults(TestCase):
 
     def setUp(self):
-        configure_order = ConfigureOrder()
-        configure_order.load_all()
+        ConfigureOrder()
 
     def test_order_creates_order_identifier(self):
         order_panel = OrderPanel.objects.create(name='panel1')
@@ -95,7 +159,21 @@ class TestGetresults(TestCase):
             value_type='calculated',
             value_datatype='decimal',
             precision=2,
-            formula='1 + log10(100)')
+            formula='1 + log10({value})')
+        order_panel_item = OrderPanelItem.objects.create(
+            order_panel=order_panel,
+            utestid=utestid,
+        )
+        self.assertEquals(order_panel_item.utestid.value(100), 3.0)
+
+    def test_panel_item_formula_invalid(self):
+        order_panel = OrderPanel.objects.create(name='viral load')
+        utestid = Utestid.objects.create(
+            name='PMHLOG',
+            value_type='calculated',
+            value_datatype='decimal',
+            precision=2,
+            formula='1 + sin({value})')
         order_panel_item = OrderPanelItem.objects.create(
             order_panel=order_panel,
             utestid=utestid,
@@ -146,3 +224,1339 @@ class TestGetresults(TestCase):
         self.assertEquals(value_with_quantifier, ('=', 750000))
         value_with_quantifier = order_panel_item.utestid.value_with_quantifier(750001)
         self.assertEquals(value_with_quantifier, ('>', 750000))
+
+
+class TestBulkOrders(TestCase):
+
+    def test_encode_decode_order_identifier(self):
+        self.assertEquals(encode_order_identifier('AAA00001'), 1)
+        self.assertEquals(encode_order_identifier('AAB00000'), 100000)
+        self.assertEquals(decode_order_identifier(100000), 'AAB00000')
+        for value in [0, 99999, 100000, 1234567, 26 ** 3 * 100000 - 1]:
+            self.assertEquals(encode_order_identifier(decode_order_identifier(value)), value)
+        self.assertRaises(ValueError, encode_order_identifier, 'aaa00001')
+        self.assertRaises(ValueError, decode_order_identifier, 26 ** 3 * 100000)
+
+    def test_reserve_order_identifiers_is_contiguous(self):
+        first = reserve_order_identifiers(3)
+        second = reserve_order_identifiers(2)
+        values = [encode_order_identifier(identifier) for identifier in first + second]
+        self.assertEquals(values, list(range(values[0], values[0] + 5)))
+
+    def test_bulk_create_orders(self):
+        order_panel = OrderPanel.objects.create(name='panel1')
+        DummyOrder.objects.create(aliquot_identifier='12345678', order_panel=order_panel)
+        orders = DummyOrder.objects.bulk_create_orders(
+            [DummyOrder(aliquot_identifier='1234567{}'.format(n), order_panel=order_panel)
+             for n in range(5)])
+        self.assertEquals(len(orders), 5)
+        identifiers = set(order.order_identifier for order in orders)
+        self.assertEquals(len(identifiers), 5)
+        for identifier in identifiers:
+            self.assertTrue(re.match(r'^[A-Z]{3}[0-9]{5}$', identifier))
+        self.assertEquals(DummyOrder.objects.filter(order_identifier__in=identifiers).count(), 5)
+        self.assertEquals(DummyOrder.objects.count(), 6)
+
+
+class TestSubmitOrders(TestCase):
+
+    def test_submit_orders_returns_existing_orders(self):
+        order_panel = OrderPanel.objects.create(name='panel1')
+        summary = DummyOrder.objects.submit_orders(
+            [DummyOrder(aliquot_identifier='1234567{}'.format(n), order_panel=order_panel) for n in [0, 1, 2, 2]])
+        self.assertEquals(len(summary.created), 3)
+        self.assertIs(summary.orders[3], summary.orders[2])
+        # savepoint, one lookup, release
+        with self.assertNumQueries(3):
+            resubmitted = DummyOrder.objects.submit_orders(
+                [DummyOrder(aliquot_identifier='1234567{}'.format(n), order_panel=order_panel) for n in range(3)])
+        self.assertEquals(resubmitted.created, [])
+        self.assertEquals([order.pk for order in resubmitted.orders], [order.pk for order in summary.orders[:3]])
+        self.assertEquals(DummyOrder.objects.count(), 3)
+        DummyOrder.objects.transition([summary.orders[0]], 'CANCELLED')
+        resubmitted = DummyOrder.objects.submit_orders(
+            [DummyOrder(aliquot_identifier='12345670', order_panel=order_panel)])
+        self.assertEquals(len(resubmitted.created), 1)
+        self.assertNotEqual(resubmitted.orders[0].pk, summary.orders[0].pk)
+
+    def test_submit_orders_idempotency_key(self):
+        order_panel = OrderPanel.objects.create(name='panel1')
+        order = DummyOrder.objects.submit_orders(
+            [DummyOrder(aliquot_identifier='12345670', order_panel=order_panel, idempotency_key='K1')]).orders[0]
+        summary = DummyOrder.objects.submit_orders(
+            [DummyOrder(aliquot_identifier='12345679', order_panel=order_panel, idempotency_key='K1')])
+        self.assertEquals((summary.orders[0].pk, summary.created), (order.pk, []))
+
+    def test_submit_orders_looks_up_again_after_a_concurrent_insert(self):
+        order_panel = OrderPanel.objects.create(name='panel1')
+        order = DummyOrder.objects.create(aliquot_identifier='12345670', order_panel=order_panel, idempotency_key='K1')
+        orders = [DummyOrder(aliquot_identifier='12345670', order_panel=order_panel, idempotency_key='K1')]
+        existing_orders = DummyOrder.objects.existing_orders(orders)
+        with mock.patch.object(
+                DummyOrder.objects, 'existing_orders', side_effect=[({}, {}), existing_orders]) as lookup:
+            summary = DummyOrder.objects.submit_orders(orders)
+        self.assertEquals(lookup.call_count, 2)
+        self.assertEquals((summary.orders[0].pk, summary.created), (order.pk, []))
+
+
+class TestOrderTransition(TestCase):
+
+    def test_transition_orders(self):
+        order_panel = OrderPanel.objects.create(name='panel1')
+        orders = DummyOrder.objects.bulk_create_orders(
+            [DummyOrder(aliquot_identifier='1234567{}'.format(n), order_panel=order_panel) for n in range(4)])
+        DummyOrder.objects.filter(pk=orders[1].pk).update(status='CANCELLED')
+        # savepoint, select, update, release
+        with self.assertNumQueries(4):
+            summary = DummyOrder.objects.transition(orders, 'COMPLETE')
+        self.assertEquals(set(order.pk for order in summary.orders), set([orders[0].pk, orders[2].pk, orders[3].pk]))
+        self.assertEquals(summary.skipped, [orders[1].pk])
+        self.assertEquals(DummyOrder.objects.filter(status='COMPLETE').count(), 3)
+        self.assertEquals(DummyOrder.objects.transition([orders[0].pk], 'CANCELLED').skipped, [orders[0].pk])
+        self.assertRaises(ValueError, DummyOrder.objects.transition, orders, 'DONE')
+        self.assertRaises(ValueError, DummyOrder.objects.transition, orders, 'PENDING')
+
+
+def lease_order_identifiers(queue, count, block_size):
+    lease = OrderIdentifierLease(block_size=block_size)
+    identifiers = [next(lease) for _ in range(count)]
+    lease.release()
+    connection.close()
+    queue.put(identifiers)
+
+
+class TestOrderIdentifierLease(TransactionTestCase):
+
+    def test_lease_hands_out_block_from_memory(self):
+        lease = OrderIdentifierLease(block_size=10)
+        first = next(lease)
+        with self.assertNumQueries(0):
+            identifiers = [next(lease) for _ in range(9)]
+        values = [encode_order_identifier(identifier) for identifier in [first] + identifiers]
+        self.assertEquals(values, list(range(values[0], values[0] + 10)))
+
+    def test_released_block_is_leased_again(self):
+        lease = OrderIdentifierLease(block_size=10)
+        identifiers = [next(lease) for _ in range(4)]
+        lease.release()
+        block = OrderIdentifierBlock.objects.get()
+        self.assertEquals(block.first_value, encode_order_identifier(identifiers[-1]) + 1)
+        other_lease = OrderIdentifierLease(block_size=10)
+        self.assertEquals(encode_order_identifier(next(other_lease)), block.first_value)
+        self.assertEquals(OrderIdentifierBlock.objects.count(), 0)
+        self.assertNotIn(next(lease), identifiers + [decode_order_identifier(block.first_value)])
+
+    @skipIf(connection.vendor not in DATABASE_LOCK_VENDORS, 'leases are reserved on an independent connection')
+    def test_lease_in_a_rolled_back_transaction_holds_no_values(self):
+        lease = OrderIdentifierLease(block_size=10)
+        try:
+            with transaction.atomic():
+                identifier = next(lease)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEquals(next(lease), identifier)
+
+
+def database_is_shared():
+    """Returns True if processes started by a test share its database."""
+    test_name = connection.settings_dict.get('TEST', {}).get('NAME')
+    return connection.vendor != 'sqlite' or bool(test_name and test_name != ':memory:')
+
+
+@skipIf(not database_is_shared(), 'requires a database shared between processes')
+class TestOrderIdentifierLeaseConcurrency(TransactionTestCase):
+
+    def test_concurrent_leases_do_not_collide(self):
+        processes, count = 8, 250
+        connections.close_all()
+        queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=lease_order_identifiers, args=(queue, count, 1 + n * 7))
+            for n in range(processes)]
+        for worker in workers:
+            worker.start()
+        identifiers = []
+        for _ in workers:
+            identifiers.extend(queue.get(timeout=120))
+        for worker in workers:
+            worker.join()
+        self.assertEquals(len(identifiers), processes * count)
+        self.assertEquals(len(set(identifiers)), processes * count)
+        for identifier in identifiers:
+            self.assertTrue(re.match(r'^[A-Z]{3}[0-9]{5}$', identifier))
+
+
+class TestOrderIdentifierLeaseThreads(TransactionTestCase):
+
+    def lease_order_identifiers(self, identifiers, count, block_size):
+        lease = OrderIdentifierLease(block_size=block_size)
+        try:
+            for _ in range(count):
+                identifiers.append(self.retry_locked(lambda: next(lease)))
+            self.retry_locked(lease.release)
+        finally:
+            connection.close()
+
+    def retry_locked(self, func):
+        # an in-memory SQLite test database is shared between threads with table locks
+        for _ in range(1000):
+            try:
+                return func()
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                time.sleep(0.001)
+        return func()
+
+    def test_concurrent_leases_in_threads_do_not_collide(self):
+        threads, count = 4, 50
+        results = [[] for _ in range(threads)]
+        workers = [
+            threading.Thread(target=self.lease_order_identifiers, args=(results[n], count, 1 + n * 7))
+            for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        identifiers = [identifier for result in results for identifier in result]
+        self.assertEquals(len(identifiers), threads * count)
+        self.assertEquals(len(set(identifiers)), threads * count)
+        # every reserved value was handed out or returned in a block
+        released = sum(block.last_value - block.first_value + 1 for block in OrderIdentifierBlock.objects.all())
+        self.assertEquals(OrderIdentifierSequence.objects.get().last_value, len(identifiers) + released)
+
+class TestNodeOrderIdentifier(TestCase):
+
+    def test_node_identifiers_are_unique_and_prefixed(self):
+        node_identifier = NodeOrderIdentifier('GAB')
+        with self.assertNumQueries(0):
+            identifiers = [next(node_identifier) for _ in range(1000)]
+        self.assertEquals(len(set(identifiers)), 1000)
+        self.assertEquals(identifiers, sorted(identifiers))
+        for identifier in identifiers:
+            self.assertEquals(NodeOrderIdentifier.node_prefix_of(identifier), 'GAB')
+            self.assertLessEqual(len(identifier), 50)
+
+    def test_invalid_node_prefix(self):
+        self.assertRaises(ValueError, NodeOrderIdentifier, None)
+        self.assertRaises(ValueError, NodeOrderIdentifier, 'gab')
+
+    def test_validate_node_order_identifiers(self):
+        gab = [next(NodeOrderIdentifier('GAB')) for _ in range(3)]
+        fra = [next(NodeOrderIdentifier('FRA')) for _ in range(3)]
+        validate_node_order_identifiers({'GAB': gab, 'FRA': fra})
+        self.assertRaises(ValueError, validate_node_order_identifiers, {'GAB': gab, 'FRA': fra + gab[:1]})
+        self.assertRaises(ValueError, validate_node_order_identifiers, {'GAB': gab + gab[:1]})
+        self.assertRaises(ValueError, validate_node_order_identifiers, {'GAB': ['AAA00001']})
+
+    @override_settings(ORDER_IDENTIFIER_SCHEME='node', ORDER_IDENTIFIER_NODE_PREFIX='GAB')
+    def test_order_uses_node_scheme(self):
+        order_panel = OrderPanel.objects.create(name='panel1')
+        order = DummyOrder.objects.create(aliquot_identifier='12345678', order_panel=order_panel)
+        self.assertEquals(NodeOrderIdentifier.node_prefix_of(order.order_identifier), 'GAB')
+        orders = DummyOrder.objects.bulk_create_orders(
+            [DummyOrder(aliquot_identifier='12345678', order_panel=order_panel) for _ in range(3)])
+        for order in orders:
+            self.assertEquals(NodeOrderIdentifier.node_prefix_of(order.order_identifier), 'GAB')
+
+
+class TestFormula(TestCase):
+
+    def test_formula_functions(self):
+        self.assertEquals(Formula('LOG10')(1000), 3.0)
+        self.assertEquals(Formula('log10({value}) * 2')('100'), 4.0)
+        self.assertEquals(Formula('ln({value})')(1), 0.0)
+        self.assertEquals(Formula('EXP({value})')(0), 1.0)
+        self.assertEquals(Formula('sqrt({value}) + 1')(16), 5.0)
+        self.assertEquals(Formula('{value} * 1000')(2), 2000)
+
+    def test_formula_rejects_unsafe_expressions(self):
+        for formula in ['__import__("os")', '{value}.real', 'log10 + 1', 'log10({value}, 2)', '"1"', 'True', 'x']:
+            self.assertRaises(ValueError, Formula, formula)
+
+    def test_compiled_formula_follows_formula_text(self):
+        utestid = Utestid.objects.create(
+            name='PMHX',
+            value_type='calculated',
+            value_datatype='decimal',
+            precision=2,
+            formula='{value} * 2')
+        self.assertEquals(utestid.value(2), 4.0)
+        compiled_formula = utestid.compiled_formula
+        self.assertIs(utestid.compiled_formula, compiled_formula)
+        utestid.formula = '{value} * 3'
+        utestid.save()
+        self.assertEquals(Utestid.objects.get(name='PMHX').value(2), 6.0)
+        self.assertIsNot(utestid.compiled_formula, compiled_formula)
+        self.assertIs(Utestid(formula='{value} * 2').compiled_formula, compiled_formula)
+        self.assertLessEqual(get_formula.cache_info().currsize, FORMULA_CACHE_SIZE)
+
+
+class TestBatchValues(TestCase):
+
+    def as_list(self, values):
+        return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+    def assert_batch_matches_scalar(self, utestid, raw_values):
+        quantifiers, values = utestid.values_with_quantifier(raw_values)
+        self.assertEquals(self.as_list(utestid.values(raw_values)), [utestid.value(v) for v in raw_values])
+        self.assertEquals(
+            list(zip(self.as_list(quantifiers), self.as_list(values))),
+            [utestid.value_with_quantifier(v) for v in raw_values])
+
+    def test_values_integer_with_limits(self):
+        utestid = Utestid.objects.create(
+            name='PMH',
+            value_type='absolute',
+            value_datatype='integer',
+            lower_limit=400,
+            upper_limit=750000)
+        self.assert_batch_matches_scalar(
+            utestid, [0, 398.5, 399, 399.5, 400, 400.5, 401, 1000, 749999.5, 750000, 750000.5, 750001, 1e7])
+        quantifiers, values = utestid.values_with_quantifier([399, 400, 750000, 750001])
+        self.assertEquals(self.as_list(quantifiers), ['<', '=', '=', '>'])
+        self.assertEquals(self.as_list(values), [400, 400, 750000, 750000])
+
+    def test_values_decimal(self):
+        utestid = Utestid.objects.create(
+            name='PMHD',
+            value_type='absolute',
+            value_datatype='decimal',
+            precision=2,
+            lower_limit=Decimal('0.3'),
+            upper_limit=Decimal('99.995'))
+        self.assert_batch_matches_scalar(
+            utestid, [0.125, 0.285, 0.29, 0.3, 0.305, 1.005, 2.675, 5.015, 99.994, 99.995, 99.996, '10.555'])
+
+    def test_values_calculated(self):
+        utestid = Utestid.objects.create(
+            name='PMHLOG',
+            value_type='calculated',
+            value_datatype='decimal',
+            precision=2,
+            formula='LOG10')
+        self.assert_batch_matches_scalar(utestid, [1, 10, 399, 400, 750000, 750001, '1000'])
+        self.assertRaises(ValueError, utestid.values, [10, 0])
+
+    def test_values_string_and_no_upper_limit(self):
+        utestid = Utestid.objects.create(
+            name='ELISA',
+            value_type='absolute',
+            value_datatype='string',
+            lower_limit=1)
+        self.assert_batch_matches_scalar(utestid, ['POS', 'NEG', '0'])
+        utestid = Utestid.objects.create(
+            name='PMH',
+            value_type='absolute',
+            value_datatype='integer',
+            lower_limit=400)
+        self.assert_batch_matches_scalar(utestid, [1, 400, 10000000])
+
+    def test_values_not_finite(self):
+        utestid = Utestid.objects.create(
+            name='PMHD',
+            value_type='absolute',
+            value_datatype='decimal',
+            precision=2)
+        for raw_value in ['nan', float('inf'), '-inf']:
+            self.assertRaises(ValueError, utestid.value, raw_value)
+            self.assertRaises(ValueError, utestid.values, [1, raw_value])
+            self.assertRaises(ValueError, UtestidSpec.from_utestid(utestid).value, raw_value)
+        utestid.value_datatype = 'integer'
+        self.assertRaises(ValueError, utestid.value, 'inf')
+        self.assertRaises(ValueError, utestid.values, ['inf'])
+
+
+class TestCatalog(TestCase):
+
+    def setUp(self):
+        ConfigureOrder()
+        catalog.clear()
+
+    def test_catalog_loads_once(self):
+        with self.assertNumQueries(2):
+            order_panel_items = catalog.panel_items('VL')
+        self.assertEquals(
+            sorted(order_panel_item.utestid.name for order_panel_item in order_panel_items), ['PHM', 'PHMLOG10'])
+        with self.assertNumQueries(0):
+            self.assertEquals(len(catalog.panel_utestids('CD4')), 4)
+            self.assertEquals(catalog.utestid('PHMLOG10').formula, 'LOG10')
+            self.assertEquals(str(order_panel_items[0]), 'PHM: VL')
+            self.assertEquals(catalog.panel_items('XXX'), ())
+
+    def test_catalog_invalidated_on_change(self):
+        self.assertEquals(catalog.utestid('PHM').precision, 0)
+        version = catalog.version
+        utestid = Utestid.objects.get(name='PHM')
+        utestid.precision = 1
+        utestid.save()
+        self.assertFalse(catalog.loaded)
+        self.assertEquals(catalog.utestid('PHM').precision, 1)
+        self.assertGreater(catalog.version, version)
+        OrderPanelItem.objects.get(order_panel__name='VL', utestid__name='PHM').delete()
+        self.assertEquals([item.utestid.name for item in catalog.panel_items('VL')], ['PHMLOG10'])
+
+    def test_catalog_is_stale_after_change_elsewhere(self):
+        catalog.load()
+        self.assertFalse(catalog.is_stale())
+        CatalogVersion.objects.filter(name=catalog.name).update(version=catalog.version + 1)
+        self.assertTrue(catalog.is_stale())
+        catalog.refresh_if_stale()
+        self.assertFalse(catalog.loaded)
+
+
+class TestConfigure(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.utestid_file = os.path.join(self.tmpdir, 'utestids.csv')
+        self.order_panel_file = os.path.join(self.tmpdir, 'order_panels.csv')
+        shutil.copy(os.path.join(settings.BASE_DIR, 'testdata/utestids.csv'), self.utestid_file)
+        shutil.copy(os.path.join(settings.BASE_DIR, 'testdata/order_panels.csv'), self.order_panel_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def configure(self, force=False):
+        return ConfigureOrder(self.utestid_file, self.order_panel_file, force=force)
+
+    def replace_in_file(self, filename, old, new):
+        with open(filename) as f:
+            content = f.read()
+        with open(filename, 'w') as f:
+            f.write(content.replace(old, new))
+
+    def test_load_all_creates_catalog(self):
+        configure = self.configure()
+        self.assertEquals(configure.summary['utestid'], LoadSummary(6, 0, 0, 0, 0))
+        self.assertEquals(configure.summary['order_panel'], LoadSummary(2, 0, 0, 0, 0))
+        self.assertEquals(configure.summary['order_panel_item'], LoadSummary(6, 0, 0, 0, 0))
+        self.assertEquals(Utestid.objects.count(), 6)
+        self.assertEquals(Utestid.history.count(), 6)
+        self.assertEquals(OrderPanelItem.objects.filter(order_panel__name='VL').count(), 2)
+        self.assertEquals(Utestid.objects.get(name='PHM').lower_limit, 400)
+
+    def test_load_all_skips_unchanged_files(self):
+        configure = self.configure()
+        with self.assertNumQueries(2):
+            summary = configure.load_all()
+        self.assertEquals(summary, {})
+        self.assertEquals(configure.skipped, ['utestid', 'order_panel'])
+
+    def test_load_all_forced_is_unchanged(self):
+        configure = self.configure()
+        summary = configure.load_all(force=True)
+        self.assertEquals(summary['utestid'], LoadSummary(0, 0, 0, 6, 0))
+        self.assertEquals(summary['order_panel'], LoadSummary(0, 0, 0, 2, 0))
+        self.assertEquals(summary['order_panel_item'], LoadSummary(0, 0, 0, 6, 0))
+
+    def test_load_all_applies_changed_rows(self):
+        configure = self.configure()
+        self.replace_in_file(
+            self.utestid_file, 'PHM,Viral Load,absolute,integer,400,', 'PHM,Viral Load,absolute,integer,40,')
+        with open(self.utestid_file, 'a') as f:
+            f.write('CD3,CD3 Absolute,absolute,integer,,,,,\n')
+        self.replace_in_file(self.order_panel_file, 'CD4,CD8%\n', 'CD4,CD3\n')
+        summary = configure.load_all()
+        self.assertEquals(summary['utestid'], LoadSummary(1, 1, 0, 5, 0))
+        self.assertEquals(summary['order_panel_item'], LoadSummary(1, 0, 1, 5, 0))
+        self.assertEquals(Utestid.objects.get(name='PHM').lower_limit, 40)
+        self.assertEquals(
+            sorted(OrderPanelItem.objects.filter(order_panel__name='CD4').values_list('utestid__name', flat=True)),
+            ['CD3', 'CD4', 'CD4%', 'CD8'])
+        self.assertEquals(self.configure().skipped, ['utestid', 'order_panel'])
+
+    def test_load_all_reports_conflicts(self):
+        self.replace_in_file(self.order_panel_file, 'VL,PHM\n', 'VL,PHM\nVL,XXX\n')
+        configure = self.configure()
+        self.assertEquals(configure.summary['order_panel_item'], LoadSummary(6, 0, 0, 0, 1))
+
+
+def create_aliquots(aliquot_identifiers):
+    return [Aliquot.objects.create(aliquot_identifier=aliquot_identifier) for aliquot_identifier in aliquot_identifiers]
+
+
+class TestManifest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        OrderPanel.objects.create(name='CD4')
+        OrderPanel.objects.create(name='VL')
+        create_aliquots(['A{:04d}'.format(n) for n in range(1, 7)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_manifest(self, name, lines):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return filename
+
+    def csv_manifest(self):
+        return self.write_manifest('manifest.csv', [
+            'requisition_identifier,subject_identifier,specimen_identifier,specimen_type,requisition_datetime,panels',
+            'R0001,S01,A0001,WB,2015-09-01T10:00:00,CD4;VL',
+            'R0002,S02,A0002,WB,,VL',
+            'R0003,S03,MISSING,WB,,VL',
+            'R0004,S04,A0004,WB,,XXX',
+            'R0005,S05,A0005,WB,not a date,VL',
+            'R0006,S06,A0006,WB,,CD4'])
+
+    def test_import_csv_manifest(self):
+        importer = ManifestImporter(self.csv_manifest(), chunk_size=2)
+        summary = importer.import_manifest()
+        self.assertEquals(summary.rows, 6)
+        self.assertEquals(summary.requisitions, 3)
+        self.assertEquals(summary.orders, 4)
+        self.assertEquals(summary.errors, 3)
+        self.assertEquals([line_number for line_number, _ in importer.errors], [4, 5, 6])
+        self.assertEquals(
+            sorted(Requisition.objects.get(requisition_identifier='R0001').tests.values_list('name', flat=True)),
+            ['CD4', 'VL'])
+        self.assertEquals(Order.objects.filter(aliquot__aliquot_identifier='A0001').count(), 2)
+        self.assertTrue(ManifestCheckpoint.objects.get().complete)
+
+    def test_import_manifest_resumes_from_checkpoint(self):
+        filename = self.csv_manifest()
+        importer = ManifestImporter(filename, chunk_size=2)
+        ManifestCheckpoint.objects.create(checksum=importer.checksum(), filename=filename, line_number=5)
+        summary = importer.import_manifest()
+        self.assertEquals(summary.skipped, 5)
+        self.assertEquals(summary.rows, 2)
+        self.assertEquals(
+            list(Requisition.objects.values_list('requisition_identifier', flat=True)), ['R0006'])
+        self.assertEquals(ManifestImporter(filename).import_manifest().rows, 0)
+
+    def test_import_manifest_reports_existing_requisitions(self):
+        filename = self.csv_manifest()
+        ManifestImporter(filename).import_manifest()
+        importer = ManifestImporter(filename)
+        summary = importer.import_manifest(restart=True)
+        self.assertEquals(summary.requisitions, 0)
+        self.assertEquals(summary.errors, 6)
+        self.assertEquals(Requisition.objects.count(), 3)
+        self.assertEquals(Order.objects.count(), 4)
+
+    def test_import_ndjson_manifest_with_error_file(self):
+        filename = self.write_manifest('manifest.ndjson', [
+            '{"requisition_identifier": "R0001", "subject_identifier": "S01", '
+            '"specimen_identifier": "A0001", "panels": ["CD4", "VL"]}',
+            'not json',
+            '{"requisition_identifier": "R0002", "subject_identifier": "S02", '
+            '"specimen_identifier": "S0002", "aliquot_identifier": "A0002", "panels": "VL"}'])
+        error_file = os.path.join(self.tmpdir, 'errors.csv')
+        summary = ManifestImporter(filename, error_file=error_file).import_manifest()
+        self.assertEquals((summary.rows, summary.requisitions, summary.orders, summary.errors), (3, 2, 3, 1))
+        self.assertEquals(Order.objects.filter(aliquot__aliquot_identifier='A0002').count(), 1)
+        with open(error_file) as f:
+            self.assertEquals([line.split(',')[0] for line in f.read().splitlines()], ['line_number', '2'])
+
+    def test_import_ndjson_manifest_with_numbers(self):
+        filename = self.write_manifest('manifest.ndjson', [
+            '{"requisition_identifier": 1, "subject_identifier": 123, "specimen_identifier": "A0001", "panels": "VL"}',
+            '{"requisition_identifier": "R0002", "subject_identifier": "S02", "specimen_identifier": "A0002", '
+            '"panels": 5}'])
+        importer = ManifestImporter(filename)
+        summary = importer.import_manifest()
+        self.assertEquals((summary.rows, summary.requisitions, summary.errors), (2, 1, 1))
+        self.assertEquals(Requisition.objects.get(requisition_identifier='1').subject_identifier, '123')
+        self.assertEquals(importer.errors, [(2, 'Invalid order panel. Got 5')])
+
+    def test_import_manifest_resolves_aliquots_with_one_query_per_chunk(self):
+        with CaptureQueriesContext(connection) as context:
+            summary = ManifestImporter(self.csv_manifest(), chunk_size=3).import_manifest()
+        aliquot_queries = [query for query in context.captured_queries if 'getresults_aliquot' in query['sql']]
+        self.assertEquals(len(aliquot_queries), 2)
+        self.assertEquals((summary.requisitions, summary.orders), (3, 4))
+        self.assertEquals(
+            sorted(Order.objects.values_list('aliquot__aliquot_identifier', 'order_panel__name')),
+            [('A0001', 'CD4'), ('A0001', 'VL'), ('A0002', 'VL'), ('A0006', 'CD4')])
+
+
+class TestOrderFanout(TestCase):
+
+    def setUp(self):
+        self.order_panels = [OrderPanel.objects.create(name='CD4'), OrderPanel.objects.create(name='VL')]
+
+    def create_requisitions(self, start, count, specimen_identifier='A{:04d}'):
+        if specimen_identifier != 'MISSING':
+            create_aliquots([specimen_identifier.format(n) for n in range(start, start + count)])
+        for n in range(start, start + count):
+            requisition = Requisition.objects.create(
+                requisition_identifier='R{:04d}'.format(n), subject_identifier='S{:04d}'.format(n),
+                specimen_identifier=specimen_identifier.format(n), specimen_type='WB')
+            requisition.tests.add(*self.order_panels)
+
+    def test_fan_out_creates_an_order_per_panel(self):
+        self.create_requisitions(0, 3)
+        self.create_requisitions(3, 1, specimen_identifier='MISSING')
+        summary = OrderFanout().fan_out(Requisition.objects.all())
+        self.assertEquals(len(summary.orders), 6)
+        self.assertEquals(summary.existing, 0)
+        self.assertEquals(summary.missing, ['R0003'])
+        self.assertEquals(
+            sorted(Order.objects.filter(aliquot_identifier='A0001').values_list('order_panel__name', flat=True)),
+            ['CD4', 'VL'])
+
+    def test_fan_out_is_idempotent(self):
+        self.create_requisitions(0, 3)
+        OrderFanout(batch_size=2).fan_out(Requisition.objects.all())
+        summary = OrderFanout(batch_size=2).fan_out(list(Requisition.objects.all()))
+        self.assertEquals(summary.orders, [])
+        self.assertEquals(summary.existing, 6)
+        self.assertEquals(Order.objects.count(), 6)
+
+    def test_fan_out_replaces_cancelled_orders(self):
+        self.create_requisitions(0, 1)
+        orders = OrderFanout().fan_out(Requisition.objects.all()).orders
+        Order.objects.transition(orders[:1], 'CANCELLED')
+        summary = OrderFanout().fan_out(Requisition.objects.all())
+        self.assertEquals([(order.aliquot_identifier, order.order_panel) for order in summary.orders],
+                          [(orders[0].aliquot_identifier, orders[0].order_panel)])
+        self.assertEquals(summary.existing, 1)
+        self.assertEquals(Order.objects.exclude(status='CANCELLED').count(), 2)
+
+    def test_fan_out_queries_per_batch_are_constant(self):
+        reserve_order_identifiers(1)
+        self.create_requisitions(0, 2)
+        with CaptureQueriesContext(connection) as small_batch:
+            OrderFanout().fan_out(Requisition.objects.all())
+        self.create_requisitions(2, 20)
+        with CaptureQueriesContext(connection) as large_batch:
+            summary = OrderFanout().fan_out(Requisition.objects.all())
+        self.assertEquals(len(summary.orders), 40)
+        self.assertEquals(len(large_batch), len(small_batch))
+
+    def test_fan_out_resolves_aliquots_with_one_query_per_batch(self):
+        self.create_requisitions(0, 4)
+        self.create_requisitions(4, 1, specimen_identifier='MISSING')
+        with CaptureQueriesContext(connection) as context:
+            summary = OrderFanout(batch_size=3).fan_out(Requisition.objects.all())
+        aliquot_queries = [query for query in context.captured_queries if 'getresults_aliquot' in query['sql']]
+        self.assertEquals(len(aliquot_queries), 2)
+        self.assertEquals((len(summary.orders), summary.missing), (8, ['R0004']))
+        self.assertEquals(Order.objects.filter(aliquot__aliquot_identifier='A0003').count(), 2)
+
+
+class TestOrderSave(TestCase):
+
+    def setUp(self):
+        self.order_panel = OrderPanel.objects.create(name='panel1')
+        reserve_order_identifiers(1)
+
+    def test_order_save_is_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            order = DummyOrder.objects.create(aliquot_identifier='12345678', order_panel=self.order_panel)
+        order_statements = [
+            query['sql'].split()[0] for query in queries.captured_queries
+            if DummyOrder._meta.db_table in query['sql']]
+        self.assertEquals(order_statements, ['INSERT'])
+        self.assertTrue(re.match(r'^[A-Z]{3}[0-9]{5}$', order.order_identifier))
+
+    @override_settings(ORDER_IDENTIFIER_SCHEME='node', ORDER_IDENTIFIER_NODE_PREFIX='N1')
+    def test_order_save_node_scheme_is_one_query(self):
+        with self.assertNumQueries(1):
+            DummyOrder.objects.create(aliquot_identifier='12345678', order_panel=self.order_panel)
+
+    def test_order_create_with_aliquot(self):
+        aliquot = create_aliquots(['A0001'])[0]
+        # savepoint, sequence update and select, release, order insert and history insert
+        with self.assertNumQueries(6):
+            order = Order.objects.create(aliquot=aliquot, order_panel=self.order_panel)
+        self.assertEquals(order.aliquot_identifier, 'A0001')
+
+
+class TestWorklist(TestCase):
+
+    def setUp(self):
+        self.order_panel = OrderPanel.objects.create(name='CD4')
+        other_panel = OrderPanel.objects.create(name='VL')
+        order_datetime = timezone.now() - timedelta(days=1)
+        create_aliquots(['A{:04d}'.format(n) for n in range(7)] + ['A0100', 'A0101'])
+        orders = [Order(aliquot_identifier='A{:04d}'.format(n), order_panel=self.order_panel,
+                        order_datetime=order_datetime + timedelta(minutes=n // 2)) for n in range(7)]
+        orders.append(Order(aliquot_identifier='A0100', order_panel=other_panel))
+        orders.append(Order(aliquot_identifier='A0101', order_panel=self.order_panel, status='COMPLETE'))
+        Order.objects.bulk_create_orders(orders)
+
+    def test_worklist_pages_by_cursor(self):
+        pages, cursor = [], None
+        while True:
+            orders, cursor = Order.objects.worklist(self.order_panel, cursor=cursor, limit=3)
+            pages.append([order.aliquot_identifier for order in orders])
+            if not cursor:
+                break
+        self.assertEquals([len(page) for page in pages], [3, 3, 1])
+        aliquot_identifiers = sum(pages, [])
+        self.assertEquals(sorted(aliquot_identifiers), ['A{:04d}'.format(n) for n in range(7)])
+        order_datetimes = [
+            Order.objects.get(aliquot_identifier=identifier).order_datetime for identifier in aliquot_identifiers]
+        self.assertEquals(order_datetimes, sorted(order_datetimes))
+        self.assertRaises(ValueError, Order.objects.worklist, self.order_panel, cursor='xxx')
+
+    def test_claim_does_not_claim_twice(self):
+        first = Order.objects.claim(self.order_panel, 'analyser1', 4)
+        second = Order.objects.claim(self.order_panel, 'analyser2', 4)
+        self.assertEquals(len(first), 4)
+        self.assertEquals(len(second), 3)
+        self.assertFalse(set(order.pk for order in first) & set(order.pk for order in second))
+        self.assertEquals(Order.objects.claim(self.order_panel, 'analyser3', 4), [])
+        self.assertEquals(len(Order.objects.release_claims('analyser1')), 4)
+        self.assertEquals(len(Order.objects.claim(self.order_panel, 'analyser3', 10)), 4)
+
+    def test_worklist_view(self):
+        user = User.objects.create_user('analyser1', password='password')
+        request = RequestFactory().get('/worklist/', {'order_panel': 'CD4', 'limit': 5})
+        request.user = user
+        response = WorklistView.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content.decode())
+        self.assertEquals(len(data['orders']), 5)
+        self.assertTrue(data['next_cursor'])
+        request = RequestFactory().post('/worklist/', {'order_panel': 'CD4', 'count': 2})
+        request.user = user
+        data = json.loads(WorklistView.as_view()(request).content.decode())
+        self.assertEquals([order['claimed_by'] for order in data['orders']], ['analyser1', 'analyser1'])
+
+    def test_worklist_view_rejects_counts_below_one(self):
+        user = User.objects.create_user('analyser1', password='password')
+        for request in [RequestFactory().get('/worklist/', {'order_panel': 'CD4', 'limit': -1}),
+                        RequestFactory().get('/worklist/', {'order_panel': 'CD4', 'limit': 'x'}),
+                        RequestFactory().post('/worklist/', {'order_panel': 'CD4', 'count': -2}),
+                        RequestFactory().post('/worklist/', {'order_panel': 'CD4', 'count': '0'})]:
+            request.user = user
+            self.assertEquals(WorklistView.as_view()(request).status_code, 400)
+        self.assertFalse(Order.objects.filter(claimed_by__isnull=False).exists())
+
+
+class TestOrderExport(TestCase):
+
+    def setUp(self):
+        cd4 = OrderPanel.objects.create(name='CD4')
+        vl = OrderPanel.objects.create(name='VL')
+        create_aliquots(['A{:04d}'.format(n) for n in range(5)])
+        self.orders = Order.objects.bulk_create_orders(
+            [Order(aliquot_identifier='A{:04d}'.format(n), order_panel=cd4 if n % 2 else vl,
+                   order_datetime=timezone.make_aware(datetime(2015, 9, 1 + n, 10, 0)))
+             for n in range(5)])
+
+    def test_export_csv(self):
+        export = OrderExport(chunk_size=2)
+        # one query per chunk of 2 rows
+        with self.assertNumQueries(3):
+            chunks = list(export)
+        self.assertEquals(len(chunks), 4)
+        lines = ''.join(chunks).splitlines()
+        self.assertEquals(lines[0], 'order_identifier,order_datetime,order_panel,aliquot_identifier,status')
+        self.assertEquals(len(lines), 6)
+        self.assertEquals(lines[1].split(',')[2:], ['VL', 'A0000', 'PENDING'])
+        self.assertEquals(export.rows, 5)
+
+    def test_export_ndjson_with_filters(self):
+        export = OrderExport(file_format='ndjson', start='2015-09-02', end='2015-09-04', order_panel='CD4')
+        rows = [json.loads(line) for line in ''.join(export).splitlines()]
+        self.assertEquals([row['aliquot_identifier'] for row in rows], ['A0001', 'A0003'])
+        self.assertEquals(rows[0]['order_panel'], 'CD4')
+        self.assertEquals(list(OrderExport(status='COMPLETE').queryset()), [])
+        self.assertRaises(ValueError, OrderExport, start='not a date')
+        self.assertRaises(ValueError, OrderExport, file_format='xml')
+
+    def test_export_view_streams(self):
+        request = RequestFactory().get('/export/orders/', {'format': 'csv', 'order_panel': 'VL'})
+        request.user = User.objects.create_user('user1', password='password')
+        response = OrderExportView.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEquals(len(b''.join(response.streaming_content).decode().splitlines()), 4)
+
+
+class TestLargeTableAdmin(TestCase):
+
+    def setUp(self):
+        order_panel = OrderPanel.objects.create(name='CD4')
+        aliquot_identifiers = ['AB{:04d}'.format(n) for n in range(12)]
+        create_aliquots(aliquot_identifiers)
+        self.orders = Order.objects.bulk_create_orders(
+            [Order(aliquot_identifier=aliquot_identifier, order_panel=order_panel)
+             for aliquot_identifier in aliquot_identifiers])
+        self.model_admin = OrderAdmin(Order, admin_site)
+        self.request = RequestFactory().get('/')
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def search(self, search_term):
+        queryset, use_distinct = self.model_admin.get_search_results(
+            self.request, Order.objects.all(), search_term)
+        self.assertFalse(use_distinct)
+        return sorted(queryset.values_list('aliquot_identifier', flat=True))
+
+    def changelist(self, params):
+        request = RequestFactory().get('/', params)
+        request.user = self.user
+        with CaptureQueriesContext(connection) as queries:
+            response = self.model_admin.changelist_view(request).render()
+        return response.context_data['cl'], queries.captured_queries
+
+    def test_search_is_prefix_or_exact(self):
+        self.assertEquals(len(self.search('ab001')), 2)
+        self.assertEquals(self.search('B001'), [])
+        self.assertEquals(self.search(self.orders[3].order_identifier), ['AB0003'])
+        self.assertEquals(self.search(self.orders[3].order_identifier[:-1]), [])
+
+    def test_search_uses_index_friendly_lookups(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search('AB001')
+        self.assertNotIn('UPPER', queries.captured_queries[0]['sql'])
+
+    def test_changelist_status_filter(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(status='CANCELLED')
+        changelist, queries = self.changelist({'status': 'CANCELLED'})
+        self.assertIsInstance(changelist.paginator, EstimatedCountPaginator)
+        self.assertEquals([order.pk for order in changelist.result_list], [self.orders[0].pk])
+        self.assertFalse([query for query in queries if 'DISTINCT' in query['sql']])
+
+    def test_changelist_selects_order_panel(self):
+        changelist, queries = self.changelist({'q': 'ab000'})
+        self.assertEquals(changelist.result_count, 10)
+        with self.assertNumQueries(0):
+            self.assertEquals({order.order_panel.name for order in changelist.result_list}, {'CD4'})
+
+    def test_search_names_is_case_insensitive(self):
+        utestid = Utestid.objects.create(name='HIV', value_type='absolute', value_datatype='string')
+        for name in ['Viral Load', 'Elisa']:
+            OrderPanelItem.objects.create(order_panel=OrderPanel.objects.create(name=name), utestid=utestid)
+        model_admin = OrderPanelItemAdmin(OrderPanelItem, admin.site)
+
+        def search(search_term):
+            queryset, use_distinct = model_admin.get_search_results(
+                self.request, OrderPanelItem.objects.all(), search_term)
+            return sorted(queryset.values_list('order_panel__name', flat=True))
+        self.assertEquals(search('viral'), ['Viral Load'])
+        self.assertEquals(search('elisa'), ['Elisa'])
+        self.assertEquals(search('hiv'), ['Elisa', 'Viral Load'])
+        self.assertEquals(search('Load'), [])
+
+    def test_paginator_count_without_statistics_is_exact(self):
+        paginator = EstimatedCountPaginator(Order.objects.all(), 5)
+        self.assertEquals(paginator.count, 12)
+        self.assertEquals(paginator.num_pages, 3)
+        self.assertEquals(EstimatedCountPaginator(Order.objects.filter(aliquot_identifier='AB0001'), 5).count, 1)
+
+
+class TestUtestidSpec(TestCase):
+
+    def setUp(self):
+        ConfigureOrder()
+        catalog.clear()
+
+    def test_spec_matches_utestid(self):
+        raw_values = [0, 1, 399, 400, 750000, 750001, '12.3456', Decimal('7.555')]
+        for utestid in Utestid.objects.all():
+            spec = UtestidSpec.from_utestid(utestid)
+            for raw_value in raw_values:
+                try:
+                    expected = utestid.value_with_quantifier(raw_value)
+                except ValueError:
+                    self.assertRaises(ValueError, spec.value_with_quantifier, raw_value)
+                else:
+                    self.assertEquals(spec.value_with_quantifier(raw_value), expected)
+        utestid = Utestid.objects.get(name='PHM')
+        quantifiers, values = UtestidSpec.from_utestid(utestid).values_with_quantifier([399, 400, 750001])
+        self.assertEquals(list(zip(quantifiers, values)), [('<', 400), ('=', 400), ('>', 750000)])
+
+    def test_spec_is_immutable_and_picklable(self):
+        spec = UtestidSpec.from_utestid(Utestid.objects.get(name='PHMLOG10'))
+        self.assertRaises(AttributeError, setattr, spec, 'precision', 4)
+        self.assertFalse(hasattr(spec, '__dict__'))
+        spec.value(750000)
+        unpickled = pickle.loads(pickle.dumps(spec))
+        self.assertEquals(unpickled, spec)
+        self.assertEquals(unpickled.value(750000), spec.value(750000))
+
+    def test_spec_catalog_round_trip(self):
+        spec_catalog = catalog.spec_catalog()
+        blob = spec_catalog.dumps()
+        self.assertIsInstance(blob, bytes)
+        with self.assertNumQueries(0):
+            loaded = UtestidSpecCatalog.loads(blob)
+            self.assertEquals(loaded.version, spec_catalog.version)
+            self.assertEquals(
+                [spec.name for spec in loaded.panel_specs('VL')],
+                [utestid.name for utestid in catalog.panel_utestids('VL')])
+            self.assertEquals(loaded['PHM'], spec_catalog['PHM'])
+            self.assertEquals(loaded['PHM'].value_with_quantifier(399), ('<', 400))
+
+
+class TestFormattingPipeline(TestCase):
+
+    def setUp(self):
+        ConfigureOrder()
+        catalog.clear()
+        self.spec_catalog = catalog.spec_catalog()
+        self.records = [
+            ('AAA{:05d}'.format(n), ['PHM', 'PHMLOG10', 'CD4'][n % 3], [399, 750001, 1234, 0, 'abc'][n % 5])
+            for n in range(60)] + [('AAA99999', 'XXX', 1)]
+
+    def test_format_in_process(self):
+        results = list(FormattingPipeline(self.spec_catalog, min_pool_records=1000).format(self.records))
+        self.assertEquals([result[:3] for result in results], self.records)
+        self.assertEquals(results[0][3:], ('<', 400, None))
+        self.assertEquals(results[1][3:], ('=', 5.88, None))
+        self.assertEquals(results[3][3:], ('<', 400, None))
+        self.assertTrue(results[4].error.startswith('ValueError'))
+        self.assertEquals(results[4].quantifier, None)
+        self.assertTrue(results[13].error.startswith('ValueError'))
+        self.assertEquals(results[-1].error, 'Invalid utestid. Got XXX')
+        for result in results:
+            if not result.error:
+                spec = self.spec_catalog[result.utestid_name]
+                self.assertEquals((result.quantifier, result.value), spec.value_with_quantifier(result.raw_value))
+
+    def test_format_with_process_pool_is_deterministic(self):
+        expected = list(FormattingPipeline(self.spec_catalog, min_pool_records=1000).format(self.records))
+        pipeline = FormattingPipeline(
+            self.spec_catalog, max_workers=2, min_pool_records=0, chunk_size=7, window_size=25)
+        self.assertEquals(list(pipeline.format(iter(self.records))), expected)
+
+
+class TestIngestionServer(TestCase):
+
+    def setUp(self):
+        ConfigureOrder()
+        catalog.clear()
+        self.tmpdir = tempfile.mkdtemp()
+        create_aliquots(['A0001'])
+        self.order = Order.objects.create(aliquot_identifier='A0001', order_panel=OrderPanel.objects.get(name='VL'))
+        self.batches = []
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.tmpdir)
+
+    def message(self, utestid, value, order_identifier=None):
+        return json.dumps({
+            'order_identifier': order_identifier or self.order.order_identifier, 'utestid': utestid, 'value': value})
+
+    async def send(self, server, path, lines):
+        await server.start(path=path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        writer.write_eof()
+        response = await reader.read()
+        writer.close()
+        await server.close()
+        return response.decode('utf-8')
+
+    def test_ingest_formats_and_flushes_in_batches(self):
+        server = IngestionServer(self.batches.append, batch_size=2, flush_interval=10, use_executor=False)
+        lines = [
+            self.message('PHM', 399),
+            'not json',
+            self.message('PHM', 1000),
+            self.message('PHMLOG10', 750000),
+            self.message('CD4', 500),
+            self.message('PHM', 1000, order_identifier='XXX00000')]
+        response = self.loop.run_until_complete(self.send(server, os.path.join(self.tmpdir, 'ingest.sock'), lines))
+        self.assertEquals(response.splitlines()[0][:4], 'ERR ')
+        self.assertEquals([len(batch) for batch in self.batches], [2, 2, 1])
+        results = sum(self.batches, [])
+        self.assertEquals([(result.quantifier, result.value) for result in results[:3]],
+                          [('<', 400), ('=', 1000), ('=', 5.88)])
+        self.assertEquals(results[3].error, 'Invalid utestid for panel VL. Got CD4')
+        self.assertEquals(results[4].error, 'Invalid order identifier. Got XXX00000')
+        self.assertEquals(server.flushed, 5)
+
+    def test_ingest_reports_failed_batch_and_goes_on(self):
+        def writer(results):
+            self.batches.append(results)
+            if len(self.batches) == 1:
+                raise OperationalError('database is locked')
+        server = IngestionServer(writer, batch_size=2, flush_interval=10, use_executor=False)
+        lines = [self.message('PHM', 1000), self.message('PHM', 2000), self.message('PHM', 3000)]
+        with self.assertLogs('getresults_order.ingest', 'ERROR'):
+            self.loop.run_until_complete(self.send(server, os.path.join(self.tmpdir, 'ingest.sock'), lines))
+        self.assertEquals([len(batch) for batch in self.batches], [2, 2, 1])
+        self.assertEquals([result.error for result in self.batches[1]],
+                          ['Flush failed. OperationalError: database is locked'] * 2)
+        self.assertEquals(self.batches[2][0].value, 3000)
+        self.assertEquals((server.flushed, server.failed), (1, 2))
+
+
+class TestOrderIdentifierIndex(TestCase):
+
+    def setUp(self):
+        self.order_panel = OrderPanel.objects.create(name='CD4')
+        self.orders = DummyOrder.objects.bulk_create_orders(
+            [DummyOrder(aliquot_identifier='A{:04d}'.format(n), order_panel=self.order_panel) for n in range(20)])
+        self.node_order = DummyOrder.objects.create(
+            order_identifier=next(NodeOrderIdentifier('N1')), aliquot_identifier='A0100', order_panel=self.order_panel)
+        self.index = OrderIdentifierIndex(model=DummyOrder)
+
+    def test_index_is_built_with_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.orders[5].order_identifier in self.index)
+            self.assertTrue(self.node_order.order_identifier in self.index)
+            self.assertFalse('ZZZ99999' in self.index)
+            self.assertFalse('CALIBRATOR' in self.index)
+        self.assertEquals(len(self.index), 21)
+
+    def test_index_is_built_in_pages(self):
+        with mock.patch('getresults_order.order_index.REBUILD_CHUNK_SIZE', 8):
+            with self.assertNumQueries(3):
+                self.index.rebuild()
+        self.assertEquals(len(self.index), 21)
+        self.assertEquals(self.index.resolve([order.order_identifier for order in self.orders], fallback=False),
+                          set(order.order_identifier for order in self.orders))
+
+    def test_resolve_falls_back_to_database(self):
+        self.index.rebuild()
+        new_order = DummyOrder.objects.create(aliquot_identifier='A0200', order_panel=self.order_panel)
+        identifiers = [order.order_identifier for order in self.orders] + [
+            new_order.order_identifier, 'ZZZ99999', 'CALIBRATOR']
+        with self.assertNumQueries(1):
+            found = self.index.resolve(identifiers)
+        self.assertEquals(found, set(identifiers[:21]))
+        with self.assertNumQueries(0):
+            self.assertTrue(new_order.order_identifier in self.index)
+            self.assertEquals(self.index.resolve(identifiers[:21], fallback=False), set(identifiers[:21]))
+
+    def test_compact_keeps_identifiers(self):
+        self.index.rebuild()
+        self.index.add(['ZZZ00001', 'AAA00000', self.orders[0].order_identifier])
+        self.index.compact()
+        self.assertEquals(list(self.index.encoded), sorted(set(self.index.encoded)))
+        self.assertEquals((len(self.index.encoded), len(self.index.added)), (22, 0))
+        self.assertTrue('ZZZ00001' in self.index)
+        self.assertTrue(self.orders[0].order_identifier in self.index)
+
+    def test_compact_empty_index(self):
+        index = OrderIdentifierIndex(model=DummyOrder)
+        index.built = True
+        index.add(['AAA00002', 'AAA00001'])
+        index.compact()
+        self.assertEquals(len(index.encoded), 2)
+        self.assertTrue('AAA00001' in index)
+
+
+class TestOrderIdentifierIndexUpdates(TransactionTestCase):
+
+    def setUp(self):
+        order_identifier_index._model = DummyOrder
+        order_identifier_index.clear()
+
+    def tearDown(self):
+        order_identifier_index._model = None
+        order_identifier_index.clear()
+
+    def test_index_is_updated_on_commit(self):
+        order_panel = OrderPanel.objects.create(name='CD4')
+        order_identifier_index.rebuild()
+        orders = DummyOrder.objects.bulk_create_orders(
+            [DummyOrder(aliquot_identifier='A{:04d}'.format(n), order_panel=order_panel) for n in range(3)])
+        with self.assertNumQueries(0):
+            self.assertEquals(
+                order_identifier_index.resolve([order.order_identifier for order in orders], fallback=False),
+                set(order.order_identifier for order in orders))
+
+
+@override_settings(ORDER_READ_DATABASES=['replica'], ORDER_WRITE_DATABASE='default', ORDER_STICKY_SECONDS=60)
+class TestOrderReadReplicaRouter(SimpleTestCase):
+
+    def setUp(self):
+        self.router = OrderReadReplicaRouter()
+        router_local.last_write = None
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        self.assertEquals(self.router.db_for_read(Utestid), 'replica')
+        self.assertEquals(self.router.db_for_read(OrderPanelItem), None)
+        self.assertEquals(self.router.db_for_write(OrderPanelItem), None)
+        self.assertEquals(self.router.db_for_read(Order), 'replica')
+        self.assertEquals(self.router.db_for_write(Order), 'default')
+        self.assertEquals(self.router.db_for_read(Order), 'replica')
+
+    def test_reads_after_a_write_go_to_primary(self):
+        record_write_on_post_save(sender=OrderPanelItem)
+        self.assertEquals(self.router.db_for_read(Order), 'replica')
+        record_write_on_post_save(sender=Order)
+        self.assertEquals(self.router.db_for_read(Order), 'default')
+        with override_settings(ORDER_STICKY_SECONDS=0):
+            self.assertEquals(self.router.db_for_read(Order), 'replica')
+        router_local.last_write = None
+        record_write(DummyOrder)
+        self.assertEquals(self.router.db_for_read(Utestid), 'replica')
+        record_write(Utestid)
+        self.assertEquals(self.router.db_for_read(Utestid), 'default')
+
+    def test_record_write_receivers_are_connected_to_routed_models(self):
+        for model in [Order, OrderPanel, Utestid]:
+            self.assertIn(record_write_on_post_save, post_save._live_receivers(model))
+            self.assertIn(record_write_on_post_delete, post_delete._live_receivers(model))
+        self.assertNotIn(record_write_on_post_save, post_save._live_receivers(OrderPanelItem))
+        self.assertNotIn(record_write_on_post_delete, post_delete._live_receivers(OrderPanelItem))
+
+    def test_use_primary(self):
+        with override_settings(ORDER_STICKY_SECONDS=0):
+            with use_primary():
+                self.assertEquals(self.router.db_for_read(OrderPanel), 'default')
+            self.assertEquals(self.router.db_for_read(OrderPanel), 'replica')
+
+    def test_copy_sqlite_database(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            primary, replica = os.path.join(tmpdir, 'primary.sqlite3'), os.path.join(tmpdir, 'replica.sqlite3')
+            with sqlite3.connect(primary) as db:
+                db.execute('CREATE TABLE t (n INTEGER)')
+                db.execute('INSERT INTO t VALUES (1)')
+            copy_sqlite_database(primary, replica)
+            with sqlite3.connect(replica) as db:
+                self.assertEquals(db.execute('SELECT n FROM t').fetchall(), [(1, )])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class DummyOrderArchive(OrderArchive):
+
+    model = DummyOrder
+    archive_model = DummyArchivedOrder
+
+
+class TestOrderArchive(TestCase):
+
+    def setUp(self):
+        order_panel = OrderPanel.objects.create(name='CD4')
+        old = timezone.now() - timedelta(days=400)
+        self.orders = DummyOrder.objects.bulk_create_orders(
+            [DummyOrder(aliquot_identifier='A{:04d}'.format(n), order_panel=order_panel,
+                        status=['COMPLETE', 'CANCELLED', 'PENDING'][n % 3],
+                        order_datetime=old if n < 9 else timezone.now()) for n in range(12)])
+
+    def test_archive_moves_old_completed_orders_in_chunks(self):
+        archive = DummyOrderArchive(chunk_size=2)
+        self.assertEquals(archive.archive(days=365), 6)
+        self.assertEquals(DummyArchivedOrder.objects.count(), 6)
+        self.assertEquals(DummyOrder.objects.count(), 6)
+        self.assertEquals(set(DummyOrder.objects.values_list('status', flat=True)),
+                          set(['PENDING', 'COMPLETE', 'CANCELLED']))
+        self.assertFalse(DummyOrder.objects.filter(order_datetime__lt=timezone.now() - timedelta(days=365)).exclude(
+            status='PENDING').exists())
+        archived = DummyArchivedOrder.objects.get(order_identifier=self.orders[0].order_identifier)
+        self.assertEquals((archived.pk, archived.aliquot_identifier), (self.orders[0].pk, 'A0000'))
+        self.assertEquals(archive.archive(days=365), 0)
+
+    def test_archive_leaves_referenced_orders(self):
+        DummyOrderResult.objects.create(order=self.orders[0])
+        self.assertEquals(DummyOrderArchive().archive(days=365), 5)
+        self.assertTrue(DummyOrder.objects.filter(pk=self.orders[0].pk).exists())
+        self.assertEquals(DummyOrderResult.objects.get().order_id, self.orders[0].pk)
+        self.assertFalse(DummyArchivedOrder.objects.filter(pk=self.orders[0].pk).exists())
+
+    def test_unified_queries_include_archived(self):
+        archive = DummyOrderArchive()
+        archive.archive(days=365)
+        order_identifier = self.orders[0].order_identifier
+        self.assertEquals(archive.get(order_identifier).pk, self.orders[0].pk)
+        self.assertRaises(DummyOrder.DoesNotExist, archive.get, order_identifier, include_archived=False)
+        self.assertTrue(archive.exists(order_identifier))
+        self.assertEquals(len(list(archive.iterator(order_panel__name='CD4'))), 6)
+        self.assertEquals(len(list(archive.iterator(include_archived=True, order_panel__name='CD4'))), 12)
+
+    def test_highest_order_identifier_includes_archive(self):
+        highest = highest_order_identifier()
+        DummyOrderArchive().archive(
+            before=timezone.now() + timedelta(days=1), statuses=['PENDING', 'COMPLETE', 'CANCELLED'])
+        self.assertEquals(DummyOrder.objects.count(), 0)
+        self.assertEquals(highest_order_identifier(), highest)
+
+    def test_archived_identifier_cannot_be_reused(self):
+        order_identifier, order_panel = 'ZZZ00001', self.orders[0].order_panel
+        ArchivedOrder.objects.create(
+            order_identifier=order_identifier, aliquot_identifier='A0000', order_panel=order_panel)
+        self.assertRaises(
+            ValueError, DummyOrder.objects.create, order_identifier=order_identifier, aliquot_identifier='A0000',
+            order_panel=order_panel)
+        self.assertRaises(
+            ValueError, DummyOrder.objects.bulk_create_orders,
+            [DummyOrder(order_identifier=order_identifier, aliquot_identifier='A0000', order_panel=order_panel)])
+
+    def test_issued_identifiers_are_not_checked(self):
+        order_panel = self.orders[0].order_panel
+        with CaptureQueriesContext(connection) as context:
+            DummyOrder.objects.create(aliquot_identifier='A0000', order_panel=order_panel)
+        self.assertFalse([query for query in context.captured_queries
+                          if ArchivedOrder._meta.db_table in query['sql']])
+
+
+class TestHistory(TransactionTestCase):
+
+    def test_deferred_history_writes_one_insert_per_history_model(self):
+        with CaptureQueriesContext(connection) as context:
+            with deferred_history():
+                for name in ['CD4', 'VL', 'PIMA']:
+                    OrderPanel.objects.create(name=name)
+                self.assertEquals(OrderPanel.history.count(), 0)
+        inserts = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('INSERT') and 'historicalorderpanel' in query['sql']]
+        self.assertEquals(len(inserts), 1)
+        self.assertEquals(OrderPanel.history.count(), 3)
+        OrderPanel.objects.create(name='ELISA')
+        self.assertEquals(OrderPanel.history.count(), 4)
+
+    def test_deferred_history_skips_rolled_back_changes(self):
+        with deferred_history():
+            OrderPanel.objects.create(name='CD4')
+            try:
+                with transaction.atomic():
+                    OrderPanel.objects.create(name='VL')
+                    raise ValueError()
+            except ValueError:
+                pass
+        self.assertEquals(list(OrderPanel.history.values_list('name', flat=True)), ['CD4'])
+
+    def test_deferred_history_is_written_in_the_transaction(self):
+        try:
+            with transaction.atomic():
+                with deferred_history() as deferred:
+                    OrderPanel.objects.create(name='CD4')
+                self.assertEquals((OrderPanel.history.count(), deferred.written), (1, 1))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEquals((OrderPanel.objects.count(), OrderPanel.history.count()), (0, 0))
+
+    def test_failed_history_write_rolls_back_the_changes(self):
+        with mock.patch('django.db.models.query.QuerySet.bulk_create', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                with deferred_history():
+                    OrderPanel.objects.create(name='CD4')
+        self.assertEquals((OrderPanel.objects.count(), OrderPanel.history.count()), (0, 0))
+
+    def test_compact_history_keeps_first_last_and_changes(self):
+        utestid = Utestid.objects.create(name='VL', value_type='absolute', value_datatype='decimal', precision=2)
+        for precision in [2, 2, 1, 1, 1, 2]:
+            utestid.precision = precision
+            utestid.save()
+        Utestid.history.update(history_date=timezone.now() - timedelta(days=400))
+        utestid.save()
+        self.assertEquals(compact_history(Utestid, timezone.now() - timedelta(days=365), fields=['precision']), 4)
+        self.assertEquals(
+            [(history.history_type, history.precision) for history in Utestid.history.order_by('history_id')],
+            [('+', 2), ('~', 1), ('~', 2), ('~', 2)])
+        self.assertEquals(compact_history(Utestid, timezone.now() - timedelta(days=365), fields=['precision']), 0)
+
+
+class TestOrderStatistics(TransactionTestCase):
+
+    def setUp(self):
+        self.order_panel = OrderPanel.objects.create(name='CD4')
+        self.today = order_date(timezone.now())
+        create_aliquots(['A{:04d}'.format(n) for n in range(5)])
+
+    def test_statistics_are_updated_on_commit(self):
+        with transaction.atomic():
+            orders = Order.objects.bulk_create_orders(
+                [Order(aliquot_identifier='A{:04d}'.format(n), order_panel=self.order_panel) for n in range(3)])
+            order = Order.objects.get(pk=orders[0].pk)
+            order.status = 'COMPLETE'
+            order.save()
+            Order.objects.create(aliquot_identifier='A0003', order_panel=self.order_panel)
+            self.assertEquals(order_statistics(), {})
+        self.assertEquals(order_statistics(), {('CD4', 'PENDING', self.today): 3, ('CD4', 'COMPLETE', self.today): 1})
+        self.assertEquals(OrderStatistic.objects.count(), 2)
+
+    def test_rolled_back_changes_are_not_counted(self):
+        with transaction.atomic():
+            Order.objects.create(aliquot_identifier='A0000', order_panel=self.order_panel)
+            try:
+                with transaction.atomic():
+                    Order.objects.create(aliquot_identifier='A0001', order_panel=self.order_panel)
+                    raise ValueError()
+            except ValueError:
+                pass
+        self.assertEquals(order_statistics(status='PENDING'), {('CD4', 'PENDING', self.today): 1})
+
+    def test_untracked_orders_are_not_counted(self):
+        DummyOrder.objects.bulk_create_orders([DummyOrder(aliquot_identifier='A0000', order_panel=self.order_panel)])
+        DummyOrder.objects.create(aliquot_identifier='A0001', order_panel=self.order_panel)
+        self.assertEquals(order_statistics(), {})
+
+    def test_transition_updates_statistics(self):
+        orders = Order.objects.bulk_create_orders(
+            [Order(aliquot_identifier='A{:04d}'.format(n), order_panel=self.order_panel) for n in range(3)])
+        Order.objects.transition(orders[:2], 'CANCELLED')
+        self.assertEquals(order_statistics(), {('CD4', 'PENDING', self.today): 1, ('CD4', 'CANCELLED', self.today): 2})
+
+    def test_archive_and_rebuild(self):
+        old = timezone.now() - timedelta(days=400)
+        Order.objects.bulk_create_orders(
+            [Order(aliquot_identifier='A{:04d}'.format(n), order_panel=self.order_panel, status='COMPLETE',
+                   order_datetime=old if n < 2 else timezone.now()) for n in range(5)])
+        OrderArchive().archive(days=365)
+        self.assertEquals(Order.history.filter(history_type='-').count(), 2)
+        expected = {('CD4', 'COMPLETE', self.today): 3}
+        self.assertEquals(order_statistics(start=self.today - timedelta(days=1)), expected)
+        OrderStatistic.objects.update(count=10)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEquals(rebuild_order_statistics(chunk_size=2), 1)
+        self.assertEquals(len([query for query in context.captured_queries
+                               if query['sql'].startswith('SELECT') and '"getresults_order"' in query['sql']]), 2)
+        self.assertEquals(order_statistics(), expected)
+
+    @override_settings(TIME_ZONE='UTC')
+    def test_order_date_ignores_the_active_time_zone(self):
+        order = Order.objects.create(
+            aliquot_identifier='A0000', order_panel=self.order_panel,
+            order_datetime=timezone.make_aware(datetime(2015, 7, 1, 23, 0), timezone.utc))
+        with timezone.override('Africa/Gaborone'):
+            self.assertEquals(order_date(order.order_datetime), datetime(2015, 7, 1).date())
+            Order.objects.transition([order], 'CANCELLED')
+        self.assertEquals(order_statistics(), {('CD4', 'CANCELLED', datetime(2015, 7, 1).date()): 1})
+
+
+class TestOrderForms(TestCase):
+
+    def setUp(self):
+        self.order_panel = OrderPanel.objects.create(name='CD4')
+
+    def form_data(self, aliquot_identifiers):
+        data = {'form-TOTAL_FORMS': str(len(aliquot_identifiers)), 'form-INITIAL_FORMS': '0',
+                'form-MIN_NUM_FORMS': '0', 'form-MAX_NUM_FORMS': '1000'}
+        for index, aliquot_identifier in enumerate(aliquot_identifiers):
+            data.update({
+                'form-{}-order_datetime'.format(index): '2015-07-01 10:00',
+                'form-{}-order_panel'.format(index): str(self.order_panel.pk),
+                'form-{}-aliquot_identifier'.format(index): aliquot_identifier,
+                'form-{}-status'.format(index): 'PENDING'})
+        return data
+
+    def test_order_form_invalid_aliquot(self):
+        form = OrderForm(data={
+            'order_datetime': '2015-07-01 10:00', 'order_panel': str(self.order_panel.pk),
+            'aliquot_identifier': 'A0000', 'status': 'PENDING'})
+        self.assertFalse(form.is_valid())
+        self.assertEquals(form.errors['aliquot_identifier'], ['Invalid Aliquot Identifier. Got A0000'])
+
+    def test_formset_resolves_aliquots_with_one_query(self):
+        formset = OrderFormSet(data=self.form_data(['A{:04d}'.format(n) for n in range(10)] + ['A0001']))
+        with CaptureQueriesContext(connection) as context:
+            self.assertFalse(formset.is_valid())
+        aliquot_queries = [query for query in context.captured_queries if 'getresults_aliquot' in query['sql']]
+        self.assertEquals(len(aliquot_queries), 1)
+        self.assertEquals(len([errors for errors in formset.errors if 'aliquot_identifier' in errors]), 11)
+        self.assertEquals(
+            formset.non_form_errors(),
+            ['Invalid Aliquot Identifiers. Got {}'.format(', '.join('A{:04d}'.format(n) for n in range(10)))])
+
+    def test_valid_formset_saves_without_looking_up_aliquots_again(self):
+        aliquots = create_aliquots(['A{:04d}'.format(n) for n in range(5)])
+        formset = OrderFormSet(data=self.form_data([aliquot.aliquot_identifier for aliquot in aliquots]))
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(formset.is_valid())
+            orders = formset.save()
+        aliquot_queries = [query for query in context.captured_queries if 'getresults_aliquot' in query['sql']]
+        self.assertEquals(len(aliquot_queries), 1)
+        self.assertEquals([order.aliquot for order in orders], aliquots)
+        self.assertEquals(Order.objects.count(), 5)
@@ -19,9 +19,13 @@ from django.contrib import admin
 from getresults.admin import admin_site
 from getresults import urls as getresults_urls
 
+from .views import OrderExportView, WorklistView
+
 admin.autodiscover()
 
 urlpatterns = [
     url(r'^admin/', include(admin_site.urls)),
+    url(r'^worklist/$', WorklistView.as_view(), name='worklist'),
+    url(r'^export/orders/$', OrderExportView.as_view(), name='order_export'),
     url(r'', include(getresults_urls)),
 ]
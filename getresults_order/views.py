@@ -0,0 +1,87 @@
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.generic import View
+
+from .export import OrderExport
+from .managers import WORKLIST_LIMIT
+from .models import Order, OrderPanel
+
+MAX_WORKLIST_LIMIT = 1000
+
+
+class WorklistView(View):
+    """Returns the pending orders of an order panel as JSON, a page at a time, and claims orders on POST.
+
+    GET ?order_panel=<name>&cursor=<next_cursor>&limit=<n> returns
+    {"orders": [...], "next_cursor": ...}. POST order_panel=<name>&count=<n>
+    claims up to n unclaimed orders for the user and returns {"orders": [...]}.
+    """
+
+    @method_decorator(login_required)
+    def dispatch(self, request, *args, **kwargs):
+        return super(WorklistView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        order_panel = self.get_order_panel(request.GET)
+        try:
+            limit = self.get_count(request.GET, 'limit', WORKLIST_LIMIT)
+            orders, next_cursor = Order.objects.worklist(order_panel, cursor=request.GET.get('cursor'), limit=limit)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        return JsonResponse({'orders': [self.order_as_dict(order) for order in orders], 'next_cursor': next_cursor})
+
+    def post(self, request, *args, **kwargs):
+        order_panel = self.get_order_panel(request.POST)
+        try:
+            count = self.get_count(request.POST, 'count', 1)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        orders = Order.objects.claim(order_panel, request.user.get_username(), count)
+        return JsonResponse({'orders': [self.order_as_dict(order) for order in orders]})
+
+    def get_count(self, params, name, default):
+        """Returns a parameter as a positive integer, at most MAX_WORKLIST_LIMIT; raises a ValueError if invalid."""
+        count = int(params.get(name) or default)
+        if count < 1:
+            raise ValueError('Invalid {}. Expected a positive integer. Got {}'.format(name, count))
+        return min(count, MAX_WORKLIST_LIMIT)
+
+    def get_order_panel(self, params):
+        try:
+            return OrderPanel.objects.get(name=params.get('order_panel'))
+        except OrderPanel.DoesNotExist:
+            raise Http404('Invalid order panel. Got {}'.format(params.get('order_panel')))
+
+    def order_as_dict(self, order):
+        return {
+            'order_identifier': order.order_identifier,
+            'aliquot_identifier': order.aliquot_identifier,
+            'order_datetime': order.order_datetime.isoformat(),
+            'status': order.status,
+            'claimed_by': order.claimed_by,
+        }
+
+
+class OrderExportView(View):
+    """Streams orders as CSV or NDJSON.
+
+    GET ?format=csv|ndjson&start=<date>&end=<date>&order_panel=<name>&status=<status>
+    """
+
+    export_class = OrderExport
+
+    @method_decorator(login_required)
+    def dispatch(self, request, *args, **kwargs):
+        return super(OrderExportView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            export = self.export_class(
+                file_format=request.GET.get('format'), start=request.GET.get('start'), end=request.GET.get('end'),
+                order_panel=request.GET.get('order_panel'), status=request.GET.get('status'))
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        response = StreamingHttpResponse(export, content_type=export.content_type)
+        response['Content-Disposition'] = 'attachment; filename="orders.{}"'.format(export.file_format)
+        return response